@@ -4,7 +4,7 @@ A chess game written in Python.
 """
 from typing import List, Dict, Tuple
 from src.util import draw_board, load_fen, coords_to_position, position_to_coords, input_valid_coords
-from src.moves import get_all_legal_moves, make_move, get_white_checks, get_black_checks
+from src.state import GameState
 
 Board = List[List[int]]
 Position = Tuple[int, int]
@@ -18,63 +18,34 @@ def console_game(fen='rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
     :param fen:
     :return:
     """
-    data = load_fen(fen)
-    board = data['board']
-    en_passant = data['en_passant']
-    turn = data['turn']  # 0 for white, 1 for black
-    castles = data['castles']
-
-    legal_moves_dict = get_all_legal_moves(board, turn, en_passant, castles)
+    state = GameState(load_fen(fen))
+    board = state.board
     while True:
         draw_board(board)
-        piece_tile = None
+        turn = state.turn  # 0 for white, 1 for black
+        legal_moves_dict = state.legal_moves
+        piece_pos = None
 
-        while not coords_to_position(piece_tile) in legal_moves_dict:
-            piece_tile = input(
+        while piece_pos not in legal_moves_dict:
+            piece_tile = input_valid_coords(
                 f'{"White" if turn == 0 else "Black"} turn\'s, choose a valid piece to move (e.g e{2 if turn == 0 else 7}):\n')
-        piece_pos = coords_to_position(piece_tile)
-        piece = board[piece_pos[0]][piece_pos[1]]
+            piece_pos = coords_to_position(piece_tile)
         legal_moves = legal_moves_dict[piece_pos]
 
         move_pos = None
-        while move_pos not in legal_moves:
+        while not state.is_legal((piece_pos, move_pos)):
             move_chosen = input_valid_coords(
                 f'Chose one of this tiles to move on:\n{" ".join(position_to_coords(move) for move in legal_moves)}\n')
             move_pos = coords_to_position(move_chosen)
 
-        # Checking castles
-        if (0, 0) == piece_pos or (0, 0) == move_pos:
-            castles['q'] = False
-        if (0, 7) == piece_pos or (0, 7) == move_pos:
-            castles['k'] = False
-        if (7, 0) == piece_pos or (7, 0) == move_pos:
-            castles['Q'] = False
-        if (7, 7) == piece_pos or (7, 7) == move_pos:
-            castles['K'] = False
-        if (0, 4) == piece_pos:
-            castles['q'], castles['k'] = False, False
-        if (7, 4) == piece_pos:
-            castles['Q'], castles['K'] = False, False
-
-        # Checking en-passant
-        en_passant = None
-        if piece == 1:
-            if piece_pos[0] == 6 and move_pos[0] == 4:
-                en_passant = (5, piece_pos[1])
-        if piece == 7:
-            if piece_pos[0] == 1 and move_pos[0] == 3:
-                en_passant = (2, piece_pos[1])
-
-        make_move(board, piece_pos, move_pos)
-        legal_moves_dict = get_all_legal_moves(board, 1 - turn, en_passant, castles)
-        if len(legal_moves_dict) == 0:
+        state.play(piece_pos, move_pos)
+        if len(state.legal_moves) == 0:
             draw_board(board)
-            if len(get_white_checks(board) if turn == 0 else get_black_checks(board)) == 0:
+            if not state.in_check:
                 print('Stalemate!')
             else:
                 print(f'{"White" if turn == 0 else "Black"} won by checkmate!')
             break
-        turn = 1 - turn
 
 
 def main(fen='rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'):
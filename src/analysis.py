@@ -0,0 +1,59 @@
+"""
+Analysis of a position, with its best lines
+"""
+import argparse
+from time import perf_counter
+from typing import List, Dict
+from src.util import position_to_coords
+from src.fen import parse_fen
+from src.bot import SearchConfig, search, new_stats, format_pv
+
+Analysis = Dict[str, int | float | List[Dict[str, str | float]]]
+
+
+def analyse(fen: str, dept: int, multipv: int = 1, time_limit: float = None, config: SearchConfig = None) -> Analysis:
+    """
+    Search the multipv best lines of a position, return something like
+    {
+        "dept": The last completed depth,
+        "lines": List of {"move": 'e2e4', "value", "pv": 'e2e4 e7e5 g1f3'}, from the best one,
+        "nodes": The number of searched nodes,
+        "time": In seconds
+    }
+
+    :param fen:
+    :param dept:
+    :param multipv:
+    :param time_limit: In seconds
+    :param config:
+    :return:
+    """
+    stats = new_stats()
+    start = perf_counter()
+    result = search(parse_fen(fen), dept, config, stats, time_limit, multipv=multipv)
+    return {
+        'dept': result['dept'],
+        'lines': [{'move': position_to_coords(line['move'][0]) + position_to_coords(line['move'][1]),
+                   'value': line['value'], 'pv': format_pv(line['pv'])} for line in result['multipv']],
+        'nodes': stats['nodes'],
+        'time': perf_counter() - start,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the best lines of a position')
+    parser.add_argument('fen')
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--multipv', type=int, default=3, help='Number of lines')
+    parser.add_argument('--time', type=float, default=None, help='Time limit, in seconds')
+    parser.add_argument('--compare', action='store_true', help='Also run a single line search, to compare the cost')
+    args = parser.parse_args()
+
+    analysis = analyse(args.fen, args.dept, args.multipv, args.time)
+    for rank, line in enumerate(analysis['lines'], 1):
+        print(f'{rank}. {line["move"]:<6} {line["value"]:>8.2f}  pv: {line["pv"]}')
+    print(f'dept {analysis["dept"]}, {analysis["nodes"]} nodes in {analysis["time"]:.2f}s')
+    if args.compare:
+        single = analyse(args.fen, args.dept, 1, args.time)
+        print(f'single line: {single["nodes"]} nodes in {single["time"]:.2f}s, '
+              f'{args.multipv} lines cost {analysis["time"] / single["time"]:.2f}x')
@@ -3,10 +3,13 @@ The pygame app of the chess game
 """
 import pygame
 import os
+import traceback
+from threading import Thread
 from time import sleep
 from src.util import pieces_ids
-from src.moves import get_all_legal_moves, make_move_smooth, get_black_checks, get_white_checks
-from src.bot import create_decision_tree, minimax, minimax_root
+from src.state import GameState
+from src.bot import create_decision_tree, minimax, search, new_stats
+from src.hud import StatsChannel, Hud
 from typing import List, Dict, Tuple
 
 Board = List[List[int]]
@@ -40,12 +43,13 @@ class App:
         pygame.draw.circle(self.point, (0, 0, 0, 100), (self.tile_width / 2, self.tile_height / 2), self.tile_width / 5)
         self.hand_grab_cursor = pygame.cursors.load_xbm('./assets/cursor-hand-grab.xbm', './assets/cursor-hand-grab.xbm')
 
-        self.board = game_data['board']
-        self.en_passant = game_data['en_passant']
-        self.turn = game_data['turn']  # 0 for white, 1 for black
-        self.castles = game_data['castles']
+        self.state = GameState(game_data, kwargs.get('debug', False))
+        self.board = self.state.board
+        self.en_passant = self.state.en_passant
+        self.turn = self.state.turn  # 0 for white, 1 for black
+        self.castles = self.state.castles
 
-        self.all_legal_moves = get_all_legal_moves(self.board, self.turn, self.en_passant, self.castles)
+        self.all_legal_moves = self.state.legal_moves
         self.legal_moves, self.selected_piece, self.drag_piece = [], None, False
 
         self.assets = {}
@@ -55,6 +59,13 @@ class App:
         for file in os.scandir('./assets/black'):
             self.assets[pieces_ids[file.name[0]]] = pygame.transform.scale(
                 pygame.image.load(f'./assets/black/{file.name}'), (self.width / 8, self.height / 8))
+
+        # The bot searches in its own thread, publishing its progress to the overlay, toggled with the H key
+        self.bot_dept, self.bot_time = kwargs.get('bot_dept', 4), kwargs.get('bot_time', None)
+        self.bot_thread, self.bot_result = None, None
+        self.channel = StatsChannel()
+        self.hud = Hud(self.channel, (self.width, self.height), (self.tile_width, self.tile_height))
+        self.show_hud = kwargs.get('hud', False)
         self.update()
 
         self.players_bot = [False, False]
@@ -79,6 +90,8 @@ class App:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     pygame.quit()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                    self.show_hud = not self.show_hud
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     x, y = pygame.mouse.get_pos()
                     j, i = x // self.tile_width, y // self.tile_height
@@ -104,6 +117,17 @@ class App:
                         else:
                             self.legal_moves, self.selected_piece, self.drag_piece = [], None, False
 
+            # Playing the move of the bot once its search is done
+            if self.bot_thread is not None and not self.bot_thread.is_alive():
+                self.bot_thread = None
+                if self.bot_result is None or self.bot_result['move'] is None:
+                    print(f'The {"white" if self.turn == 0 else "black"} bot failed to find a move')
+                else:
+                    pos1, pos2 = self.bot_result['move']
+                    if self.play_move(pos1, pos2):
+                        if self.players_bot[self.turn]:
+                            self.bot_play()
+
             # Update
             self.update()
 
@@ -131,6 +155,8 @@ class App:
             self.screen.blit(self.assets[self.board[self.selected_piece[0]][self.selected_piece[1]]], (x - self.tile_width / 2, y - self.tile_height / 2))
         else:
             pygame.mouse.set_cursor(pygame.SYSTEM_CURSOR_ARROW)
+        if self.show_hud:
+            self.hud.draw(self.screen)
         pygame.display.update()
 
     def on_click(self, event: pygame.event.Event):
@@ -169,20 +195,34 @@ class App:
 
     def bot_play(self):
         """
-        A bot play a turn!
+        A bot play a turn! It searches in another thread, its move is played by run once it is done
 
         :return:
         """
-        pos1, pos2 = minimax_root({
+        stats = new_stats()
+        stats['channel'] = self.channel
+        self.bot_result = None
+        self.bot_thread = Thread(target=self.bot_search, args=({
             "board": self.board,
             "castles": self.castles,
             "en_passant": self.en_passant,
             "turn": self.turn
-        }, 4)
+        }, stats), daemon=True)
+        self.bot_thread.start()
 
-        if self.play_move(pos1, pos2):
-            if self.players_bot[self.turn]:
-                self.bot_play()
+    def bot_search(self, game_data: GameData, stats):
+        """
+        The search of the bot thread, its result is read by run, it stays None if the search fails
+
+        :param game_data:
+        :param stats:
+        :return:
+        """
+        try:
+            self.bot_result = search(game_data, self.bot_dept, stats=stats, time_limit=self.bot_time)
+        except Exception:
+            traceback.print_exc()
+            self.channel.publish(searching=False)
 
     def play_move(self, pos1, pos2):
         """
@@ -191,15 +231,15 @@ class App:
 
         :return:
         """
-        data = make_move_smooth(self.board, pos1, pos2, self.en_passant, self.castles)
-        self.castles = data['castles']
-        self.en_passant = data['en_passant']
+        self.state.play(pos1, pos2)
+        self.castles = self.state.castles
+        self.en_passant = self.state.en_passant
 
-        self.turn = 1 - self.turn
-        self.all_legal_moves = get_all_legal_moves(self.board, self.turn, self.en_passant, self.castles)
+        self.turn = self.state.turn
+        self.all_legal_moves = self.state.legal_moves
         self.update()
         if len(self.all_legal_moves) == 0:
-            if len(get_black_checks(self.board) if self.turn == 0 else get_white_checks(self.board)):
+            if self.state.in_check:
                 print(f'{"White" if self.turn == 1 else "Black"} won by checkmate!')
             else:
                 print("Stalemate!")
@@ -0,0 +1,330 @@
+"""
+Compact binary game archive, each move is stored as its index in the sorted list of the legal moves, one byte per ply
+The file starts with MAGIC, then the records of the games, each one prefixed by its length, and ends with the index of
+their offsets, so that any game can be read without reading the others. A file without index (a writer that didn't
+close) is scanned to rebuild it
+A record is: flags (result and whether there is a FEN), the FEN, the headers, the number of plies and the moves
+"""
+import argparse
+import struct
+from array import array
+from time import perf_counter
+from typing import List, Dict, Tuple, Iterator, BinaryIO
+from src.util import load_fen
+from src.state import GameState
+from src.zobrist import hash_game_data
+from src.fen import to_fen
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+SanMove = Tuple[Position, Position, int | None]  # From, to, and the white id of the promotion piece
+ArchiveGame = Dict[str, Dict[str, str] | List[SanMove] | str | None]
+
+MAGIC = b'CHGA\x01'
+INDEX_MAGIC = b'CIDX'
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+PROMOTIONS = (2, 3, 4, 5)
+HAS_FEN = 4  # Flag bit, the result is on the two first bits
+
+LENGTH = struct.Struct('<I')
+SHORT = struct.Struct('<H')
+FOOTER = struct.Struct('<Q4s')  # Number of games and INDEX_MAGIC, after the offsets
+
+
+def sorted_legal_moves(state: GameState) -> List[SanMove]:
+    """
+    The legal moves of the position sorted, a promotion being one move per piece, there are at most 218 of them
+    They come from the incremental legal moves of the state, which only regenerates the pieces a move affects
+
+    :param state:
+    :return:
+    """
+    board = state.board
+    moves = []
+    for pos1, targets in state.legal_moves.items():
+        pawn = board[pos1[0]][pos1[1]] in (1, 7)
+        for pos2 in targets:
+            if pawn and pos2[0] in (0, 7):
+                moves.extend((pos1, pos2, promotion) for promotion in PROMOTIONS)
+            else:
+                moves.append((pos1, pos2, None))
+    moves.sort()
+    return moves
+
+
+def encode_moves(fen: str, moves: List[SanMove]) -> bytes:
+    """
+    The index of each move in the sorted legal moves of its position
+    A pawn move to the last row without promotion piece is a queen promotion
+
+    :param fen:
+    :param moves:
+    :return:
+    """
+    state = GameState(load_fen(fen))
+    board = state.board
+    codes = bytearray()
+    for pos1, pos2, promotion in moves:
+        if promotion is None and board[pos1[0]][pos1[1]] in (1, 7) and pos2[0] in (0, 7):
+            promotion = 5
+        try:
+            codes.append(sorted_legal_moves(state).index((pos1, pos2, promotion)))
+        except ValueError:
+            raise ValueError(f'Illegal move {pos1} {pos2} at ply {len(codes) + 1}') from None
+        state.play(pos1, pos2, promotion)
+    return bytes(codes)
+
+
+def decode_moves(fen: str, codes: bytes) -> Iterator[Tuple[GameState, SanMove]]:
+    """
+    Replay the codes of a game on a single state, yielding it after each move with the move
+
+    :param fen:
+    :param codes:
+    :return:
+    """
+    state = GameState(load_fen(fen))
+    for code in codes:
+        move = sorted_legal_moves(state)[code]
+        state.play(*move)
+        yield state, move
+
+
+def encode_game(moves: List[SanMove], result: str = '*', headers: Dict[str, str] = None, fen: str = None) -> bytes:
+    """
+    The record of a game, without its length
+
+    :param moves:
+    :param result: One of RESULTS
+    :param headers: Short strings, at most 255 of them
+    :param fen: The starting position, if it isn't the usual one
+    :return:
+    """
+    headers = headers or {}
+    has_fen = fen is not None and fen != START_FEN
+    parts = [bytes((RESULTS.index(result) | (HAS_FEN if has_fen else 0), ))]
+    if has_fen:
+        parts += [bytes((len(fen), )), fen.encode('ascii')]
+    parts.append(bytes((len(headers), )))
+    for key, value in headers.items():
+        key, value = key.encode('utf-8'), value.encode('utf-8')
+        parts += [bytes((len(key), )), key, SHORT.pack(len(value)), value]
+    parts += [SHORT.pack(len(moves)), encode_moves(fen if has_fen else START_FEN, moves)]
+    return b''.join(parts)
+
+
+def decode_header(record: bytes) -> Tuple[ArchiveGame, bytes]:
+    """
+    The game of a record, without its moves, and the codes of its moves
+
+    :param record:
+    :return:
+    """
+    flags, offset = record[0], 1
+    fen = START_FEN
+    if flags & HAS_FEN:
+        fen = record[offset + 1:offset + 1 + record[offset]].decode('ascii')
+        offset += 1 + record[offset]
+    headers, count = {}, record[offset]
+    offset += 1
+    for _ in range(count):
+        key = record[offset + 1:offset + 1 + record[offset]].decode('utf-8')
+        offset += 1 + record[offset]
+        length = SHORT.unpack_from(record, offset)[0]
+        headers[key] = record[offset + 2:offset + 2 + length].decode('utf-8')
+        offset += 2 + length
+    plies = SHORT.unpack_from(record, offset)[0]
+    codes = record[offset + 2:offset + 2 + plies]
+    return {"headers": headers, "fen": fen, "result": RESULTS[flags & 3], "moves": []}, codes
+
+
+class ArchiveWriter:
+    """
+    Streaming writer, the games are written as they come and the index when closing
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        """
+        :param path:
+        :param append: Add the games to an existing archive, its index is rewritten when closing
+        """
+        self.path = path
+        if append:
+            with ArchiveReader(path) as reader:
+                self.offsets = array('Q', reader.offsets)
+                end = reader.end
+            self.file: BinaryIO = open(path, 'r+b')
+            self.file.seek(end)
+            self.file.truncate()
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC)
+            self.offsets = array('Q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def write_game(self, moves: List[SanMove], result: str = '*', headers: Dict[str, str] = None,
+                   fen: str = None) -> int:
+        """
+        See encode_game, return the index of the game
+
+        :param moves:
+        :param result:
+        :param headers:
+        :param fen:
+        :return:
+        """
+        record = encode_game(moves, result, headers, fen)
+        self.offsets.append(self.file.tell())
+        self.file.write(LENGTH.pack(len(record)))
+        self.file.write(record)
+        return len(self.offsets) - 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write(self.offsets.tobytes())
+        self.file.write(FOOTER.pack(len(self.offsets), INDEX_MAGIC))
+        self.file.close()
+
+
+class ArchiveReader:
+    """
+    Random access reader, with the offsets of the games in memory
+    """
+
+    def __init__(self, path: str):
+        self.file: BinaryIO = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a game archive')
+        size = self.file.seek(0, 2)
+
+        # The index at the end, or a scan of the records if the writer didn't close
+        count, magic = None, None
+        if size >= len(MAGIC) + FOOTER.size:
+            self.file.seek(size - FOOTER.size)
+            count, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic == INDEX_MAGIC:
+            self.end = size - FOOTER.size - count * 8
+            self.file.seek(self.end)
+            self.offsets = array('Q')
+            self.offsets.frombytes(self.file.read(count * 8))
+        else:
+            self.offsets, offset = array('Q'), len(MAGIC)
+            self.file.seek(offset)
+            while offset + LENGTH.size <= size:
+                length = LENGTH.unpack(self.file.read(LENGTH.size))[0]
+                if offset + LENGTH.size + length > size:  # A truncated last record
+                    break
+                self.offsets.append(offset)
+                offset += LENGTH.size + length
+                self.file.seek(offset)
+            self.end = offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> ArchiveGame:
+        return self.read_game(index)
+
+    def __iter__(self) -> Iterator[ArchiveGame]:
+        for index in range(len(self.offsets)):
+            yield self.read_game(index)
+
+    def read_record(self, index: int) -> bytes:
+        self.file.seek(self.offsets[index])
+        return self.file.read(LENGTH.unpack(self.file.read(LENGTH.size))[0])
+
+    def read_game(self, index: int) -> ArchiveGame:
+        """
+        A game like {"headers": Dict[str, str], "fen": The starting position, "result", "moves": List[SanMove]}
+
+        :param index:
+        :return:
+        """
+        game, codes = decode_header(self.read_record(index))
+        game['moves'] = [move for _, move in decode_moves(game['fen'], codes)]
+        return game
+
+    def positions(self, index: int, emit: str = 'fen') -> List[str | int]:
+        """
+        The positions reached by the moves of a game, from the starting one
+        emit is 'fen' for their FEN or 'hash' for their Zobrist hash
+
+        :param index:
+        :param emit:
+        :return:
+        """
+        game, codes = decode_header(self.read_record(index))
+        convert = to_fen if emit == 'fen' else hash_game_data
+        return [convert(load_fen(game['fen']))] + [convert(state.game_data) for state, _ in
+                                                  decode_moves(game['fen'], codes)]
+
+    def close(self):
+        self.file.close()
+
+
+def convert_pgn(pgn_path: str, path: str, limit: int = None) -> Dict[str, int]:
+    """
+    Write the games of a PGN file to an archive, the games that can't be replayed are skipped
+
+    :param pgn_path:
+    :param path:
+    :param limit: Maximum number of games
+    :return: The number of games written and skipped
+    """
+    from src.pgn import read_games, replay
+
+    stats = {'games': 0, 'errors': 0}
+    with open(pgn_path, encoding='utf-8', errors='replace') as file, ArchiveWriter(path) as writer:
+        for game in read_games(file):
+            try:
+                moves = [position['move'] for position in replay(game, None)]
+                fen = game['headers'].get('FEN')
+                writer.write_game(moves, game['result'], {key: value for key, value in game['headers'].items()
+                                                          if key not in ('FEN', 'SetUp', 'Result')}, fen)
+                stats['games'] += 1
+            except (SyntaxError, ValueError):
+                stats['errors'] += 1
+            if limit is not None and stats['games'] >= limit:
+                break
+    return stats
+
+
+if __name__ == '__main__':
+    import os
+
+    parser = argparse.ArgumentParser(description='Show the size of a game archive and how fast its games decode')
+    parser.add_argument('file')
+    parser.add_argument('--pgn', help='Convert this PGN file to the archive first')
+    parser.add_argument('--limit', type=int, help='Maximum number of games to convert or decode')
+    args = parser.parse_args()
+
+    if args.pgn is not None:
+        converted = convert_pgn(args.pgn, args.file, args.limit)
+        print(f'{converted["games"]} games converted, {converted["errors"]} skipped')
+    with ArchiveReader(args.file) as archive:
+        count = min(len(archive), args.limit or len(archive))
+        start = perf_counter()
+        plies = sum(len(archive[i]['moves']) for i in range(count))
+        elapsed = perf_counter() - start
+        size = os.path.getsize(args.file)
+        print(f'{len(archive)} games, {size} bytes, {size / max(len(archive), 1):.1f} bytes/game, '
+              f'{size / max(plies, 1):.2f} bytes/ply' + (' (decoded games only)' if count < len(archive) else ''))
+        print(f'decoded {count} games, {plies} plies in {elapsed:.2f}s: {count / elapsed:.1f} games/s, '
+              f'{plies / elapsed:.0f} plies/s')
@@ -0,0 +1,285 @@
+"""
+Search benchmarks, time-to-depth and nodes-to-depth on a fixed suite
+The release benchmark writes its runs as JSON, and two runs can be compared to find the slowdowns
+"""
+import sys
+import json
+import argparse
+import platform
+import statistics
+from datetime import datetime
+from time import perf_counter
+from typing import List, Dict
+from src.util import load_fen, position_to_coords
+from src.bot import SearchConfig, DEFAULT_CONFIG, search, new_stats, format_pv
+from src.pawns import PawnHashTable
+
+SUITE = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3',
+    'r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/2N2N2/PPPP1PPP/R1BQK2R w KQkq - 6 5',
+    'r3k2r/ppp2ppp/2nqbn2/3pp3/3PP3/2NQBN2/PPP2PPP/R3K2R w KQkq - 0 9',
+    '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1',
+    '8/8/4k3/8/2p5/2P5/4K3/8 w - - 0 1',
+    '4rrk1/pp3ppp/2p5/8/3q4/1P3Q2/P4PPP/R4RK1 b - - 0 1',
+    'r1b1k2r/ppppnppp/2n2q2/2b5/3NP3/2P1B3/PP3PPP/RN1QKB1R w KQkq - 0 7',
+]
+
+# The release suite, about 50 varied positions, to follow the performance of the whole engine across versions
+FULL_SUITE = SUITE + [
+    # Perft positions, full of castles, en-passants and promotions
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    # Bratko-Kopec positions, middlegames
+    '1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1',
+    '3r1k2/4npp1/1ppr3p/p6P/P2PPPP1/1NR5/5K2/2R5 w - - 0 1',
+    '2q1rr1k/3bbnnp/p2p1pp1/2pPp3/PpP1P1P1/1P2BNNP/2BQ1PRK/7R b - - 0 1',
+    'rnbqkb1r/p3pppp/1p6/2ppP3/3N4/2P5/PPP1QPPP/R1B1KB1R w KQkq - 0 1',
+    'r1b2rk1/2q1b1pp/p2ppn2/1p6/3QP3/1BN1B3/PPP3PP/R4RK1 w - - 0 1',
+    '2r3k1/pppR1pp1/4p3/4P1P1/5P2/1P4K1/P1P5/8 w - - 0 1',
+    '1nk1r1r1/pp2n1pp/4p3/q2pPp1N/b1pP1P2/B1P2R2/2P1B1PP/R2Q2K1 w - - 0 1',
+    '4b3/p3kp2/6p1/3pP2p/2pP1P2/4K1P1/P3N2P/8 w - - 0 1',
+    '2kr1bnr/pbpq4/2n1pp2/3p3p/3P1P1B/2N2N1Q/PPP3PP/2KR1B1R w - - 0 1',
+    '3rr1k1/pp3pp1/1qn2np1/8/3p4/PP1R1P2/2P1NQPP/R1B3K1 b - - 0 1',
+    '2r1nrk1/p2q1ppp/bp1p4/n1pPp3/P1P1P3/2PBB1N1/4QPPP/R4RK1 w - - 0 1',
+    'r3r1k1/ppqb1ppp/8/4p1NQ/8/2P5/PP3PPP/R3R1K1 b - - 0 1',
+    'r2q1rk1/4bppp/p2p4/2pP4/3pP3/3Q4/PP1B1PPP/R3R1K1 w - - 0 1',
+    'rnb2r1k/pp2p2p/2pp2p1/q2P1p2/8/1Pb2NP1/PB2PPBP/R2Q1RK1 w - - 0 1',
+    '2r3k1/1p2q1pp/2b1pr2/p1pp4/6Q1/1P1PP1R1/P1PN2PP/5RK1 w - - 0 1',
+    'r1bqkb1r/4npp1/p1p4p/1p1pP1B1/8/1B6/PPPN1PPP/R2Q1RK1 w kq - 0 1',
+    'r2q1rk1/1ppnbppp/p2p1nb1/3Pp3/2P1P1P1/2N2N1P/PPB1QP2/R1B2RK1 b - - 0 1',
+    'r1bq1rk1/pp2ppbp/2np2p1/2n5/P3PP2/N1P2N2/1PB3PP/R1B1QRK1 b - - 0 1',
+    '3rr3/2pq2pk/p2p1pnp/8/2QBPP2/1P6/P5PP/4RRK1 b - - 0 1',
+    'r4k2/pb2bp1r/1p1qp2p/3pNp2/3P1P2/2N3P1/PPP1Q2P/2KRR3 w - - 0 1',
+    '3rn2k/ppb2rpp/2ppqp2/5N2/2P1P3/1P5Q/PB3PPP/3RR1K1 w - - 0 1',
+    '2r2rk1/1bqnbpp1/1p1ppn1p/pP6/N1P1P3/P2B1N1P/1B2QPP1/R2R2K1 b - - 0 1',
+    'r1bqk2r/pp2bppp/2p5/3pP3/P2Q1P2/2N1B3/1PP3PP/R4RK1 b kq - 0 1',
+    'r2qnrnk/p2b2b1/1p1p2pp/2pPpp2/1PP1P3/PRNBB3/3QNPPP/5RK1 w - - 0 1',
+    # Endgames
+    '8/k7/3p4/p2P1p2/P2P1P2/8/8/K7 w - - 0 1',
+    '8/8/1p1r1k2/p1pPN1p1/P3KnP1/1P6/8/3R4 b - - 0 1',
+    '5k2/7R/4P2p/5K2/p1r2P1p/8/8/8 b - - 0 1',
+    '8/6pk/1p6/8/PP3p1p/5P2/4KP1q/3Q4 w - - 0 1',
+    '7k/3p2pp/4q3/8/4Q3/5Kp1/P6b/8 w - - 0 1',
+    '8/2p5/8/2kPKp1p/2p4P/2P5/3P4/8 w - - 0 1',
+    '8/8/3k4/8/8/3K4/3P4/8 w - - 0 1',
+    '6k1/5ppp/8/8/8/8/r4PPP/1R4K1 w - - 0 1',
+    # Win at chess tactics
+    '2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1',
+    '5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - 0 1',
+    'r1bq2rk/pp3pbp/2p1p1pQ/7P/3P4/2PB1N2/PP3PPR/2KR4 w - - 0 1',
+    # Openings
+    'rnbqkb1r/pp1p1ppp/4pn2/2p5/2PP4/2N5/PP2PPPP/R1BQKBNR w KQkq - 0 4',
+    'rnbqk2r/ppp1ppbp/3p1np1/8/2PPP3/2N5/PP3PPP/R1BQKBNR w KQkq - 0 5',
+]
+
+CONFIGS = {
+    'plain': SearchConfig(null_move=False, lmr=False, pvs=False, aspiration=False, tt=False, see=False),
+    'null-move': SearchConfig(lmr=False, pvs=False, aspiration=False, tt=False, see=False),
+    'lmr': SearchConfig(null_move=False, pvs=False, aspiration=False, tt=False, see=False),
+    'pvs': SearchConfig(null_move=False, lmr=False, aspiration=False, tt=False, see=False),
+    'aspiration': SearchConfig(null_move=False, lmr=False, pvs=False, tt=False, see=False),
+    'tt': SearchConfig(null_move=False, lmr=False, pvs=False, aspiration=False, see=False),
+    'see': SearchConfig(null_move=False, lmr=False, pvs=False, aspiration=False, tt=False),
+    'no-eval-cache': SearchConfig(eval_cache=False),
+    'all': SearchConfig(),
+}
+
+
+# Depth of the searches with a fixed time, only the time limit stops them
+MAX_DEPT = 64
+
+BenchRun = Dict[str, str | int | float | None | Dict | List[Dict[str, str | int | float | List[float]]]]
+
+
+def time_to_dept(fen: str, dept: int, config: SearchConfig, time_limit: float = None) -> Dict[str, str | int | float]:
+    """
+    Search a position to a fixed depth, or for a fixed time, and measure it
+    Every search gets a new pawn hash table, so that the previous ones don't make it faster
+
+    :param fen:
+    :param dept:
+    :param config:
+    :param time_limit: In seconds
+    :return:
+    """
+    stats = new_stats()
+    stats['pawn_hash'] = PawnHashTable()
+    start = perf_counter()
+    result = search(load_fen(fen), dept, config, stats, time_limit)
+    elapsed = perf_counter() - start
+    pos1, pos2 = result['move']
+    return {
+        'fen': fen,
+        'move': position_to_coords(pos1) + position_to_coords(pos2),
+        'value': result['value'],
+        'pv': format_pv(result['pv']),
+        'dept': result['dept'],
+        'nodes': stats['nodes'],
+        'time': elapsed,
+        'nps': stats['nodes'] / elapsed,
+    }
+
+
+def run_suite(dept: int, configs: Dict[str, SearchConfig], suite: List[str] = None) -> Dict[str, List[Dict]]:
+    """
+    Run every configuration on the whole suite, printing a line per position
+
+    :param dept:
+    :param configs:
+    :param suite:
+    :return:
+    """
+    results = {}
+    for name, config in configs.items():
+        results[name] = []
+        for fen in suite or SUITE:
+            result = time_to_dept(fen, dept, config)
+            results[name].append(result)
+            print(f'{name:<10} {result["move"]:<6} {result["value"]:>8} {result["nodes"]:>9} nodes '
+                  f'{result["time"]:>8.2f}s  {fen}  pv: {result["pv"]}')
+        total_nodes = sum(r['nodes'] for r in results[name])
+        total_time = sum(r['time'] for r in results[name])
+        print(f'{name:<10} total: {total_nodes} nodes, {total_time:.2f}s\n')
+    return results
+
+
+def spread(values: List[float]) -> float:
+    return statistics.stdev(values) if len(values) > 1 else 0.
+
+
+def run_benchmark(dept: int = None, time_limit: float = None, repeat: int = 3, warmup: int = 1,
+                  config: SearchConfig = None, suite: List[str] = None) -> BenchRun:
+    """
+    The release benchmark, every position is searched repeat times to a fixed depth or for a fixed time, after warmup
+    unmeasured searches of the first one. Return something like
+    {
+        "date", "python", "machine", "config", "dept", "time_limit", "repeat", "warmup",
+        "positions": List of {"fen", "move", "value", "dept", "nodes", "time", "time_stdev", "nps", "nps_stdev",
+                              "times", "stable"}, the medians of the runs, stable is False if their moves differ,
+        "total": {"nodes", "time", "nps"}, from the medians
+    }
+
+    :param dept: Fixed depth, used if there is no time limit
+    :param time_limit: Fixed time per position, in seconds
+    :param repeat:
+    :param warmup:
+    :param config: DEFAULT_CONFIG if None
+    :param suite: FULL_SUITE if None
+    :return:
+    """
+    config = config or DEFAULT_CONFIG
+    suite = suite or FULL_SUITE
+    search_dept = MAX_DEPT if time_limit is not None else dept
+    for _ in range(warmup):
+        time_to_dept(suite[0], search_dept, config, time_limit)
+
+    positions = []
+    for fen in suite:
+        runs = [time_to_dept(fen, search_dept, config, time_limit) for _ in range(repeat)]
+        times, speeds = [run['time'] for run in runs], [run['nps'] for run in runs]
+        positions.append({
+            'fen': fen,
+            'move': runs[-1]['move'],
+            'value': runs[-1]['value'],
+            'dept': runs[-1]['dept'],
+            'nodes': int(statistics.median(run['nodes'] for run in runs)),
+            'time': statistics.median(times),
+            'time_stdev': spread(times),
+            'nps': statistics.median(speeds),
+            'nps_stdev': spread(speeds),
+            'times': times,
+            'stable': len({run['move'] for run in runs}) == 1,
+        })
+        print(f'{positions[-1]["move"]:<6} {positions[-1]["value"]:>8} dept {positions[-1]["dept"]:>2} '
+              f'{positions[-1]["nodes"]:>8} nodes {positions[-1]["time"]:>7.3f}s '
+              f'± {positions[-1]["time_stdev"]:.3f} {positions[-1]["nps"]:>7.0f} nps  {fen}')
+
+    total_nodes, total_time = sum(p['nodes'] for p in positions), sum(p['time'] for p in positions)
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'config': repr(config),
+        'dept': dept if time_limit is None else None,
+        'time_limit': time_limit,
+        'repeat': repeat,
+        'warmup': warmup,
+        'positions': positions,
+        'total': {'nodes': total_nodes, 'time': total_time, 'nps': total_nodes / total_time},
+    }
+
+
+def compare_runs(old: BenchRun, new: BenchRun, threshold: float = .1) -> List[Dict[str, str | float | bool]]:
+    """
+    Compare two runs of the same suite, position by position and in total, printing a line for each
+    At a fixed depth the time is compared, at a fixed time the nodes per second are. A slowdown is flagged when it is
+    larger than the threshold and than twice the noise of the runs (the sum of their standard deviations)
+    Moves and node counts that changed are shown, they mean that the search itself changed
+
+    :param old:
+    :param new:
+    :param threshold: Relative slowdown, 0.1 for 10%
+    :return: A row per position in both runs, and the total, with their ratios and flags
+    """
+    by_time = old['time_limit'] is None
+    metric = 'time' if by_time else 'nps'
+    new_positions = {position['fen']: position for position in new['positions']}
+    rows = []
+    for before in old['positions']:
+        after = new_positions.get(before['fen'])
+        if after is None:
+            continue
+        # Ratio above 1 when the new run is slower
+        ratio = after['time'] / before['time'] if by_time else before['nps'] / after['nps']
+        noise = before[metric + '_stdev'] + after[metric + '_stdev']
+        rows.append({
+            'fen': before['fen'],
+            'ratio': ratio,
+            'slowdown': ratio > 1 + threshold and abs(after[metric] - before[metric]) > 2 * noise,
+            'move_changed': before['move'] != after['move'],
+            'nodes_changed': before['nodes'] != after['nodes'],
+        })
+    total_ratio = new['total']['time'] / old['total']['time'] if by_time else old['total']['nps'] / new['total']['nps']
+    rows.append({'fen': 'total', 'ratio': total_ratio, 'slowdown': total_ratio > 1 + threshold,
+                 'move_changed': any(row['move_changed'] for row in rows),
+                 'nodes_changed': old['total']['nodes'] != new['total']['nodes']})
+
+    for row in rows:
+        notes = [note for note, flag in (('SLOWER', row['slowdown']), ('move changed', row['move_changed']),
+                                         ('nodes changed', row['nodes_changed'])) if flag]
+        print(f'{row["ratio"]:>6.2f}x {metric}  {", ".join(notes):<35} {row["fen"]}')
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time-to-depth and nodes-to-depth of the search configurations, '
+                                                 'or the release benchmark with --full')
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--config', choices=CONFIGS, action='append',
+                        help='Configuration to run, can be repeated, all of them by default')
+    parser.add_argument('--full', action='store_true',
+                        help='Run the release benchmark on the full suite, with the default configuration')
+    parser.add_argument('--time', type=float, default=None, help='Fixed time per position instead of a fixed dept')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--json', default=None, help='File to write the release benchmark run to')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two release benchmark runs')
+    parser.add_argument('--threshold', type=float, default=.1, help='Relative slowdown flagged by --compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+            compared = compare_runs(json.load(old_file), json.load(new_file), args.threshold)
+        sys.exit(1 if any(row['slowdown'] for row in compared) else 0)
+    elif args.full:
+        run = run_benchmark(args.dept, args.time, args.repeat, args.warmup)
+        print(f'total: {run["total"]["nodes"]} nodes, {run["total"]["time"]:.2f}s, {run["total"]["nps"]:.0f} nps')
+        if args.json is not None:
+            with open(args.json, 'w') as file:
+                json.dump(run, file, indent=2)
+    else:
+        run_suite(args.dept, {name: CONFIGS[name] for name in args.config or CONFIGS})
@@ -1,15 +1,104 @@
 """
 Some bot functions
 """
-from typing import List, Dict, Tuple
+import random
+from typing import List, Dict, Tuple, Set
 from copy import deepcopy
-from src.util import evaluate_position, load_fen, draw_board
-from src.moves import get_all_legal_moves, make_move_smooth, get_black_checks, get_white_checks, reverse_moves
+from time import perf_counter
+from src.util import evaluate_position, load_fen, draw_board, position_to_coords, coords_to_position, \
+    EVALUATION_PARAMETERS
+from src.moves import get_all_legal_moves, make_move_smooth, get_black_checks, get_white_checks, reverse_moves, \
+    is_in_check
+from src.cache import AnalysisCache, fingerprint
+from src.tt import TranspositionTable, EXACT, LOWER, UPPER
+from src.undo import UndoStack
+from src.evalcache import EvalCache
+from src.see import see
 
 Board = List[List[int]]
 Position = Tuple[int, int]
 GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
 DecisionTree = Dict[str, int | float | str | Dict[any, any] | Tuple[Position, Position]]
+SearchStats = Dict[str, int | float | None]
+Move = Tuple[Position, Position]
+Line = Dict[str, int | float | Move | List[Move]]
+SearchResult = Dict[str, int | float | Move | List[Move] | List[Line]]
+
+# Width of the null windows, scores closer than this are considered equal
+NULL_WINDOW = 0.01
+# Bounds of the root window, just outside of the checkmate scores
+INFINITE = 10001
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when its deadline is over, when its node limit is reached or when it is stopped
+    """
+
+
+class SearchConfig:
+    """
+    The switches of the selective search, so that each of them can be compared with the others
+    """
+
+    def __init__(self, **kwargs):
+        # Null-move pruning: let the opponent play twice with a shallower search, if we still fail high we prune
+        self.null_move = kwargs.get('null_move', True)
+        self.null_move_reduction = kwargs.get('null_move_reduction', 2)
+
+        # Late move reductions: quiet moves ordered late are searched shallower, and re-searched if they fail high
+        self.lmr = kwargs.get('lmr', True)
+        self.lmr_min_dept = kwargs.get('lmr_min_dept', 3)
+        self.lmr_min_index = kwargs.get('lmr_min_index', 3)
+        self.lmr_reduction = kwargs.get('lmr_reduction', 1)
+
+        # Principal variation search: only the first move gets the full window, the others a null window
+        self.pvs = kwargs.get('pvs', True)
+
+        # Aspiration windows: each iteration starts with a window around the previous score, widened on failure
+        self.aspiration = kwargs.get('aspiration', True)
+        self.aspiration_window = kwargs.get('aspiration_window', 5)
+
+        # Transposition table: the searched nodes are stored, to cut the ones reached again and order their moves
+        self.tt = kwargs.get('tt', True)
+        self.tt_size = kwargs.get('tt_size', 1 << 16)
+
+        # Static exchange evaluation: losing captures are ordered after the quiet moves, and pruned near the leaves
+        self.see = kwargs.get('see', True)
+        self.see_prune_dept = kwargs.get('see_prune_dept', 2)
+
+        # Evaluation cache: the static evaluations are stored by position hash, the leaves are reached many times
+        self.eval_cache = kwargs.get('eval_cache', True)
+        self.eval_cache_size = kwargs.get('eval_cache_size', 1 << 16)
+
+    def __repr__(self):
+        return f'SearchConfig({", ".join(f"{k}={v!r}" for k, v in self.__dict__.items())})'
+
+
+DEFAULT_CONFIG = SearchConfig()
+
+
+def new_stats() -> SearchStats:
+    """
+    Create the counters filled by a search, they also hold its limits, its transposition table, its pawn hash table
+    (the shared one if None), its evaluation cache (one for the search if None and enabled by the config), the undo
+    stack of the searched game data, an event to stop it from another process and a channel to publish its progress
+    to (see src.hud.StatsChannel)
+
+    :return:
+    """
+    return {'nodes': 0, 'researches': 0, 'aspiration_fails': 0, 'see_pruned': 0, 'deadline': None, 'node_limit': None, 'tt': None,
+            'pawn_hash': None, 'eval_cache': None, 'undo': None, 'stop': None, 'channel': None}
+
+
+def format_pv(pv: List[Move]) -> str:
+    """
+    Format a principal variation like 'e2e4 e7e5 g1f3'
+
+    :param pv:
+    :return:
+    """
+    return ' '.join(position_to_coords(pos1) + position_to_coords(pos2) for pos1, pos2 in pv)
 
 
 def create_decision_tree(game_data: GameData, dept: int, move: Tuple[Position, Position] = None) -> DecisionTree:
@@ -21,6 +110,7 @@ def create_decision_tree(game_data: GameData, dept: int, move: Tuple[Position, P
         "move": Tuple[Position, Position], the move that lead to this node,
         "children": List[DecisionTree],
     }
+    The whole tree is kept in memory, see src.tree.export_tree to stream it to a file instead
 
     :param game_data:
     :param dept:
@@ -95,53 +185,253 @@ def minimax(tree: DecisionTree, dept: int):
         return best_child
 
 
-def minimax_root(game_data: GameData, dept: int) -> Tuple[Position, Position]:
+def minimax_root(game_data: GameData, dept: int, config: SearchConfig = None, stats: SearchStats = None,
+                 cache: AnalysisCache = None) -> Tuple[Position, Position]:
     """
     The root of the minimax algorithm
 
     :param game_data:
     :param dept:
+    :param config:
+    :param stats:
+    :param cache:
+    :return:
+    """
+    return search(game_data, dept, config, stats, cache=cache)['move']
+
+
+def search(game_data: GameData, dept: int, config: SearchConfig = None, stats: SearchStats = None,
+           time_limit: float = None, cache: AnalysisCache = None, multipv: int = 1,
+           tt: TranspositionTable = None, node_limit: int = None, seed: int = None) -> SearchResult:
+    """
+    Iterative deepening up to dept, using aspiration windows around the previous iteration score
+    If the time limit is over or the node limit is reached, the result of the last completed iteration is returned
+    With a cache, the position is only searched if it wasn't already at least at this depth
+    With multipv, the next best lines are found by searching the root again without the moves of the previous ones
+    Return something like
+    {
+        "move": The best move,
+        "value": Its score,
+        "pv": List[Move], the principal variation,
+        "dept": The last completed depth,
+        "lines": List of {"dept", "value", "pv"}, one per iteration, to check the PV stability,
+        "multipv": List of {"move", "value", "pv"}, the best lines from the best one, with their exact scores,
+        "cached": Whether the result comes from the cache
+    }
+
+    :param game_data:
+    :param dept:
+    :param config:
+    :param stats:
+    :param time_limit: In seconds
+    :param cache: Persistent analysis cache, read before searching and written after, only for a single line, its
+    entries are keyed by the config and the evaluation parameters too
+    :param multipv: Number of lines to find
+    :param tt: Transposition table to use, a new one is created if None and enabled by the config
+    :param node_limit: Checked every 256 nodes, like the time limit
+    :param seed: If given, the root moves are first shuffled with it, so that parallel searches diverge
     :return:
     """
+    if config is None:
+        config = DEFAULT_CONFIG
+    if stats is None:
+        stats = new_stats()
+    if cache is not None and multipv == 1:
+        cache_fingerprint = fingerprint(config, EVALUATION_PARAMETERS)
+        entry = cache.get(game_data, dept, cache_fingerprint)
+        if entry is not None:
+            move = (coords_to_position(entry['move'][:2]), coords_to_position(entry['move'][2:]))
+            return {"move": move, "value": entry['value'], "pv": [move], "dept": entry['dept'], "lines": [],
+                    "multipv": [{"move": move, "value": entry['value'], "pv": [move]}], "cached": True}
+
+    stats['deadline'] = perf_counter() + time_limit if time_limit is not None else None
+    stats['node_limit'] = stats['nodes'] + node_limit if node_limit is not None else None
+    stats['tt'] = tt if tt is not None or not config.tt else TranspositionTable(config.tt_size)
+    eval_cache = stats['eval_cache']
+    if not config.eval_cache:
+        stats['eval_cache'] = None
+    elif eval_cache is None:
+        stats['eval_cache'] = EvalCache(config.eval_cache_size)
+    if stats['channel'] is not None:
+        stats['channel'].publish(searching=True, start=perf_counter(), end=None, budget=time_limit, dept=0,
+                                 value=None, pv=[], nodes=stats['nodes'], hashfull=0)
     game_data_copy = deepcopy(game_data)
-    board = game_data_copy['board']
-    all_legal_moves = get_all_legal_moves(board, game_data_copy['turn'], game_data_copy['en_passant'],
-                                          game_data_copy['castles'])
-
-    if game_data_copy['turn'] == 0:
-        best, value = None, -10001
-        for piece_pos in all_legal_moves:
-            for move in all_legal_moves[piece_pos]:
-                data = make_move_smooth(board, piece_pos, move, game_data_copy['en_passant'], game_data_copy['castles'])
-                data['turn'] = 1 - game_data['turn']
-                v = minimax_new(data, dept - 1)
-                if v > value:
-                    best, value = (piece_pos, move), v
-                reverse_moves(board, data['old_tiles'])
-        return best
+    board, turn = game_data_copy['board'], game_data_copy['turn']
+    stats['undo'] = UndoStack(game_data_copy)
+
+    moves, _ = order_moves(stats['undo'], flatten_move_dict(get_all_legal_moves(
+        board, turn, game_data_copy['en_passant'], game_data_copy['castles'])), config, stats)
+    if seed is not None:
+        random.Random(seed).shuffle(moves)
+    if len(moves) == 0:
+        value = (-10000 if turn == 0 else 10000) if is_in_check(board, turn) else 0
+        if stats['channel'] is not None:
+            stats['channel'].publish(searching=False, end=perf_counter(), value=value)
+        stats['undo'], stats['eval_cache'] = None, eval_cache
+        return {"move": None, "value": value, "pv": [], "dept": 0, "lines": [], "multipv": [], "cached": False}
+
+    result = {"move": moves[0], "value": evaluate_position(board), "pv": [moves[0]], "dept": 0, "lines": [],
+              "multipv": [], "cached": False}
+    try:
+        for current_dept in range(1, dept + 1):
+            iterate(game_data_copy, moves, current_dept, config, stats, result, multipv)
+    except SearchTimeout:
+        pass
+    if stats['channel'] is not None:
+        stats['channel'].publish(searching=False, end=perf_counter(), nodes=stats['nodes'])
+    stats['deadline'], stats['node_limit'], stats['tt'], stats['undo'] = None, None, None, None
+    stats['eval_cache'] = eval_cache
+
+    if cache is not None and multipv == 1 and result['dept'] > 0:
+        cache.put(game_data, format_pv([result['move']]), result['value'], result['dept'], stats['nodes'],
+                  cache_fingerprint)
+
+    return result
+
+
+def iterate(game_data: GameData, moves: List[Move], dept: int, config: SearchConfig, stats: SearchStats,
+            result: SearchResult, multipv: int = 1):
+    """
+    One iteration of the iterative deepening, update the result and the root moves order
+    The result is only updated once every line of the iteration is found
+
+    :param game_data:
+    :param moves:
+    :param dept:
+    :param config:
+    :param stats:
+    :param result:
+    :param multipv:
+    :return:
+    """
+    delta = config.aspiration_window
+    if config.aspiration and dept > 1:
+        alpha, beta = max(result['value'] - delta, -INFINITE), min(result['value'] + delta, INFINITE)
     else:
-        best, value = None, 10001
-        for piece_pos in all_legal_moves:
-            for move in all_legal_moves[piece_pos]:
-                data = make_move_smooth(board, piece_pos, move, game_data_copy['en_passant'], game_data_copy['castles'])
-                data['turn'] = 1 - game_data['turn']
-                v = minimax_new(data, dept - 1)
-                if v < value:
-                    best, value = (piece_pos, move), v
-                reverse_moves(board, data['old_tiles'])
-        return best
+        alpha, beta = -INFINITE, INFINITE
+
+    fails = 0
+    while True:
+        pv = []
+        best, value = search_root(game_data, moves, dept, alpha, beta, config, stats, pv)
+        if value <= alpha and alpha > -INFINITE:
+            alpha = max(result['value'] - delta * 4 ** (fails + 1), -INFINITE) if fails < 2 else -INFINITE
+        elif value >= beta and beta < INFINITE:
+            beta = min(result['value'] + delta * 4 ** (fails + 1), INFINITE) if fails < 2 else INFINITE
+        else:
+            break
+        # Widening on each failure, the failing side is fully opened after the third one
+        fails += 1
+        stats['aspiration_fails'] += 1
+
+    # The next lines, each one is the best line without the moves of the previous ones, with a full window
+    # Their nodes were mostly searched by the previous lines, so they are found in the transposition table
+    lines = [{"move": best, "value": value, "pv": pv}]
+    while len(lines) < min(multipv, len(moves)):
+        excluded = [line['move'] for line in lines]
+        line_pv = []
+        line_best, line_value = search_root(game_data, [move for move in moves if move not in excluded], dept,
+                                            -INFINITE, INFINITE, config, stats, line_pv)
+        lines.append({"move": line_best, "value": line_value, "pv": line_pv})
+
+    # Searching the previous best moves first
+    for line in reversed(lines):
+        moves.remove(line['move'])
+        moves.insert(0, line['move'])
+    result.update({"move": best, "value": value, "pv": pv, "dept": dept, "multipv": lines})
+    result['lines'].append({"dept": dept, "value": value, "pv": pv})
+    if stats['channel'] is not None:
+        stats['channel'].publish(dept=dept, value=value, pv=list(pv), nodes=stats['nodes'],
+                                 hashfull=stats['tt'].hashfull() if stats['tt'] is not None else 0)
+
+
+def search_root(game_data: GameData, moves: List[Move], dept: int, alpha: float, beta: float, config: SearchConfig,
+                stats: SearchStats, pv: List[Move]) -> Tuple[Move, float]:
+    """
+    Search the root moves in the given order, only the first one gets the full window when PVS is enabled
+    Fill pv with the principal variation, return the best move and its score
+
+    :param game_data:
+    :param moves:
+    :param dept:
+    :param alpha:
+    :param beta:
+    :param config:
+    :param stats:
+    :param pv:
+    :return:
+    """
+    turn, undo = game_data['turn'], stats['undo']
+    stats['nodes'] += 1
+    best = moves[0]
+    for index, (piece_pos, move) in enumerate(moves):
+        undo.make(piece_pos, move)
+        child_pv = []
+        v = search_child(game_data, dept, index, False, alpha, beta, config, stats, child_pv)
+        undo.unmake()
+
+        if (turn == 0 and v > alpha) or (turn == 1 and v < beta):
+            best = (piece_pos, move)
+            pv[:] = [best] + child_pv
+            if turn == 0:
+                alpha = v
+            else:
+                beta = v
+            if alpha >= beta:
+                break
+
+    return best, alpha if turn == 0 else beta
 
 def compare_two_moves(game_data: GameData, p1, m1, p2, m2):
     d1 = make_move_smooth(game_data['board'], p1, m1, game_data['en_passant'],
-                                        game_data['castles'])
+                                        game_data['castles'].copy())
     s1 = evaluate_position(game_data['board'])
     reverse_moves(game_data['board'], d1['old_tiles'])
     d2 = make_move_smooth(game_data['board'], p2, m2, game_data['en_passant'],
-                                        game_data['castles'])
+                                        game_data['castles'].copy())
     s2 = evaluate_position(game_data['board'])
     reverse_moves(game_data['board'], d2['old_tiles'])
     return s1 - s2
 
+
+def is_capture(board: Board, pos1: Position, pos2: Position) -> bool:
+    """
+    Return whether the move takes a piece, en-passants included, must be called before making the move
+
+    :param board:
+    :param pos1:
+    :param pos2:
+    :return:
+    """
+    return board[pos2[0]][pos2[1]] is not None or (board[pos1[0]][pos1[1]] in (1, 7) and pos1[1] != pos2[1])
+
+
+def order_moves(undo: UndoStack, moves: List[Move], config: SearchConfig, stats: SearchStats) -> Tuple[
+        List[Move], Set[Move]]:
+    """
+    Sort the moves by the evaluation of the position they lead to, the best ones for the player to move first
+    With SEE, the losing captures are put after every other move, the least losing first, without being evaluated
+    Return the sorted moves and the losing captures
+
+    :param undo: The undo stack of the position
+    :param moves:
+    :param config:
+    :param stats:
+    :return:
+    """
+    board, pawn_hash, eval_cache, scores, losing = undo.board, stats['pawn_hash'], stats['eval_cache'], {}, {}
+    for piece_pos, move in moves:
+        if config.see and is_capture(board, piece_pos, move):
+            gain = see(board, piece_pos, move)
+            if gain < 0:
+                losing[piece_pos, move] = gain
+                continue
+        undo.make(piece_pos, move)
+        scores[piece_pos, move] = evaluate_position(board, pawn_hash, eval_cache, undo.hash)
+        undo.unmake()
+    return sorted(scores, key=scores.__getitem__, reverse=undo.turn == 0) + sorted(
+        losing, key=losing.__getitem__, reverse=True), set(losing)
+
 def flatten_move_dict(all_legal_moves: Dict[Position, List[Position]]) -> List[Tuple[Position, Position]]:
     moves = []
     for piece_pos in all_legal_moves:
@@ -150,59 +440,220 @@ def flatten_move_dict(all_legal_moves: Dict[Position, List[Position]]) -> List[T
     return moves
     
 
-def minimax_new(game_data: GameData, dept: int, alpha: int = -10000, beta: int = 10000) -> int:
+def has_non_pawn_material(board: Board, player: int) -> bool:
+    """
+    Return whether the player has something else than pawns and its king
+    Null-move pruning is unsafe without it, pawn endings are full of zugzwangs
+
+    :param board:
+    :param player:
+    :return:
+    """
+    pieces = (2, 3, 4, 5) if player == 0 else (8, 9, 10, 11)
+    for line in board:
+        for piece in line:
+            if piece in pieces:
+                return True
+    return False
+
+
+def is_quiet_move(board: Board, pos1: Position, pos2: Position) -> bool:
+    """
+    Return whether the move is neither a capture nor a promotion, must be called before making the move
+
+    :param board:
+    :param pos1:
+    :param pos2:
+    :return:
+    """
+    if board[pos2[0]][pos2[1]] is not None:
+        return False
+    if board[pos1[0]][pos1[1]] in (1, 7):  # Diagonal pawn moves on empty tiles are en-passants
+        return pos1[1] == pos2[1] and pos2[0] not in (0, 7)
+    return True
+
+
+def check_limits(stats: SearchStats):
+    """
+    Called every 256 nodes, raise SearchTimeout if a limit is reached, and publish the node count
+
+    :param stats:
+    :return:
+    """
+    if stats['channel'] is not None:
+        stats['channel'].publish(nodes=stats['nodes'])
+    if stats['deadline'] is not None and perf_counter() > stats['deadline'] or (
+            stats['node_limit'] is not None and stats['nodes'] >= stats['node_limit']) or (
+            stats['stop'] is not None and stats['stop'].is_set()):
+        raise SearchTimeout()
+
+
+def minimax_new(game_data: GameData, dept: int, alpha: float = -10000, beta: float = 10000,
+                config: SearchConfig = None, stats: SearchStats = None, null_allowed: bool = True,
+                pv: List[Move] = None) -> float:
     """
     New optimised version of minimax
+    White is maximizing, black is minimizing
 
     :param game_data:
     :param dept:
     :param alpha:
     :param beta:
+    :param config: The selective search switches, DEFAULT_CONFIG if None
+    :param stats: Counters to fill, see new_stats
+    :param null_allowed: False right after a null move, two null moves in a row prove nothing
+    :param pv: If given, filled with the principal variation
     :return:
     """
-    if dept == 0:
-        return evaluate_position(game_data['board'])
+    if config is None:
+        config = DEFAULT_CONFIG
+    if stats is None:
+        stats = new_stats()
+    stats['nodes'] += 1
+    if stats['nodes'] % 256 == 0:
+        check_limits(stats)
+
+    # The moves are made and taken back on the undo stack of the game data, which keeps its hash
+    board, turn, undo = game_data['board'], game_data['turn'], stats['undo']
+    if undo is None or undo.game_data is not game_data:
+        # Called directly, the stack gets its own copy, the game data of the caller stays as it is
+        game_data = deepcopy(game_data)
+        board = game_data['board']
+        undo = stats['undo'] = UndoStack(game_data)
+
+    if dept <= 0:
+        return evaluate_position(board, stats['pawn_hash'], stats['eval_cache'], undo.hash)
 
-    all_legal_moves = get_all_legal_moves(game_data['board'], game_data['turn'], game_data['en_passant'],
-                                          game_data['castles'])
+    # Transposition table, the stored bounds can only cut the nodes outside of the principal variation
+    tt, key, tt_move = stats['tt'], None, None
+    if tt is not None:
+        key = undo.hash
+        entry = tt.probe(key)
+        if entry is not None:
+            entry_dept, value, flag, tt_move = entry
+            if pv is None and entry_dept >= dept and (flag == EXACT or (flag == LOWER and value >= beta) or (
+                    flag == UPPER and value <= alpha)):
+                return value
+
+    all_legal_moves = get_all_legal_moves(board, turn, game_data['en_passant'], game_data['castles'])
+    in_check = is_in_check(board, turn)
     if len(all_legal_moves) == 0:
-        if game_data['turn'] == 0 and len(get_black_checks(game_data['board'])) > 0:
-            return -10000
-        elif game_data['turn'] == 1 and len(get_white_checks(game_data['board'])) > 0:
-            return 10000
+        if in_check:
+            return -10000 if turn == 0 else 10000
+        return 0
+
+    # Null-move pruning
+    if config.null_move and null_allowed and not in_check and dept > config.null_move_reduction \
+            and has_non_pawn_material(board, turn):
+        undo.make_null()
+        if turn == 0:
+            v = minimax_new(game_data, dept - 1 - config.null_move_reduction, beta - NULL_WINDOW, beta, config, stats,
+                            False)
+            undo.unmake()
+            if v >= beta:
+                return beta
         else:
-            return 0
-    if game_data['turn'] == 0:
-        for piece_pos, move in sorted(flatten_move_dict(all_legal_moves), key=lambda x: compare_two_moves(game_data, x[0], x[1], x[0], x[1]), reverse=True):
-            data = make_move_smooth(game_data['board'], piece_pos, move, game_data['en_passant'],
-                                    game_data['castles'])
-            data['turn'] = 1 - game_data['turn']
-
-            v = minimax_new(data, dept - 1, alpha, beta)
-            reverse_moves(game_data['board'], data['old_tiles'])
+            v = minimax_new(game_data, dept - 1 - config.null_move_reduction, alpha, alpha + NULL_WINDOW, config,
+                            stats, False)
+            undo.unmake()
+            if v <= alpha:
+                return alpha
+
+    moves, losing = order_moves(undo, flatten_move_dict(all_legal_moves), config, stats)
+    if tt_move in moves:
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
+
+    alpha_start, beta_start, best_move = alpha, beta, None
+    for index, (piece_pos, move) in enumerate(moves):
+        # SEE pruning, the losing captures near the leaves are only refuted by captures that wouldn't be searched
+        if index > 0 and dept <= config.see_prune_dept and not in_check and (piece_pos, move) in losing:
+            stats['see_pruned'] += 1
+            continue
+
+        # Late move reductions, never for tactical moves or when a king is in check
+        reduced = config.lmr and dept >= config.lmr_min_dept and index >= config.lmr_min_index and not in_check \
+            and is_quiet_move(board, piece_pos, move)
+
+        undo.make(piece_pos, move)
+        if reduced and is_in_check(board, 1 - turn):
+            reduced = False
+
+        child_pv = [] if pv is not None else None
+        v = search_child(game_data, dept, index, reduced, alpha, beta, config, stats, child_pv)
+        undo.unmake()
+
+        if turn == 0:
             if v >= beta:
+                if tt is not None:
+                    tt.store(key, dept, v, LOWER, (piece_pos, move))
+                return v
+            if v > alpha:
+                alpha, best_move = v, (piece_pos, move)
+                if pv is not None:
+                    pv[:] = [(piece_pos, move)] + child_pv
+        else:
+            if alpha >= v:
+                if tt is not None:
+                    tt.store(key, dept, v, UPPER, (piece_pos, move))
                 return v
-            alpha = max(alpha, v)
-        return alpha
+            if v < beta:
+                beta, best_move = v, (piece_pos, move)
+                if pv is not None:
+                    pv[:] = [(piece_pos, move)] + child_pv
 
+    if tt is not None:
+        if turn == 0:
+            tt.store(key, dept, alpha, EXACT if alpha > alpha_start else UPPER, best_move)
+        else:
+            tt.store(key, dept, beta, EXACT if beta < beta_start else LOWER, best_move)
+    return alpha if turn == 0 else beta
+
+
+def search_child(data: GameData, dept: int, index: int, reduced: bool, alpha: float, beta: float,
+                 config: SearchConfig, stats: SearchStats, pv: List[Move] | None) -> float:
+    """
+    Search the child reached by the index-th move of a node of the given depth
+    Reduced moves are first searched shallower, with PVS every move but the first is first searched with a null window
+    Both are re-searched when they fail high
+
+    :param data: The child game data, it's turn is the one of the child
+    :param dept: The depth of the parent node
+    :param index:
+    :param reduced:
+    :param alpha:
+    :param beta:
+    :param config:
+    :param stats:
+    :param pv:
+    :return:
+    """
+    # The null window just above alpha for white, just below beta for black
+    if data['turn'] == 1:
+        null_alpha, null_beta = alpha, alpha + NULL_WINDOW
     else:
-        for piece_pos, move in sorted(flatten_move_dict(all_legal_moves), key=lambda x: compare_two_moves(game_data, x[0], x[1], x[0], x[1])):
-            data = make_move_smooth(game_data['board'], piece_pos, move, game_data['en_passant'],
-                                    game_data['castles'])
-            data['turn'] = 1 - game_data['turn']
+        null_alpha, null_beta = beta - NULL_WINDOW, beta
 
-            v = minimax_new(data, dept - 1, alpha, beta)
-            reverse_moves(game_data['board'], data['old_tiles'])
-            if alpha >= v:
-                return v
-            beta = min(beta, v)
-    return beta
+    def fails_high(value):
+        return value > alpha if data['turn'] == 1 else value < beta
+
+    if reduced:
+        v = minimax_new(data, dept - 1 - config.lmr_reduction, null_alpha, null_beta, config, stats)
+        if not fails_high(v):
+            return v
+        stats['researches'] += 1
+
+    if config.pvs and index > 0:
+        v = minimax_new(data, dept - 1, null_alpha, null_beta, config, stats)
+        if not fails_high(v) or not alpha < v < beta:
+            return v
+        stats['researches'] += 1
+
+    return minimax_new(data, dept - 1, alpha, beta, config, stats, pv=pv)
 
 
 if __name__ == '__main__':
-    d = load_fen('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1')
-    t = create_decision_tree(d, 3)
-    import json
+    from src.tree import export_tree
 
-    with open('tree.json', 'w') as f:
-        json.dump(t, f)
+    d = load_fen('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1')
+    export_tree(d, 3, 'tree.jsonl')
@@ -0,0 +1,168 @@
+"""
+Persistent analysis cache, so that the positions searched in a session are not searched again in the next ones
+Stored in SQLite, that can be shared by several worker processes
+"""
+import os
+import sqlite3
+import hashlib
+from time import time
+from typing import List, Dict, Tuple
+from src.zobrist import hash_game_data
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+CacheEntry = Dict[str, str | int | float]
+
+# Bumped when the table changes, an older table is dropped since its rows can't be kept
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    hash INTEGER NOT NULL,
+    fingerprint INTEGER NOT NULL,
+    move TEXT NOT NULL,
+    value REAL NOT NULL,
+    dept INTEGER NOT NULL,
+    nodes INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (hash, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS analysis_last_access ON analysis (last_access);
+"""
+
+
+def to_signed(key: int) -> int:
+    """
+    SQLite integers are signed 64 bits, the hashes are unsigned ones
+
+    :param key:
+    :return:
+    """
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def fingerprint(*parts) -> int:
+    """
+    A stable hash of the reprs of the parts, the same in every process and session (unlike hash)
+    Used to key the analyses by what they depend on besides the position, like the search config and the evaluation
+    parameters
+
+    :param parts:
+    :return:
+    """
+    return to_signed(int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest(), 'little'))
+
+
+class AnalysisCache:
+    """
+    Best move, score, depth and node count of the analysed positions, keyed by position hash and by a fingerprint of
+    what produced them (see fingerprint), so that the searches of other configs or evaluations don't share results
+    The least recently used entries are evicted once max_entries is reached
+    """
+
+    def __init__(self, path: str = 'analysis.sqlite', max_entries: int = 100_000, eviction_interval: int = 100):
+        """
+        :param path:
+        :param max_entries:
+        :param eviction_interval: Number of writes between two size checks
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.eviction_interval = eviction_interval
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        self._connection, self._pid, self._writes = None, None, 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        One connection per process, a connection can't be used after a fork
+
+        :return:
+        """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            if self._connection.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                self._connection.execute('DROP TABLE IF EXISTS analysis')
+                self._connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._connection.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, game_data: GameData, dept: int = 0, key_fingerprint: int = 0) -> CacheEntry | None:
+        """
+        Return the analysis of the position if it was searched at least at the given depth, else None
+
+        :param game_data:
+        :param dept:
+        :param key_fingerprint: Of what the analysis must come from, see fingerprint
+        :return:
+        """
+        key = to_signed(hash_game_data(game_data))
+        row = self.connection.execute(
+            'SELECT move, value, dept, nodes FROM analysis WHERE hash = ? AND fingerprint = ? AND dept >= ?',
+            (key, key_fingerprint, dept)).fetchone()
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.connection.execute('UPDATE analysis SET last_access = ? WHERE hash = ? AND fingerprint = ?',
+                                (time(), key, key_fingerprint))
+        return {'move': row[0], 'value': row[1], 'dept': row[2], 'nodes': row[3]}
+
+    def put(self, game_data: GameData, move: str, value: float, dept: int, nodes: int, key_fingerprint: int = 0):
+        """
+        Store the analysis of a position, unless a deeper one is already stored
+
+        :param game_data:
+        :param move: Something like 'e2e4'
+        :param value:
+        :param dept:
+        :param nodes:
+        :param key_fingerprint: Of what the analysis comes from, see fingerprint
+        :return:
+        """
+        key = to_signed(hash_game_data(game_data))
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT INTO analysis (hash, fingerprint, move, value, dept, nodes, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (hash, fingerprint) DO UPDATE SET move = excluded.move, '
+                'value = excluded.value, dept = excluded.dept, nodes = excluded.nodes, last_access = excluded.last_access WHERE excluded.dept >= analysis.dept',
+                (key, key_fingerprint, move, value, dept, nodes, time()))
+            self._writes += 1
+            if self._writes % self.eviction_interval == 0:
+                self._evict(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self.stats['writes'] += 1
+
+    def _evict(self, connection: sqlite3.Connection):
+        count = connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+        if count > self.max_entries:
+            cursor = connection.execute(
+                'DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis ORDER BY last_access LIMIT ?)',
+                (count - self.max_entries,))
+            self.stats['evictions'] += cursor.rowcount
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups > 0 else 0.
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    def __getstate__(self):
+        # The connection stays in its process, the other ones open their own
+        state = self.__dict__.copy()
+        state['_connection'], state['_pid'] = None, None
+        return state
@@ -0,0 +1,88 @@
+"""
+Local client standing in for real users, to load the game server
+Every simulated user plays random legal moves against the bot
+"""
+import argparse
+import asyncio
+import json
+import random
+from time import perf_counter
+
+
+async def play_games(host: str, port: int, games: int, max_plies: int, seed: int) -> int:
+    """
+    One connection playing several games one after the other, return the number of finished games
+
+    :param host:
+    :param port:
+    :param games:
+    :param max_plies: Plies of the user after which a game is abandoned
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def request(line):
+        writer.write((line + '\n').encode())
+        await writer.drain()
+
+    finished = 0
+    for _ in range(games):
+        color = rng.choice(('white', 'black'))
+        await request(f'NEW {color}')
+        game_id, plies, over = None, 0, False
+        while not over:
+            parts = (await reader.readline()).decode().split()
+            if len(parts) == 0:
+                return finished
+            if parts[0] == 'GAME':
+                game_id = parts[1]
+                if color == 'white':
+                    await request(f'MOVES {game_id}')
+            elif len(parts) > 1 and parts[1] != game_id:  # Late replies about the previous game
+                continue
+            elif parts[0] == 'BOT':
+                await request(f'MOVES {game_id}')
+            elif parts[0] == 'MOVES':
+                if plies >= max_plies:
+                    over = True
+                else:
+                    plies += 1
+                    await request(f'MOVE {game_id} {rng.choice(parts[2:])}')
+            elif parts[0] == 'END':
+                finished += 1
+                over = True
+            elif parts[0] == 'ERR':
+                print(' '.join(parts))
+                over = True
+    await request('QUIT')
+    writer.close()
+    return finished
+
+
+async def main(host: str, port: int, users: int, games: int, max_plies: int):
+    start = perf_counter()
+    results = await asyncio.gather(*(play_games(host, port, games, max_plies, seed) for seed in range(users)))
+    elapsed = perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'METRICS\n')
+    await writer.drain()
+    metrics = json.loads((await reader.readline()).decode().split(' ', 1)[1])
+    writer.close()
+
+    print(f'{users} users, {sum(results)} finished games in {elapsed:.1f}s')
+    for key, value in metrics.items():
+        print(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate users playing random moves on the game server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--games', type=int, default=1, help='Games per user')
+    parser.add_argument('--max-plies', type=int, default=40)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.users, args.games, args.max_plies))
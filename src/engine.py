@@ -0,0 +1,163 @@
+"""
+Engine instances, each one with its own caches inside a memory budget and its own search limits
+So that many bots can be packed on a host without any of them growing without bound
+"""
+import sys
+import argparse
+from time import perf_counter
+from typing import List, Dict, Tuple
+from src.fen import parse_fen
+from src.bot import SearchConfig, SearchResult, search, new_stats, format_pv
+from src.tt import TranspositionTable
+from src.pawns import PawnHashTable
+from src.evalcache import EvalCache
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+EngineReport = Dict[str, str | int | float]
+
+# How the memory budget is split between the caches
+MEMORY_SHARES = {'tt': .7, 'pawn_hash': .2, 'eval_cache': .1}
+
+
+class Engine:
+    """
+    A bot with a byte budget shared by its caches, a node limit and a time limit per move
+    The caches are fixed size tables, they are full before reaching the budget and then replace their entries
+    When a limit is reached, the best move of the last completed depth is played
+    """
+
+    def __init__(self, name: str = 'engine', dept: int = 3, time_limit: float = None, node_limit: int = None,
+                 memory: int = 32 << 20, **kwargs):
+        """
+        :param name:
+        :param dept: Maximum depth of each search
+        :param time_limit: Per move, in seconds
+        :param node_limit: Per move
+        :param memory: Byte budget of all the caches
+        :param kwargs: The SearchConfig ones
+        """
+        self.name = name
+        self.dept = dept
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.memory = memory
+        self.config = SearchConfig(**kwargs)
+        shares = {cache: share for cache, share in MEMORY_SHARES.items() if getattr(self.config, cache, True)}
+        total = sum(shares.values())
+        self.tt = TranspositionTable.from_bytes(int(memory * shares['tt'] / total)) if self.config.tt else None
+        self.pawn_hash = PawnHashTable.from_bytes(int(memory * shares['pawn_hash'] / total))
+        self.eval_cache = EvalCache.from_bytes(int(memory * shares['eval_cache'] / total)) \
+            if self.config.eval_cache else None
+        self.stats = {'moves': 0, 'nodes': 0, 'time': 0., 'peak_nodes': 0, 'limited_moves': 0, 'peak_memory': 0}
+
+    def __repr__(self):
+        return f'Engine({self.name!r}, dept={self.dept}, time_limit={self.time_limit}, ' \
+               f'node_limit={self.node_limit}, memory={self.memory}, {self.config})'
+
+    def __getstate__(self):
+        # The tables are rebuilt empty in the other process, there is no need to send their content
+        state = self.__dict__.copy()
+        state['tt'] = TranspositionTable(self.tt.size) if self.tt is not None else None
+        state['pawn_hash'] = PawnHashTable(self.pawn_hash.size)
+        state['eval_cache'] = EvalCache(self.eval_cache.size) if self.eval_cache is not None else None
+        return state
+
+    def cache_memory(self) -> int:
+        """
+        Estimation of the bytes used by the caches, at most the budget
+
+        :return:
+        """
+        return (self.tt.memory() if self.tt is not None else 0) + self.pawn_hash.memory() + (
+            self.eval_cache.memory() if self.eval_cache is not None else 0)
+
+    def play(self, game_data: GameData) -> SearchResult:
+        """
+        Search the best move within the limits, see src.bot.search for the result
+
+        :param game_data:
+        :return:
+        """
+        stats = new_stats()
+        stats['pawn_hash'], stats['eval_cache'] = self.pawn_hash, self.eval_cache
+        start = perf_counter()
+        result = search(game_data, self.dept, self.config, stats, self.time_limit, tt=self.tt,
+                        node_limit=self.node_limit)
+        self.stats['moves'] += 1
+        self.stats['nodes'] += stats['nodes']
+        self.stats['time'] += perf_counter() - start
+        self.stats['peak_nodes'] = max(self.stats['peak_nodes'], stats['nodes'])
+        if result['move'] is not None and result['dept'] < self.dept:
+            self.stats['limited_moves'] += 1
+        self.stats['peak_memory'] = max(self.stats['peak_memory'], self.cache_memory())
+        return result
+
+    def new_game(self):
+        """
+        Forget the previous positions
+
+        :return:
+        """
+        if self.tt is not None:
+            self.tt.clear()
+        self.pawn_hash.clear()
+        if self.eval_cache is not None:
+            self.eval_cache.clear()
+
+    def report(self) -> EngineReport:
+        """
+        What the engine used, to know how many of them fit on a host
+
+        :return:
+        """
+        return {
+            'name': self.name,
+            'moves': self.stats['moves'],
+            'nodes': self.stats['nodes'],
+            'peak_nodes': self.stats['peak_nodes'],
+            'nodes_per_sec': self.stats['nodes'] / self.stats['time'] if self.stats['time'] > 0 else 0.,
+            'limited_moves': self.stats['limited_moves'],
+            'memory_budget': self.memory,
+            'peak_memory': self.stats['peak_memory'],
+            'tt_hit_rate': self.tt.hit_rate() if self.tt is not None else 0.,
+            'pawn_hash_hit_rate': self.pawn_hash.hit_rate(),
+            'eval_cache_hit_rate': self.eval_cache.hit_rate() if self.eval_cache is not None else 0.,
+        }
+
+
+def process_peak_memory() -> int:
+    """
+    Peak resident memory of the whole process, in bytes, 0 if it can't be known
+    resource is Unix only (Linux reports it in KiB, macOS in bytes), Windows reads it with psutil if it is installed
+
+    :return:
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return 0
+        return getattr(psutil.Process().memory_info(), 'peak_wset', 0)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search a position with an engine instance and show what it used')
+    parser.add_argument('fen', nargs='?', default='rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+    parser.add_argument('--dept', type=int, default=4)
+    parser.add_argument('--time', type=float, default=None, help='Time limit per move, in seconds')
+    parser.add_argument('--nodes', type=int, default=None, help='Node limit per move')
+    parser.add_argument('--memory', type=int, default=32, help='Memory budget of the caches, in MiB')
+    args = parser.parse_args()
+
+    engine = Engine('engine', args.dept, args.time, args.nodes, args.memory << 20)
+    result = engine.play(parse_fen(args.fen))
+    print(f'move {format_pv([result["move"]])}, value {result["value"]}, completed dept {result["dept"]}/{args.dept}')
+    for key, value in engine.report().items():
+        print(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}')
+    print(f'process peak memory: {process_peak_memory() >> 20} MiB')
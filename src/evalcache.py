@@ -0,0 +1,121 @@
+"""
+Cache of the static evaluations of the search, the same leaves are reached by different move orders and again by
+every iteration
+It is two fixed arrays indexed by the low bits of the position hash, the other bits of the hash are kept to verify
+that an entry is the one of the position
+"""
+from array import array
+
+
+class EvalCache:
+    """
+    Fixed size table of the evaluations, its size is a power of two so that the index is the low bits of the hash
+    A new entry replaces the one stored at its index
+    """
+
+    # Bytes of an entry, the verification bits and the value
+    ENTRY_BYTES = 16
+
+    def __init__(self, size: int = 1 << 16):
+        """
+        :param size: Number of entries, rounded down to a power of two
+        """
+        self.bits = max(1, size).bit_length() - 1
+        self.size = 1 << self.bits
+        self.mask = self.size - 1
+        # A verification of 0 is an empty entry, the hashes that are under the size never use it
+        self.checks = array('Q', bytes(8 * self.size))
+        self.values = array('d', bytes(8 * self.size))
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @classmethod
+    def from_bytes(cls, budget: int) -> 'EvalCache':
+        """
+        The largest table that fits in the budget
+
+        :param budget: In bytes
+        :return:
+        """
+        return cls(max(1, budget // cls.ENTRY_BYTES))
+
+    def memory(self) -> int:
+        """
+        The arrays are allocated when created
+
+        :return:
+        """
+        return self.size * self.ENTRY_BYTES
+
+    def probe(self, key: int) -> float | None:
+        """
+        Return the evaluation of the position, or None
+
+        :param key: The position hash
+        :return:
+        """
+        index = key & self.mask
+        if self.checks[index] == key >> self.bits != 0:
+            self.stats['hits'] += 1
+            return self.values[index]
+        self.stats['misses'] += 1
+        return None
+
+    def store(self, key: int, value: float):
+        index = key & self.mask
+        self.checks[index], self.values[index] = key >> self.bits, value
+
+    def resize(self, size: int):
+        self.__init__(size)
+
+    def clear(self):
+        self.__init__(self.size)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups > 0 else 0.
+
+
+if __name__ == '__main__':
+    import argparse
+    import statistics
+    from time import perf_counter
+    from src.util import load_fen
+    from src.bot import SearchConfig, search, new_stats
+    from src.bench import SUITE, spread
+    from src.pawns import PawnHashTable
+
+    parser = argparse.ArgumentParser(description='Search the benchmark positions with and without the evaluation cache')
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--size', type=int, default=1 << 16, help='Number of entries of the evaluation cache')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of the suite per configuration')
+    parser.add_argument('--warmup', type=int, default=1, help='Unmeasured runs of the suite per configuration')
+    args = parser.parse_args()
+
+    # The two configurations are run alternately, starting with each one in turn, so that a drift of the speed of the
+    # machine affects both. Each search gets empty tables, like a search without given tables
+    speeds, nodes, lookups = {False: [], True: []}, {}, {'hits': 0, 'misses': 0}
+    for run in range(args.warmup + args.repeat):
+        for enabled in (False, True) if run % 2 == 0 else (True, False):
+            config = SearchConfig(eval_cache=enabled, eval_cache_size=args.size)
+            start, nodes[enabled] = perf_counter(), 0
+            for fen in SUITE:
+                stats = new_stats()
+                stats['pawn_hash'], stats['eval_cache'] = PawnHashTable(), EvalCache(args.size) if enabled else None
+                search(load_fen(fen), args.dept, config, stats)
+                nodes[enabled] += stats['nodes']
+                if enabled and run == 0:
+                    for key in lookups:
+                        lookups[key] += stats['eval_cache'].stats[key]
+            if run >= args.warmup:
+                speeds[enabled].append(nodes[enabled] / (perf_counter() - start))
+
+    for enabled in (False, True):
+        print(f'{"with" if enabled else "without"} evaluation cache: {nodes[enabled]} nodes, '
+              f'{statistics.median(speeds[enabled]):.0f} ± {spread(speeds[enabled]):.0f} nodes/s '
+              f'(median of {args.repeat} runs)')
+    gain = statistics.median(speeds[True]) / statistics.median(speeds[False]) - 1
+    noise = max(spread(speeds[False]), spread(speeds[True])) / statistics.median(speeds[False])
+    print(f'Speed change {gain:+.1%}' + (', within the noise of the runs' if abs(gain) <= noise else ''))
+    print(f'Evaluation cache: {lookups["hits"]} hits, {lookups["misses"]} misses, '
+          f'{lookups["hits"] / max(1, lookups["hits"] + lookups["misses"]):.1%} hit rate, '
+          f'{EvalCache(args.size).size} entries per search')
@@ -0,0 +1,370 @@
+"""
+FEN and EPD parsing and serialization, with a bulk mode loading whole files into compact arrays
+"""
+import argparse
+from array import array
+from time import perf_counter
+from typing import List, Dict, Tuple, Iterable
+from src.util import pieces_ids
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+Opcodes = Dict[str, str | List[str]]
+FenBatch = Dict[str, int | bytearray | array]
+
+CASTLES_BITS = {'K': 1, 'Q': 2, 'k': 4, 'q': 8}
+# Where the king and the rook must be for each castle
+CASTLES_PIECES = {'K': ((7, 4, 6), (7, 7, 4)), 'Q': ((7, 4, 6), (7, 0, 4)),
+                  'k': ((0, 4, 12), (0, 7, 10)), 'q': ((0, 4, 12), (0, 0, 10))}
+
+# Rank strings are the same in a lot of positions, their parsing is cached, both as tuples and as bytes
+_ranks_cache: Dict[str, Tuple[Tuple[int | None, ...], bytes]] = {}
+_RANKS_CACHE_SIZE = 100_000
+
+
+def _parse_rank(rank: str) -> Tuple[Tuple[int | None, ...], bytes]:
+    parsed = _ranks_cache.get(rank)
+    if parsed is not None:
+        return parsed
+
+    pieces = []
+    for e in rank:
+        if e in '12345678':
+            pieces.extend([None] * int(e))
+        elif e in 'PNBRQKpnbrqk':
+            pieces.append(pieces_ids[e])
+        else:
+            raise SyntaxError(f'Invalid FEN: unknown piece {e!r}')
+    if len(pieces) != 8:
+        raise SyntaxError(f'Invalid FEN: rank {rank!r} has {len(pieces)} tiles')
+
+    if len(_ranks_cache) >= _RANKS_CACHE_SIZE:
+        _ranks_cache.clear()
+    parsed = _ranks_cache[rank] = (tuple(pieces), bytes(piece or 0 for piece in pieces))
+    return parsed
+
+
+def _parse_fields(placement: str, turn: str, castles: str, en_passant: str) -> Tuple[List[Tuple], Position | None]:
+    """
+    Parse and check the four first fields, common to FEN and EPD
+    Return the parsed ranks (see _parse_rank) and the en-passant tile
+
+    :param placement:
+    :param turn:
+    :param castles:
+    :param en_passant:
+    :return:
+    """
+    ranks = placement.split('/')
+    if len(ranks) != 8:
+        raise SyntaxError(f'Invalid FEN: {len(ranks)} ranks')
+    if placement.count('K') != 1 or placement.count('k') != 1:
+        raise SyntaxError('Invalid FEN: each player must have exactly one king')
+    if 'P' in ranks[0] or 'p' in ranks[0] or 'P' in ranks[7] or 'p' in ranks[7]:
+        raise SyntaxError('Invalid FEN: pawn on the first or last rank')
+    parsed = [_parse_rank(rank) for rank in ranks]
+
+    if turn != 'w' and turn != 'b':
+        raise SyntaxError(f'Invalid FEN: unknown turn {turn!r}')
+
+    if castles != '-':
+        if len(set(castles)) != len(castles) or any(e not in CASTLES_BITS for e in castles):
+            raise SyntaxError(f'Invalid FEN: invalid castles {castles!r}')
+        for e in castles:
+            for x, y, piece in CASTLES_PIECES[e]:
+                if parsed[x][0][y] != piece:
+                    raise SyntaxError(f'Invalid FEN: castle {e} without its king or rook')
+
+    if en_passant == '-':
+        return parsed, None
+    if len(en_passant) != 2 or en_passant[0] not in 'abcdefgh' or en_passant[1] != ('6' if turn == 'w' else '3'):
+        raise SyntaxError(f'Invalid FEN: invalid en-passant {en_passant!r}')
+    x, y = 8 - int(en_passant[1]), 'abcdefgh'.index(en_passant[0])
+    pawn_x, pawn = (x + 1, 7) if turn == 'w' else (x - 1, 1)
+    if parsed[x][0][y] is not None or parsed[pawn_x][0][y] != pawn:
+        raise SyntaxError(f'Invalid FEN: en-passant {en_passant} without its pawn')
+    return parsed, (x, y)
+
+
+def _to_game_data(parsed: List[Tuple], turn: str, castles: str, en_passant: Position | None) -> GameData:
+    return {
+        'board': [list(rank[0]) for rank in parsed],
+        'turn': 0 if turn == 'w' else 1,
+        'castles': {
+            'Q': 'Q' in castles,
+            'K': 'K' in castles,
+            'q': 'q' in castles,
+            'k': 'k' in castles,
+        },
+        'en_passant': en_passant,
+    }
+
+
+def _parse_counter(text: str) -> int:
+    if not text.isdigit():
+        raise SyntaxError(f'Invalid FEN: invalid counter {text!r}')
+    return int(text)
+
+
+def parse_fen(string: str) -> GameData:
+    """
+    Parse a FEN, strictly: raise a SyntaxError for anything that isn't a valid position
+
+    :param string:
+    :return:
+    """
+    parts = string.split()
+    if len(parts) != 6:
+        raise SyntaxError(f'Invalid FEN: {len(parts)} fields instead of 6')
+    parsed, en_passant = _parse_fields(*parts[:4])
+    game_data = _to_game_data(parsed, parts[1], parts[2], en_passant)
+    game_data['count_b'] = _parse_counter(parts[4])
+    game_data['count'] = _parse_counter(parts[5])
+    return game_data
+
+
+def board_to_placement(board: Board) -> str:
+    """
+    The first field of a FEN
+
+    :param board:
+    :return:
+    """
+    ranks = []
+    for line in board:
+        rank, empty = '', 0
+        for piece in line:
+            if piece is None:
+                empty += 1
+            else:
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += pieces_ids[piece]
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    return '/'.join(ranks)
+
+
+def _fields_to_text(game_data: GameData) -> str:
+    castles = ''.join(e for e in 'KQkq' if game_data['castles'][e]) or '-'
+    en_passant = game_data['en_passant']
+    en_passant = '-' if en_passant is None else 'abcdefgh'[en_passant[1]] + str(8 - en_passant[0])
+    return f'{board_to_placement(game_data["board"])} {"w" if game_data["turn"] == 0 else "b"} {castles} {en_passant}'
+
+
+def to_fen(game_data: GameData) -> str:
+    """
+    Write a game data as a FEN, the inverse of parse_fen
+    The counters are 0 and 1 if the game data doesn't have them
+
+    :param game_data:
+    :return:
+    """
+    return f'{_fields_to_text(game_data)} {game_data.get("count_b", 0)} {game_data.get("count", 1)}'
+
+
+def _split_opcodes(text: str) -> List[str]:
+    """
+    Split on the semicolons that aren't quoted
+
+    :param text:
+    :return:
+    """
+    operations, current, quoted = [], '', False
+    for e in text:
+        if e == '"':
+            quoted = not quoted
+        if e == ';' and not quoted:
+            operations.append(current.strip())
+            current = ''
+        else:
+            current += e
+    if quoted:
+        raise SyntaxError('Invalid EPD: unterminated string')
+    if current.strip():
+        operations.append(current.strip())
+    return operations
+
+
+def parse_epd(string: str) -> Tuple[GameData, Opcodes]:
+    """
+    Parse an EPD line, return the game data and the opcodes
+    bm and am (best and avoid moves) are lists of moves, quoted operands like id are unquoted strings
+
+    :param string:
+    :return:
+    """
+    parts = string.strip().split(None, 4)
+    if len(parts) < 4:
+        raise SyntaxError(f'Invalid EPD: {len(parts)} fields instead of at least 4')
+    parsed, en_passant = _parse_fields(*parts[:4])
+    game_data = _to_game_data(parsed, parts[1], parts[2], en_passant)
+
+    opcodes = {}
+    for operation in _split_opcodes(parts[4] if len(parts) == 5 else ''):
+        opcode, _, operand = operation.partition(' ')
+        operand = operand.strip()
+        if opcode in ('bm', 'am'):
+            opcodes[opcode] = operand.split()
+        elif operand.startswith('"') and operand.endswith('"') and len(operand) >= 2:
+            opcodes[opcode] = operand[1:-1]
+        else:
+            opcodes[opcode] = operand
+    # The hmvc and fmvn opcodes are the FEN counters
+    if 'hmvc' in opcodes:
+        game_data['count_b'] = _parse_counter(opcodes['hmvc'])
+    if 'fmvn' in opcodes:
+        game_data['count'] = _parse_counter(opcodes['fmvn'])
+    return game_data, opcodes
+
+
+def to_epd(game_data: GameData, opcodes: Opcodes = None) -> str:
+    """
+    Write a game data and its opcodes as an EPD line, the inverse of parse_epd
+
+    :param game_data:
+    :param opcodes:
+    :return:
+    """
+    operations = []
+    for opcode, operand in (opcodes or {}).items():
+        if isinstance(operand, list):
+            operations.append(f'{opcode} {" ".join(operand)};')
+        elif opcode in ('id', 'c0', 'c1', 'c2', 'c3', 'c4', 'c5', 'c6', 'c7', 'c8', 'c9'):
+            operations.append(f'{opcode} "{operand}";')
+        else:
+            operations.append(f'{opcode} {operand};')
+    return ' '.join([_fields_to_text(game_data)] + operations)
+
+
+def new_batch() -> FenBatch:
+    """
+    Compact arrays of positions:
+    64 bytes of piece ids per board (0 for empty tiles), the turn, a castles mask (K=1, Q=2, k=4, q=8),
+    the en-passant tile x * 8 + y (-1 without one) and both counters
+
+    :return:
+    """
+    return {
+        'count': 0,
+        'boards': bytearray(),
+        'turns': bytearray(),
+        'castles': bytearray(),
+        'en_passant': array('b'),
+        'halfmove': array('H'),
+        'fullmove': array('H'),
+    }
+
+
+def parse_fens(lines: Iterable[str], skip_invalid: bool = False) -> FenBatch:
+    """
+    Parse many FENs (or EPDs, the opcodes being ignored) in one pass into a batch, see new_batch
+
+    :param lines:
+    :param skip_invalid: Skip the invalid lines instead of raising a SyntaxError
+    :return:
+    """
+    batch = new_batch()
+    boards, turns, castles_masks = batch['boards'], batch['turns'], batch['castles']
+    en_passants, halfmoves, fullmoves = batch['en_passant'], batch['halfmove'], batch['fullmove']
+    for number, line in enumerate(lines, 1):
+        parts = line.split(None, 6)
+        if len(parts) == 0:
+            continue
+        try:
+            if len(parts) < 4:
+                raise SyntaxError(f'Invalid FEN: {len(parts)} fields')
+            parsed, en_passant = _parse_fields(*parts[:4])
+            if len(parts) >= 6 and parts[4].isdigit() and parts[5].isdigit():
+                halfmove, fullmove = int(parts[4]), int(parts[5])
+            else:
+                halfmove, fullmove = 0, 1
+        except SyntaxError as e:
+            if skip_invalid:
+                continue
+            raise SyntaxError(f'Line {number}: {e}') from None
+
+        boards += b''.join([rank[1] for rank in parsed])
+        turns.append(parts[1] == 'b')
+        castles_mask = 0
+        if parts[2] != '-':
+            for e in parts[2]:
+                castles_mask |= CASTLES_BITS[e]
+        castles_masks.append(castles_mask)
+        en_passants.append(-1 if en_passant is None else en_passant[0] * 8 + en_passant[1])
+        halfmoves.append(min(halfmove, 0xFFFF))
+        fullmoves.append(min(fullmove, 0xFFFF))
+        batch['count'] += 1
+    return batch
+
+
+def parse_fen_file(path: str, skip_invalid: bool = False) -> FenBatch:
+    """
+    parse_fens on a file, with one position per line
+
+    :param path:
+    :param skip_invalid:
+    :return:
+    """
+    with open(path) as file:
+        return parse_fens(file, skip_invalid)
+
+
+def batch_game_data(batch: FenBatch, index: int) -> GameData:
+    """
+    Rebuild the game data of a position of a batch
+
+    :param batch:
+    :param index:
+    :return:
+    """
+    tiles = batch['boards'][index * 64:index * 64 + 64]
+    castles_mask = batch['castles'][index]
+    en_passant = batch['en_passant'][index]
+    return {
+        'board': [[tiles[i * 8 + j] or None for j in range(8)] for i in range(8)],
+        'turn': batch['turns'][index],
+        'castles': {e: castles_mask & bit != 0 for e, bit in CASTLES_BITS.items()},
+        'en_passant': None if en_passant == -1 else (en_passant // 8, en_passant % 8),
+        'count_b': batch['halfmove'][index],
+        'count': batch['fullmove'][index],
+    }
+
+
+def benchmark(fens: List[str], repeat: int = 10) -> Dict[str, float]:
+    """
+    Positions per second of each way to load positions
+
+    :param fens:
+    :param repeat:
+    :return:
+    """
+    parsed = [parse_fen(fen) for fen in fens]
+    results = {}
+    for name, function in (('parse_fen', lambda: [parse_fen(fen) for fen in fens]),
+                           ('parse_fens', lambda: parse_fens(fens)),
+                           ('to_fen', lambda: [to_fen(game_data) for game_data in parsed])):
+        start = perf_counter()
+        for _ in range(repeat):
+            function()
+        results[name] = len(fens) * repeat / (perf_counter() - start)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the FEN parsing, in positions per second')
+    parser.add_argument('file', nargs='?', help='File with one FEN per line, the benchmark suite by default')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            positions = [line.strip() for line in f if line.strip()]
+    else:
+        from src.bench import SUITE
+        positions = SUITE * 100
+    for key, value in benchmark(positions, args.repeat).items():
+        print(f'{key:<12} {value:>12.0f} positions/s')
@@ -0,0 +1,134 @@
+"""
+Overlay of the pygame app showing what the bot is searching, fed by a channel that the search publishes to
+"""
+import pygame
+from math import atan2, cos, sin
+from threading import Lock
+from time import perf_counter
+from typing import List, Dict, Tuple
+from src.bot import format_pv
+
+Position = Tuple[int, int]
+Move = Tuple[Position, Position]
+Snapshot = Dict[str, bool | int | float | List[Move] | None]
+
+PANEL_COLOR = (20, 20, 20, 190)
+TEXT_COLOR = (235, 235, 235)
+# The arrows of the first PV moves, from the first one, fading
+ARROW_COLORS = [(255, 170, 0, 200), (80, 160, 255, 160), (255, 170, 0, 120), (80, 160, 255, 90)]
+
+
+class StatsChannel:
+    """
+    The progress of a search, written by the search thread and read by the app one
+    Each publish bumps the version, so that a reader knows if something changed
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.values: Snapshot = {'searching': False, 'start': None, 'end': None, 'budget': None, 'dept': 0,
+                                 'value': None, 'pv': [], 'nodes': 0, 'hashfull': 0}
+        self.version = 0
+
+    def publish(self, **values):
+        with self.lock:
+            self.values.update(values)
+            self.version += 1
+
+    def snapshot(self) -> Tuple[int, Snapshot]:
+        """
+        A copy of the values, with their version
+
+        :return:
+        """
+        with self.lock:
+            return self.version, self.values.copy()
+
+
+class Hud:
+    """
+    The overlay, drawn on its own surface that is only redrawn a few times per second, and blitted on every frame
+    """
+
+    def __init__(self, channel: StatsChannel, size: Tuple[int, int], tile_size: Tuple[int, int],
+                 refresh: float = .25):
+        """
+        :param channel:
+        :param size: Of the board, in pixels
+        :param tile_size:
+        :param refresh: Minimum time between two redraws, in seconds
+        """
+        self.channel = channel
+        self.tile_width, self.tile_height = tile_size
+        self.refresh = refresh
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.font = pygame.font.SysFont('monospace', max(12, self.tile_height // 5))
+        self.version, self.drawn_at = -1, 0.
+
+    def draw(self, screen: pygame.Surface):
+        """
+        Blit the overlay, redrawing it first if it changed and wasn't redrawn recently
+        While searching the time used changes on its own, so the overlay is redrawn even without a new version
+
+        :param screen:
+        :return:
+        """
+        now = perf_counter()
+        if now - self.drawn_at >= self.refresh:
+            version, values = self.channel.snapshot()
+            if version != self.version or values['searching']:
+                self.redraw(values, now)
+                self.version, self.drawn_at = version, now
+        screen.blit(self.surface, (0, 0))
+
+    def redraw(self, values: Snapshot, now: float):
+        """
+        :param values: A snapshot of the channel
+        :param now:
+        :return:
+        """
+        self.surface.fill((0, 0, 0, 0))
+        for move, color in zip(values['pv'], ARROW_COLORS):
+            self.draw_arrow(move, color)
+
+        used = ((values['end'] or now) - values['start']) if values['start'] is not None else 0.
+        value = values['value']
+        lines = [
+            f'dept  {values["dept"]}' + (' (searching)' if values['searching'] else ''),
+            f'score {value:+.2f}' if value is not None else 'score -',
+            f'nodes {values["nodes"]} ({values["nodes"] / used if used > 0 else 0:.0f}/s)',
+            f'tt    {values["hashfull"] / 10:.1f}%',
+            f'time  {used:.1f}s' + (f' / {values["budget"]:.1f}s' if values['budget'] is not None else ''),
+            f'pv    {format_pv(values["pv"][:6])}',
+        ]
+        texts = [self.font.render(line, True, TEXT_COLOR) for line in lines]
+        margin = self.font.get_height() // 3
+        panel = pygame.Surface((max(text.get_width() for text in texts) + 2 * margin,
+                                sum(text.get_height() for text in texts) + 2 * margin), pygame.SRCALPHA)
+        panel.fill(PANEL_COLOR)
+        y = margin
+        for text in texts:
+            panel.blit(text, (margin, y))
+            y += text.get_height()
+        self.surface.blit(panel, (margin, margin))
+
+    def draw_arrow(self, move: Move, color: Tuple[int, int, int, int]):
+        """
+        An arrow from the center of a tile to the center of the other, positions are (row, column)
+
+        :param move:
+        :param color:
+        :return:
+        """
+        (x1, y1), (x2, y2) = move
+        start = ((y1 + .5) * self.tile_width, (x1 + .5) * self.tile_height)
+        end = ((y2 + .5) * self.tile_width, (x2 + .5) * self.tile_height)
+        angle = atan2(end[1] - start[1], end[0] - start[0])
+        head = self.tile_width / 3
+        base = (end[0] - head * cos(angle), end[1] - head * sin(angle))
+        pygame.draw.line(self.surface, color, start, base, max(2, self.tile_width // 10))
+        pygame.draw.polygon(self.surface, color, [
+            end,
+            (base[0] + head / 2 * sin(angle), base[1] - head / 2 * cos(angle)),
+            (base[0] - head / 2 * sin(angle), base[1] + head / 2 * cos(angle)),
+        ])
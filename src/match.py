@@ -0,0 +1,286 @@
+"""
+Headless matches between two engine configurations, to know if a change is stronger and not just faster
+"""
+import argparse
+import ast
+import math
+from multiprocessing import Pool
+from time import perf_counter
+from typing import List, Dict, Tuple
+from src.util import load_fen, position_to_coords, coords_to_position
+from src.moves import get_all_legal_moves, make_move_smooth, is_in_check
+from src.engine import Engine
+from src.archive import ArchiveWriter
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+GameRecord = Dict[str, str | int | float | List[str]]
+
+OPENINGS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkb1r/pppppppp/5n2/8/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 1 2',
+    'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3',
+    'rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pp1ppppp/2p5/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+]
+
+
+def new_engine(name: str, dept: int = 3, time_limit: float = 1., **kwargs) -> Engine:
+    """
+    Create an engine, the kwargs are the Engine (node_limit, memory) and SearchConfig ones
+
+    :param name:
+    :param dept: Maximum depth of each search
+    :param time_limit: Time budget of each move, in seconds
+    :param kwargs:
+    :return:
+    """
+    return Engine(name, dept, time_limit, **kwargs)
+
+
+def parse_engine(name: str, text: str, dept: int, time_limit: float, **kwargs) -> Engine:
+    """
+    Create an engine from something like 'null_move=False,lmr_reduction=2'
+
+    :param name:
+    :param text:
+    :param dept:
+    :param time_limit:
+    :param kwargs: Defaults of the other Engine parameters, overridden by the text
+    :return:
+    """
+    for part in filter(None, text.split(',')):
+        key, value = part.split('=')
+        kwargs[key.strip()] = ast.literal_eval(value.strip())
+    return new_engine(name, dept, time_limit, **kwargs)
+
+
+def position_key(game_data: GameData) -> Tuple:
+    """
+    A key identifying the position, for repetitions
+
+    :param game_data:
+    :return:
+    """
+    return (tuple(tuple(line) for line in game_data['board']), game_data['turn'], game_data['en_passant'],
+            tuple(sorted(game_data['castles'].items())))
+
+
+def is_insufficient_material(board: Board) -> bool:
+    """
+    Return whether nobody can checkmate anymore, only kings and at most one minor piece
+
+    :param board:
+    :return:
+    """
+    minors = 0
+    for line in board:
+        for piece in line:
+            if piece in (1, 4, 5, 7, 10, 11):
+                return False
+            if piece in (2, 3, 8, 9):
+                minors += 1
+    return minors <= 1
+
+
+def play_game(white: Engine, black: Engine, fen: str, max_plies: int = 200) -> GameRecord:
+    """
+    Play a whole game between two engines, with the move budgets of each one
+
+    :param white:
+    :param black:
+    :param fen:
+    :param max_plies: The game is adjudicated as a draw after it
+    :return:
+    """
+    game_data = load_fen(fen)
+    engines = (white, black)
+    for engine in engines:
+        engine.new_game()
+    record = {
+        'white': white.name, 'black': black.name, 'fen': fen, 'moves': [],
+        'nodes': [0, 0], 'time': [0., 0.], 'plies': [0, 0], 'peak_memory': [0, 0], 'limited_moves': [0, 0],
+    }
+    halfmove = game_data['count_b']
+    repetitions = {position_key(game_data): 1}
+
+    while True:
+        turn = game_data['turn']
+        legal_moves = get_all_legal_moves(game_data['board'], turn, game_data['en_passant'], game_data['castles'])
+        if len(legal_moves) == 0:
+            if is_in_check(game_data['board'], turn):
+                record['result'], record['reason'] = ('0-1' if turn == 0 else '1-0'), 'checkmate'
+            else:
+                record['result'], record['reason'] = '1/2-1/2', 'stalemate'
+            break
+        if halfmove >= 100:
+            record['result'], record['reason'] = '1/2-1/2', 'fifty moves'
+            break
+        if is_insufficient_material(game_data['board']):
+            record['result'], record['reason'] = '1/2-1/2', 'insufficient material'
+            break
+        if len(record['moves']) >= max_plies:
+            record['result'], record['reason'] = '1/2-1/2', 'adjudication'
+            break
+
+        engine = engines[turn]
+        nodes, limited_moves = engine.stats['nodes'], engine.stats['limited_moves']
+        start = perf_counter()
+        pos1, pos2 = engine.play(game_data)['move']
+        record['time'][turn] += perf_counter() - start
+        record['nodes'][turn] += engine.stats['nodes'] - nodes
+        record['limited_moves'][turn] += engine.stats['limited_moves'] - limited_moves
+        record['peak_memory'][turn] = engine.stats['peak_memory']
+        record['plies'][turn] += 1
+
+        board = game_data['board']
+        if board[pos2[0]][pos2[1]] is not None or board[pos1[0]][pos1[1]] in (1, 7):
+            halfmove = 0
+        else:
+            halfmove += 1
+        data = make_move_smooth(board, pos1, pos2, game_data['en_passant'], game_data['castles'])
+        game_data.update({'castles': data['castles'], 'en_passant': data['en_passant'], 'turn': 1 - turn})
+        record['moves'].append(position_to_coords(pos1) + position_to_coords(pos2))
+
+        key = position_key(game_data)
+        repetitions[key] = repetitions.get(key, 0) + 1
+        if repetitions[key] >= 3:
+            record['result'], record['reason'] = '1/2-1/2', 'repetition'
+            break
+
+    return record
+
+
+def _play_game(args: Tuple[Engine, Engine, str, int]) -> GameRecord:
+    return play_game(*args)
+
+
+def elo_estimate(wins: int, draws: int, losses: int) -> Tuple[float, float, float]:
+    """
+    Return the Elo difference and its 95% confidence interval, from the scores of the first engine
+
+    :param wins:
+    :param draws:
+    :param losses:
+    :return:
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return 0., -math.inf, math.inf
+
+    def to_elo(score):
+        if score <= 0:
+            return -math.inf
+        if score >= 1:
+            return math.inf
+        return 400 * math.log10(score / (1 - score))
+
+    score = (wins + draws / 2) / games
+    deviation = math.sqrt((wins * (1 - score) ** 2 + draws * (.5 - score) ** 2 + losses * score ** 2) / games)
+    margin = 1.96 * deviation / math.sqrt(games)
+    return to_elo(score), to_elo(score - margin), to_elo(score + margin)
+
+
+def run_match(engine_a: Engine, engine_b: Engine, games: int, openings: List[str] = None, workers: int = None,
+              output: str = None, max_plies: int = 200, archive: str = None) -> Dict[str, int | float]:
+    """
+    Play games between two engines in a process pool, each opening being played with both colors
+    Return the W/D/L of the first engine, its Elo difference and the speed of both engines
+
+    :param engine_a:
+    :param engine_b:
+    :param games:
+    :param openings:
+    :param workers: Number of processes, the number of CPUs if None
+    :param output: If given, file where to write one line per game
+    :param max_plies:
+    :param archive: If given, game archive where to write the games, see src.archive
+    :return:
+    """
+    openings = openings or OPENINGS
+    jobs = []
+    for i in range(games):
+        fen = openings[i // 2 % len(openings)]
+        jobs.append((engine_a, engine_b, fen, max_plies) if i % 2 == 0 else (engine_b, engine_a, fen, max_plies))
+
+    report = {'wins': 0, 'draws': 0, 'losses': 0}
+    totals = {engine_a.name: [0, 0., 0, 0, 0], engine_b.name: [0, 0., 0, 0, 0]}  # Nodes, time, plies, limited, memory
+    file = open(output, 'w') if output is not None else None
+    writer = ArchiveWriter(archive) if archive is not None else None
+    try:
+        with Pool(workers) as pool:
+            for record in pool.imap_unordered(_play_game, jobs):
+                if record['result'] == '1/2-1/2':
+                    report['draws'] += 1
+                elif (record['result'] == '1-0') == (record['white'] == engine_a.name):
+                    report['wins'] += 1
+                else:
+                    report['losses'] += 1
+                for color, name in enumerate((record['white'], record['black'])):
+                    totals[name][0] += record['nodes'][color]
+                    totals[name][1] += record['time'][color]
+                    totals[name][2] += record['plies'][color]
+                    totals[name][3] += record['limited_moves'][color]
+                    totals[name][4] = max(totals[name][4], record['peak_memory'][color])
+                if file is not None:
+                    file.write(f'{record["result"]}\t{record["white"]}\t{record["black"]}\t{record["reason"]}\t'
+                               f'{record["fen"]}\t{" ".join(record["moves"])}\n')
+                if writer is not None:
+                    writer.write_game([(coords_to_position(move[:2]), coords_to_position(move[2:]), None)
+                                       for move in record['moves']], record['result'],
+                                      {'White': record['white'], 'Black': record['black'],
+                                       'Termination': record['reason']}, record['fen'])
+                print(f'{record["white"]} - {record["black"]}: {record["result"]} ({record["reason"]}), '
+                      f'+{report["wins"]} ={report["draws"]} -{report["losses"]}')
+    finally:
+        if file is not None:
+            file.close()
+        if writer is not None:
+            writer.close()
+
+    report['elo'], report['elo_low'], report['elo_high'] = elo_estimate(report['wins'], report['draws'],
+                                                                        report['losses'])
+    for key, name in (('a', engine_a.name), ('b', engine_b.name)):
+        nodes, time, plies, limited_moves, peak_memory = totals[name]
+        report[f'nps_{key}'] = nodes / time if time > 0 else 0.
+        report[f'time_per_move_{key}'] = time / plies if plies > 0 else 0.
+        report[f'limited_moves_{key}'] = limited_moves
+        report[f'peak_memory_{key}'] = peak_memory
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play a match between two engine configurations')
+    parser.add_argument('--a', default='', help="SearchConfig of the first engine, e.g. 'null_move=False'")
+    parser.add_argument('--b', default='', help='SearchConfig of the second engine')
+    parser.add_argument('--games', type=int, default=16)
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--time', type=float, default=1., help='Time budget per move, in seconds')
+    parser.add_argument('--nodes', type=int, default=None, help='Node limit per move')
+    parser.add_argument('--memory', type=int, default=32, help='Memory budget of the caches of each engine, in MiB')
+    parser.add_argument('--openings', help='File with one opening FEN per line')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-plies', type=int, default=200)
+    parser.add_argument('--output', default='games.txt', help='Where to write the games')
+    parser.add_argument('--archive', default=None, help='Game archive where to also write the games')
+    args = parser.parse_args()
+
+    fens = None
+    if args.openings:
+        with open(args.openings) as f:
+            fens = [line.strip() for line in f if line.strip()]
+    limits = {'node_limit': args.nodes, 'memory': args.memory << 20}
+    result = run_match(parse_engine('A', args.a, args.dept, args.time, **limits),
+                       parse_engine('B', args.b, args.dept, args.time, **limits),
+                       args.games, fens, args.workers, args.output, args.max_plies, args.archive)
+    games = result['wins'] + result['draws'] + result['losses']
+    print(f'\nA vs B: +{result["wins"]} ={result["draws"]} -{result["losses"]} ({games} games)')
+    print(f'Elo: {result["elo"]:+.1f} [{result["elo_low"]:+.1f}, {result["elo_high"]:+.1f}]')
+    for key, name in (('a', 'A'), ('b', 'B')):
+        print(f'{name}: {result[f"nps_{key}"]:.0f} nodes/s, {result[f"time_per_move_{key}"]:.3f}s/move, '
+              f'{result[f"limited_moves_{key}"]} limited moves, '
+              f'{result[f"peak_memory_{key}"] >> 10} KiB peak cache memory')
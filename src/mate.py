@@ -0,0 +1,320 @@
+"""
+Mate-in-N solver, using a depth-limited depth-first proof-number search (df-pn)
+No static evaluation at all, a position is either proven (forced mate) or disproven
+"""
+import argparse
+from time import perf_counter
+from typing import List, Dict, Tuple
+from src.util import load_fen, position_to_coords
+from src.moves import get_all_legal_moves, make_move_smooth, reverse_moves, is_in_check
+from src.zobrist import hash_game_data
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+Move = Tuple[Position, Position]
+MateResult = Dict[str, str | int | float | List[str] | None]
+
+# Proof and disproof numbers are capped to it, a node with a proof number of PN_INFINITE is disproven
+PN_INFINITE = 10 ** 9
+
+# Some puzzles with their mate distance, to time the solver
+PUZZLES = [
+    ('6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1', 1),
+    ('r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4', 1),
+    ('k7/8/2K5/8/8/8/8/7R w - - 0 1', 2),
+    ('6k1/pp4p1/2p5/2bp4/8/P5Pb/1P3rrP/2BRRN1K b - - 0 1', 2),
+    ('r2qk2r/pb4pp/1n2Pb2/2B2Q2/p1p5/2P5/2B2PPP/RN2R1K1 w - - 1 0', 2),
+    ('5rk1/1p1q2bp/p2pN1p1/2pP2Bn/2P3P1/1P6/P4QKP/5R2 w - - 1 0', 2),
+    ('k7/8/8/3K4/8/8/8/7R w - - 0 1', 3),
+    ('1k6/8/8/2K5/8/8/8/7R w - - 0 1', 3),
+]
+
+
+class MateSearchAborted(Exception):
+    """
+    Raised when the node limit of the solver is reached
+    """
+
+
+class MateSolver:
+    """
+    Proof-number search for forced mates, with its own hash table of proof and disproof numbers
+    The attacker is the side to move at the root, its moves are OR nodes and the defender ones are AND nodes
+    """
+
+    def __init__(self, checks_only: bool = False, table_size: int = 1_000_000, max_nodes: int = None):
+        """
+        :param checks_only: Only consider the checking moves of the attacker, way faster but some mates are missed
+        :param table_size: Maximum number of entries in the hash table, it is cleared when it is full
+        :param max_nodes: The search is aborted after it
+        """
+        self.checks_only = checks_only
+        self.table_size = table_size
+        self.max_nodes = max_nodes
+        self.table: Dict[Tuple[int, int], Tuple[int, int]] = {}  # (hash, remaining plies) -> (proof, disproof)
+        self.nodes = 0
+        self.attacker = 0
+
+    def solve(self, game_data: GameData, max_n: int) -> MateResult:
+        """
+        Look for the shortest forced mate in at most max_n moves
+        Return something like
+        {
+            "status": 'mate', 'no mate' or 'unknown' if the node limit was reached,
+            "n": The mate distance, None without mate,
+            "line": List[str], the mating line with the best defence,
+            "nodes": The number of nodes searched,
+            "time": In seconds
+        }
+        With checks_only, 'no mate' only means that there is no mate with checks only
+
+        :param game_data:
+        :param max_n:
+        :return:
+        """
+        start, self.nodes = perf_counter(), 0
+        game_data = {
+            'board': [line.copy() for line in game_data['board']],
+            'turn': game_data['turn'],
+            'en_passant': game_data['en_passant'],
+            'castles': game_data['castles'].copy(),
+        }
+        self.attacker = game_data['turn']
+        result = {"status": 'no mate', "n": None, "line": [], "nodes": 0, "time": 0.}
+        try:
+            for n in range(1, max_n + 1):
+                if self.prove(game_data, 2 * n - 1):
+                    result.update({"status": 'mate', "n": n, "line": self.mating_line(game_data, n)})
+                    break
+        except MateSearchAborted:
+            result['status'] = 'unknown'
+        result.update({"nodes": self.nodes, "time": perf_counter() - start})
+        return result
+
+    def prove(self, game_data: GameData, remaining: int) -> bool:
+        """
+        Search until the node is either proven or disproven, return whether it is proven
+
+        :param game_data:
+        :param remaining: Remaining plies
+        :return:
+        """
+        self.mid(game_data, remaining, PN_INFINITE, PN_INFINITE)
+        return self.table[(hash_game_data(game_data), remaining)][0] == 0
+
+    def moves(self, game_data: GameData, or_node: bool) -> List[Move]:
+        """
+        The moves to explore from a node
+
+        :param game_data:
+        :param or_node:
+        :return:
+        """
+        board, turn = game_data['board'], game_data['turn']
+        all_legal_moves = get_all_legal_moves(board, turn, game_data['en_passant'], game_data['castles'])
+        moves = []
+        for piece_pos in all_legal_moves:
+            for move in all_legal_moves[piece_pos]:
+                if or_node and self.checks_only:
+                    data = make_move_smooth(board, piece_pos, move, game_data['en_passant'],
+                                            game_data['castles'].copy())
+                    gives_check = is_in_check(board, 1 - turn)
+                    reverse_moves(board, data['old_tiles'])
+                    if not gives_check:
+                        continue
+                moves.append((piece_pos, move))
+        return moves
+
+    def store(self, key: Tuple[int, int], proof: int, disproof: int):
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+        self.table[key] = (proof, disproof)
+
+    def mid(self, game_data: GameData, remaining: int, proof_threshold: int, disproof_threshold: int):
+        """
+        Multiple iterative deepening, expand the node until one of its numbers reaches its threshold
+
+        :param game_data:
+        :param remaining:
+        :param proof_threshold:
+        :param disproof_threshold:
+        :return:
+        """
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise MateSearchAborted()
+
+        board = game_data['board']
+        key = (hash_game_data(game_data), remaining)
+        or_node = game_data['turn'] == self.attacker
+        entry = self.table.get(key)
+        if entry is not None and (entry[0] == 0 or entry[1] == 0):  # Already solved
+            return
+
+        # Terminal nodes
+        if or_node and remaining == 0:
+            return self.store(key, PN_INFINITE, 0)
+        moves = self.moves(game_data, or_node)
+        if len(moves) == 0:
+            if not or_node and is_in_check(board, game_data['turn']):
+                return self.store(key, 0, PN_INFINITE)
+            return self.store(key, PN_INFINITE, 0)
+        if remaining == 0:
+            return self.store(key, PN_INFINITE, 0)
+
+        # Children keys, computed once for the whole expansion
+        children = []
+        for piece_pos, move in moves:
+            data = make_move_smooth(board, piece_pos, move, game_data['en_passant'], game_data['castles'].copy())
+            data['turn'] = 1 - game_data['turn']
+            children.append(((hash_game_data(data), remaining - 1), piece_pos, move))
+            reverse_moves(board, data['old_tiles'])
+
+        while True:
+            # The numbers that matter are the minimum ones for an OR node, and the sums for an AND node
+            best, best_value, second_value, total = None, PN_INFINITE, PN_INFINITE, 0
+            for child in children:
+                proof, disproof = self.table.get(child[0], (1, 1))
+                value, other = (proof, disproof) if or_node else (disproof, proof)
+                if value < best_value:
+                    best, best_value, second_value = child, value, best_value
+                elif value < second_value:
+                    second_value = value
+                total = min(total + other, PN_INFINITE)
+            proof, disproof = (best_value, total) if or_node else (total, best_value)
+
+            if proof >= proof_threshold or disproof >= disproof_threshold or best is None:
+                return self.store(key, proof, disproof)
+            self.store(key, proof, disproof)
+
+            child_key, piece_pos, move = best
+            child_proof, child_disproof = self.table.get(child_key, (1, 1))
+            if or_node:
+                child_proof_threshold = min(proof_threshold, second_value + 1)
+                child_disproof_threshold = min(disproof_threshold - disproof + child_disproof, PN_INFINITE)
+            else:
+                child_proof_threshold = min(proof_threshold - proof + child_proof, PN_INFINITE)
+                child_disproof_threshold = min(disproof_threshold, second_value + 1)
+
+            data = make_move_smooth(board, piece_pos, move, game_data['en_passant'], game_data['castles'].copy())
+            data['turn'] = 1 - game_data['turn']
+            self.mid(data, remaining - 1, child_proof_threshold, child_disproof_threshold)
+            reverse_moves(board, data['old_tiles'])
+
+    def mate_distance(self, game_data: GameData, max_n: int) -> int | None:
+        """
+        The shortest mate distance of an OR node, None if there is no mate within max_n
+
+        :param game_data:
+        :param max_n:
+        :return:
+        """
+        for n in range(1, max_n + 1):
+            if self.prove(game_data, 2 * n - 1):
+                return n
+        return None
+
+    def mating_line(self, game_data: GameData, n: int) -> List[str]:
+        """
+        Follow a proven node, the attacker takes the shortest mate and the defender the longest resistance
+
+        :param game_data:
+        :param n: The mate distance of the node
+        :return:
+        """
+        board, line, undo = game_data['board'], [], []
+        while n > 0:
+            # Attacker, any move keeping the mate within n moves
+            for piece_pos, move in self.moves(game_data, True):
+                data = make_move_smooth(board, piece_pos, move, game_data['en_passant'], game_data['castles'].copy())
+                data['turn'] = 1 - game_data['turn']
+                if self.prove(data, 2 * n - 2):
+                    break
+                reverse_moves(board, data['old_tiles'])
+            else:
+                break
+            line.append(position_to_coords(piece_pos) + position_to_coords(move))
+            undo.append(data['old_tiles'])
+            game_data = data
+
+            # Defender, the move delaying the mate the most
+            defence, defence_n = None, 0
+            for piece_pos, move in self.moves(game_data, False):
+                data = make_move_smooth(board, piece_pos, move, game_data['en_passant'], game_data['castles'].copy())
+                data['turn'] = 1 - game_data['turn']
+                distance = self.mate_distance(data, n - 1)
+                reverse_moves(board, data['old_tiles'])
+                if distance is not None and distance > defence_n:
+                    defence, defence_n = (piece_pos, move), distance
+            if defence is None:  # Checkmate
+                break
+            data = make_move_smooth(board, defence[0], defence[1], game_data['en_passant'],
+                                    game_data['castles'].copy())
+            data['turn'] = 1 - game_data['turn']
+            line.append(position_to_coords(defence[0]) + position_to_coords(defence[1]))
+            undo.append(data['old_tiles'])
+            game_data, n = data, defence_n
+
+        for old_tiles in reversed(undo):
+            reverse_moves(board, old_tiles)
+        return line
+
+
+def solve_mate(fen: str, max_n: int, checks_only: bool = False, max_nodes: int = None) -> MateResult:
+    """
+    Look for a forced mate in at most max_n moves from a FEN, see MateSolver.solve
+
+    :param fen:
+    :param max_n:
+    :param checks_only:
+    :param max_nodes:
+    :return:
+    """
+    return MateSolver(checks_only, max_nodes=max_nodes).solve(load_fen(fen), max_n)
+
+
+def run_puzzles(puzzles: List[Tuple[str, int]], checks_only: bool = False, max_nodes: int = None) -> float:
+    """
+    Solve a puzzle suite, printing the result and timing of each puzzle, return the total time
+
+    :param puzzles: List of (fen, mate distance)
+    :param checks_only:
+    :param max_nodes:
+    :return:
+    """
+    total = 0.
+    for fen, n in puzzles:
+        result = solve_mate(fen, n, checks_only, max_nodes)
+        total += result['time']
+        found = f'mate in {result["n"]}' if result['status'] == 'mate' else result['status']
+        print(f'{found:<10} (expected {n}) {result["nodes"]:>8} nodes {result["time"]:>7.2f}s  {fen}  '
+              f'{" ".join(result["line"])}')
+    print(f'Total: {total:.2f}s')
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find forced mates')
+    parser.add_argument('fen', nargs='?', help='Position to solve, the puzzle suite is timed if missing')
+    parser.add_argument('--max-n', type=int, default=3, help='Maximum mate distance, in moves')
+    parser.add_argument('--checks-only', action='store_true', help='Only consider checking moves for the attacker')
+    parser.add_argument('--max-nodes', type=int)
+    parser.add_argument('--suite', help="File with one 'FEN;N' puzzle per line")
+    args = parser.parse_args()
+
+    if args.fen is not None:
+        mate = solve_mate(args.fen, args.max_n, args.checks_only, args.max_nodes)
+        if mate['status'] == 'mate':
+            print(f'Mate in {mate["n"]}: {" ".join(mate["line"])}')
+        elif mate['status'] == 'no mate':
+            print(f'No mate within {args.max_n} moves{" with checks only" if args.checks_only else ""}')
+        else:
+            print('Unknown, node limit reached')
+        print(f'{mate["nodes"]} nodes, {mate["time"]:.2f}s')
+    else:
+        suite = PUZZLES
+        if args.suite:
+            with open(args.suite) as f:
+                suite = [(line.split(';')[0].strip(), int(line.split(';')[1])) for line in f if line.strip()]
+        run_puzzles(suite, args.checks_only, args.max_nodes)
@@ -239,7 +239,8 @@ def make_move(board: Board, pos1: Position, pos2: Position) -> Board:
     board[x1][y1], board[x2][y2] = None, board[x1][y1]
     return board
 
-def make_move_smooth(board: Board, pos1: Position, pos2: Position, en_passant: Position, castles: Dict[str, bool]) -> GameData:
+def make_move_smooth(board: Board, pos1: Position, pos2: Position, en_passant: Position, castles: Dict[str, bool],
+                     promotion: int = None) -> GameData:
     """
     Make a move considering game data, and returning the new game data
 
@@ -248,6 +249,7 @@ def make_move_smooth(board: Board, pos1: Position, pos2: Position, en_passant: P
     :param pos2:
     :param en_passant:
     :param castles:
+    :param promotion: The white id of the promotion piece (2 to 5), a queen if None
     :return:
     """
     x1, y1 = pos1
@@ -286,8 +288,8 @@ def make_move_smooth(board: Board, pos1: Position, pos2: Position, en_passant: P
             y2] is None:  # En-passants, assuming that they are legal if there isn't a piece on a diagonal move from a pawn
             old_tiles[(x1, y2)] = board[x1][y2]
             board[x1][y2] = None
-        if x2 == 7 or x2 == 0:  # Queen promotion, assuming that a pawn on the first or the last line can promote
-            board[x1][y1] += 4  # From pawn to queen id
+        if x2 == 7 or x2 == 0:  # Promotion, assuming that a pawn on the first or the last line can promote
+            board[x1][y1] += (promotion or 5) - 1  # From pawn to the promotion id, a queen by default
 
     # Castles, assuming that they are legal if the king love two tiles on a side
     if board[x1][y1] == 6 or board[x1][y1] == 12:
@@ -424,3 +426,76 @@ def get_black_checks(board: Board) -> List[Position]:
             if move == white_king:
                 checks.append(piece_pos)
     return checks
+
+
+def is_square_attacked(board: Board, position: Position, player: int) -> bool:
+    """
+    Return whether the given player attacks the given tile
+    Way cheaper than get_white_checks or get_black_checks, it only looks from the tile
+
+    :param board:
+    :param position:
+    :param player:
+    :return:
+    """
+    x, y = position
+    offset = 0 if player == 0 else 6
+
+    # Pawns, a white pawn attacks from the row below, a black one from the row above
+    i = x + 1 if player == 0 else x - 1
+    if 0 <= i < 8:
+        if y > 0 and board[i][y - 1] == 1 + offset:
+            return True
+        if y < 7 and board[i][y + 1] == 1 + offset:
+            return True
+
+    # Knights
+    for dx, dy in ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)):
+        i, j = x + dx, y + dy
+        if 0 <= i < 8 and 0 <= j < 8 and board[i][j] == 2 + offset:
+            return True
+
+    # King
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            i, j = x + dx, y + dy
+            if 0 <= i < 8 and 0 <= j < 8 and board[i][j] == 6 + offset:
+                return True
+
+    # Sliding pieces
+    for dx, dy in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+        i, j = x + dx, y + dy
+        while 0 <= i < 8 and 0 <= j < 8:
+            piece = board[i][j]
+            if piece is not None:
+                if piece == 3 + offset or piece == 5 + offset:
+                    return True
+                break
+            i, j = i + dx, j + dy
+    for dx, dy in ((1, 0), (0, -1), (0, 1), (-1, 0)):
+        i, j = x + dx, y + dy
+        while 0 <= i < 8 and 0 <= j < 8:
+            piece = board[i][j]
+            if piece is not None:
+                if piece == 4 + offset or piece == 5 + offset:
+                    return True
+                break
+            i, j = i + dx, j + dy
+
+    return False
+
+
+def is_in_check(board: Board, player: int) -> bool:
+    """
+    Return whether the king of the given player is attacked
+
+    :param board:
+    :param player:
+    :return:
+    """
+    king = 6 if player == 0 else 12
+    for i in range(8):
+        for j in range(8):
+            if board[i][j] == king:
+                return is_square_attacked(board, (i, j), 1 - player)
+    return False
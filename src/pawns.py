@@ -0,0 +1,169 @@
+"""
+Pawn structure evaluation, cached in a pawn hash table
+The pawns rarely move between two nodes of a search, so most evaluations are found in the table
+"""
+from typing import List, Tuple
+from src.zobrist import piece_keys
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+
+DOUBLED_PAWN = -1.0  # For each pawn more than one on a column
+ISOLATED_PAWN = -1.5  # For each pawn without friendly pawn on the adjacent columns
+PASSED_PAWN = [0.0, 0.5, 1.0, 1.5, 2.5, 4.0, 6.0, 0.0]  # By rank, from the pawn point of view
+
+
+def pawn_key(board: Board) -> int:
+    """
+    Zobrist key of the pawns only, evaluate_position computes it while scanning the board
+
+    :param board:
+    :return:
+    """
+    key = 0
+    for i in range(8):
+        line = board[i]
+        for j in range(8):
+            if line[j] == 1 or line[j] == 7:
+                key ^= piece_keys[line[j]][i * 8 + j]
+    return key
+
+
+def evaluate_pawn_structure(board: Board) -> float:
+    """
+    Evaluate the doubled, isolated and passed pawns
+    Negative is good for black, positive is good for white
+
+    :param board:
+    :return:
+    """
+    white, black = [[] for _ in range(8)], [[] for _ in range(8)]  # Rows of the pawns, by column
+    for i in range(1, 7):
+        line = board[i]
+        for j in range(8):
+            if line[j] == 1:
+                white[j].append(i)
+            elif line[j] == 7:
+                black[j].append(i)
+
+    total = 0.
+    for j in range(8):
+        if len(white[j]) == 0 and len(black[j]) == 0:
+            continue
+        columns = range(max(0, j - 1), min(8, j + 2))
+        if len(white[j]) > 1:
+            total += DOUBLED_PAWN * (len(white[j]) - 1)
+        if len(black[j]) > 1:
+            total -= DOUBLED_PAWN * (len(black[j]) - 1)
+        if len(white[j]) > 0 and len(white[j - 1] if j > 0 else ()) == 0 and len(white[j + 1] if j < 7 else ()) == 0:
+            total += ISOLATED_PAWN * len(white[j])
+        if len(black[j]) > 0 and len(black[j - 1] if j > 0 else ()) == 0 and len(black[j + 1] if j < 7 else ()) == 0:
+            total -= ISOLATED_PAWN * len(black[j])
+
+        # A white pawn goes to the row 0, it is passed if no black pawn is in front of it or on the adjacent columns
+        for i in white[j]:
+            if all(row >= i for column in columns for row in black[column]):
+                total += PASSED_PAWN[7 - i]
+        for i in black[j]:
+            if all(row <= i for column in columns for row in white[column]):
+                total -= PASSED_PAWN[i]
+
+    return total
+
+
+class PawnHashTable:
+    """
+    Fixed size table of the pawn structure evaluations, indexed by the pawn key modulo the size
+    A new entry replaces the one stored at its index
+    """
+
+    # Bytes of a filled entry, its two list slots, the key and the value
+    ENTRY_BYTES = 80
+    SLOT_BYTES = 16
+
+    def __init__(self, size: int = 1 << 14):
+        """
+        :param size: Number of entries
+        """
+        self.size = size
+        self.keys: List[int | None] = [None] * size
+        self.values: List[float] = [0.] * size
+        self.stats = {'hits': 0, 'misses': 0}
+        self.filled = 0
+
+    @classmethod
+    def from_bytes(cls, budget: int) -> 'PawnHashTable':
+        """
+        The largest table that fits in the budget once full
+
+        :param budget: In bytes
+        :return:
+        """
+        return cls(max(1, budget // cls.ENTRY_BYTES))
+
+    def memory(self) -> int:
+        """
+        Estimation of the bytes used, the empty slots only cost their pointers
+
+        :return:
+        """
+        return self.size * self.SLOT_BYTES + self.filled * (self.ENTRY_BYTES - self.SLOT_BYTES)
+
+    def probe(self, board: Board, key: int) -> float:
+        """
+        Return the pawn structure evaluation, from the table if it is there, else computed and stored
+
+        :param board:
+        :param key: The pawn key of the board
+        :return:
+        """
+        index = key % self.size
+        if self.keys[index] == key:
+            self.stats['hits'] += 1
+            return self.values[index]
+        self.stats['misses'] += 1
+        if self.keys[index] is None:
+            self.filled += 1
+        value = evaluate_pawn_structure(board)
+        self.keys[index], self.values[index] = key, value
+        return value
+
+    def resize(self, size: int):
+        self.__init__(size)
+
+    def clear(self):
+        self.__init__(self.size)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups > 0 else 0.
+
+
+# Shared by the evaluations that don't get their own table
+pawn_hash = PawnHashTable()
+
+
+if __name__ == '__main__':
+    import argparse
+    from time import perf_counter
+    from src.util import load_fen
+    from src.bot import search, new_stats
+    from src.bench import SUITE
+    # Run as __main__, the evaluation uses the table of the imported src.pawns module
+    from src.pawns import pawn_hash
+
+    parser = argparse.ArgumentParser(description='Search the benchmark positions and show the pawn hash statistics')
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--size', type=int, default=1 << 14, help='Number of entries of the pawn hash table')
+    args = parser.parse_args()
+
+    pawn_hash.resize(args.size)
+    start, nodes = perf_counter(), 0
+    for fen in SUITE:
+        stats = new_stats()
+        search(load_fen(fen), args.dept, stats=stats)
+        nodes += stats['nodes']
+    elapsed = perf_counter() - start
+    print(f'{nodes} nodes in {elapsed:.2f}s, {nodes / elapsed:.0f} nodes/s')
+    print(f'Pawn hash: {pawn_hash.stats["hits"]} hits, {pawn_hash.stats["misses"]} misses, '
+          f'{pawn_hash.hit_rate():.1%} hit rate, {args.size} entries')
@@ -0,0 +1,331 @@
+"""
+PGN import and export: a streaming reader, SAN parsing and writing, and fast replay of the games
+"""
+import argparse
+import re
+from time import perf_counter
+from typing import List, Dict, Tuple, Iterator, TextIO
+from src.util import load_fen, coords_to_position, position_to_coords
+from src.moves import get_all_legal_moves, get_legal_moves, get_moves, make_move_smooth, reverse_moves, is_in_check
+from src.zobrist import hash_game_data
+from src.fen import to_fen
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+PgnGame = Dict[str, Dict[str, str] | List[str] | str]
+SanMove = Tuple[Position, Position, int | None]  # From, to, and the white id of the promotion piece
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SAN_PIECES = {'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+SAN_LETTERS = {2: 'N', 3: 'B', 4: 'R', 5: 'Q', 6: 'K'}
+
+TAG_REGEX = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*]')
+TOKEN_REGEX = re.compile(r'\{[^}]*}|;[^\n]*|\$\d+|[()]|[^\s(){};]+')
+MOVE_NUMBER_REGEX = re.compile(r'^\d+\.*')
+
+
+def read_games(file: TextIO) -> Iterator[PgnGame]:
+    """
+    Read the games of a PGN file one by one, only the current game is kept in memory
+    Each game looks like {"headers": Dict[str, str], "moves": List[str] of SAN moves, "result": str}
+    Comments, NAGs and variations are skipped
+
+    :param file:
+    :return:
+    """
+    headers, movetext = {}, []
+    for line in file:
+        line = line.strip()
+        if line.startswith('%'):  # Escape lines
+            continue
+        if line.startswith('['):
+            if movetext:
+                game = parse_movetext(headers, '\n'.join(movetext))
+                if headers or game['moves']:  # Not just a comment between two games
+                    yield game
+                headers, movetext = {}, []
+            match = TAG_REGEX.match(line)
+            if match is not None:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        elif line:
+            movetext.append(line)
+    if headers or movetext:
+        yield parse_movetext(headers, '\n'.join(movetext))
+
+
+def parse_movetext(headers: Dict[str, str], movetext: str) -> PgnGame:
+    """
+    Extract the SAN moves and the result of a movetext
+
+    :param headers:
+    :param movetext:
+    :return:
+    """
+    moves, result, variations = [], headers.get('Result', '*'), 0
+    for token in TOKEN_REGEX.findall(movetext):
+        first = token[0]
+        if first == '{' or first == ';' or first == '$':
+            continue
+        if token == '(':
+            variations += 1
+        elif token == ')':
+            variations -= 1
+        elif variations == 0:
+            if token in RESULTS:
+                result = token
+                continue
+            token = MOVE_NUMBER_REGEX.sub('', token)
+            if token:
+                moves.append(token)
+    return {"headers": headers, "moves": moves, "result": result}
+
+
+def _is_safe(game_data: GameData, pos1: Position, pos2: Position) -> bool:
+    """
+    Whether the move doesn't leave the king in check, played and taken back on the board
+
+    :param game_data:
+    :param pos1:
+    :param pos2:
+    :return:
+    """
+    board = game_data['board']
+    data = make_move_smooth(board, pos1, pos2, game_data['en_passant'], game_data['castles'].copy())
+    safe = not is_in_check(board, game_data['turn'])
+    reverse_moves(board, data['old_tiles'])
+    return safe
+
+
+def _candidates(game_data: GameData, piece: int, target: Position, from_x: int = None,
+                from_y: int = None) -> List[Position]:
+    """
+    The positions of the pieces with this id that have a legal move to the target, on the given row and column if
+    they are not None
+    The moves come from the generator of src.moves, only the ones reaching the target are checked for checks, in place
+    instead of on the board copies of get_legal_moves, which is about ten times slower on a whole game
+
+    :param game_data:
+    :param piece:
+    :param target:
+    :param from_x:
+    :param from_y:
+    :return:
+    """
+    board, candidates = game_data['board'], []
+    for i in range(8) if from_x is None else (from_x, ):
+        for j in range(8) if from_y is None else (from_y, ):
+            if board[i][j] == piece and target in get_moves(board, (i, j), game_data['en_passant'],
+                                                            game_data['castles']) \
+                    and _is_safe(game_data, (i, j), target):
+                candidates.append((i, j))
+    return candidates
+
+
+def parse_san(game_data: GameData, san: str) -> SanMove:
+    """
+    Find the legal move written in SAN, raise a SyntaxError if there isn't exactly one
+
+    :param game_data:
+    :param san:
+    :return:
+    """
+    board, turn = game_data['board'], game_data['turn']
+    offset = 0 if turn == 0 else 6
+    text = san.rstrip('+#!?')
+
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        x = 7 if turn == 0 else 0
+        pos1, pos2 = (x, 4), (x, 6 if len(text) == 3 else 2)
+        if board[x][4] != 6 + offset or pos2 not in get_legal_moves(board, pos1, game_data['en_passant'],
+                                                                     game_data['castles']):
+            raise SyntaxError(f'Illegal move {san}')
+        return pos1, pos2, None
+
+    promotion = None
+    if '=' in text:
+        text, _, letter = text.partition('=')
+        promotion = SAN_PIECES.get(letter)
+        if promotion is None or promotion == 6:
+            raise SyntaxError(f'Invalid promotion {san}')
+    elif len(text) > 2 and text[-1] in 'NBRQ' and text[0] in 'abcdefgh':  # Promotions without '=', like e8Q
+        promotion, text = SAN_PIECES[text[-1]], text[:-1]
+
+    if len(text) < 2 or text[-2] not in 'abcdefgh' or text[-1] not in '12345678':
+        raise SyntaxError(f'Invalid move {san}')
+    target = coords_to_position(text[-2:])
+    rest = text[:-2].replace('x', '')
+    kind = 1
+    if rest and rest[0] in SAN_PIECES:
+        kind, rest = SAN_PIECES[rest[0]], rest[1:]
+    from_x = from_y = None
+    for e in rest:
+        if e in 'abcdefgh':
+            from_y = 'abcdefgh'.index(e)
+        elif e in '12345678':
+            from_x = 8 - int(e)
+        else:
+            raise SyntaxError(f'Invalid move {san}')
+
+    if kind == 1:
+        if from_y is None:  # Pushes stay on their column
+            from_y = target[1]
+        if target[0] in (0, 7) and promotion is None:
+            promotion = 5
+    legal = _candidates(game_data, kind + offset, target, from_x, from_y)
+    if len(legal) != 1:
+        raise SyntaxError(f'{"Ambiguous" if len(legal) > 1 else "Illegal"} move {san}')
+    return legal[0], target, promotion if kind == 1 else None
+
+
+def to_san(game_data: GameData, pos1: Position, pos2: Position, promotion: int = None) -> str:
+    """
+    Write a legal move in SAN, with its check or checkmate suffix
+
+    :param game_data:
+    :param pos1:
+    :param pos2:
+    :param promotion: The white id of the promotion piece, a queen if None
+    :return:
+    """
+    board, turn = game_data['board'], game_data['turn']
+    piece = board[pos1[0]][pos1[1]]
+    kind = piece if piece < 7 else piece - 6
+
+    if kind == 6 and abs(pos2[1] - pos1[1]) == 2:
+        san = 'O-O' if pos2[1] == 6 else 'O-O-O'
+    elif kind == 1:
+        capture = pos1[1] != pos2[1]
+        san = ('abcdefgh'[pos1[1]] + 'x' if capture else '') + position_to_coords(pos2)
+        if pos2[0] in (0, 7):
+            san += '=' + SAN_LETTERS[promotion or 5]
+    else:
+        others = [other for other in _candidates(game_data, piece, pos2) if other != pos1]
+        disambiguation = ''
+        if others:
+            if all(other[1] != pos1[1] for other in others):
+                disambiguation = 'abcdefgh'[pos1[1]]
+            elif all(other[0] != pos1[0] for other in others):
+                disambiguation = str(8 - pos1[0])
+            else:
+                disambiguation = position_to_coords(pos1)
+        capture = 'x' if board[pos2[0]][pos2[1]] is not None else ''
+        san = SAN_LETTERS[kind] + disambiguation + capture + position_to_coords(pos2)
+
+    data = make_move_smooth(board, pos1, pos2, game_data['en_passant'], game_data['castles'].copy(), promotion)
+    if is_in_check(board, 1 - turn):
+        san += '+' if get_all_legal_moves(board, 1 - turn, data['en_passant'], data['castles']) else '#'
+    reverse_moves(board, data['old_tiles'])
+    return san
+
+
+def replay(game: PgnGame, emit: str = 'hash') -> Iterator[Dict[str, int | str | SanMove]]:
+    """
+    Replay a game on a single board, yielding something like {"ply", "san", "move", "hash"} after each move
+    emit is 'hash' for the Zobrist hash of the position, 'fen' for its FEN or None for nothing
+
+    :param game:
+    :param emit:
+    :return:
+    """
+    game_data = load_fen(game['headers'].get('FEN', START_FEN))
+    board = game_data['board']
+    for ply, san in enumerate(game['moves'], 1):
+        pos1, pos2, promotion = parse_san(game_data, san)
+        if board[pos2[0]][pos2[1]] is not None or board[pos1[0]][pos1[1]] in (1, 7):
+            game_data['count_b'] = 0
+        else:
+            game_data['count_b'] += 1
+        data = make_move_smooth(board, pos1, pos2, game_data['en_passant'], game_data['castles'], promotion)
+        game_data['en_passant'] = data['en_passant']
+        game_data['turn'] = 1 - game_data['turn']
+        if game_data['turn'] == 0:
+            game_data['count'] += 1
+
+        position = {"ply": ply, "san": san, "move": (pos1, pos2, promotion)}
+        if emit == 'hash':
+            position['hash'] = hash_game_data(game_data)
+        elif emit == 'fen':
+            position['fen'] = to_fen(game_data)
+        yield position
+
+
+def write_pgn(headers: Dict[str, str], moves: List[str], result: str = '*', fen: str = None) -> str:
+    """
+    Write a game as PGN, the moves being in SAN
+
+    :param headers:
+    :param moves:
+    :param result:
+    :param fen: The starting position, if it isn't the usual one
+    :return:
+    """
+    headers = dict(headers)
+    headers['Result'] = result
+    if fen is not None and fen != START_FEN:
+        headers.update({'SetUp': '1', 'FEN': fen})
+    game_data = load_fen(fen or START_FEN)
+    number, turn = game_data['count'], game_data['turn']
+
+    tokens = []
+    for san in moves:
+        if turn == 0:
+            tokens.append(f'{number}.')
+        elif not tokens:
+            tokens.append(f'{number}...')
+        tokens.append(san)
+        if turn == 1:
+            number += 1
+        turn = 1 - turn
+    tokens.append(result)
+
+    lines, line = [], ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    lines.append(line)
+
+    tags = '\n'.join(f'[{key} "{value}"]' for key, value in headers.items())
+    return f'{tags}\n\n' + '\n'.join(lines) + '\n\n'
+
+
+def replay_file(path: str, emit: str = 'hash', limit: int = None) -> Dict[str, int | float]:
+    """
+    Replay every game of a PGN file, return the number of games, plies and errors and the games per second
+
+    :param path:
+    :param emit:
+    :param limit: Maximum number of games
+    :return:
+    """
+    stats = {'games': 0, 'plies': 0, 'errors': 0}
+    start = perf_counter()
+    with open(path, encoding='utf-8', errors='replace') as file:
+        for game in read_games(file):
+            try:
+                for _ in replay(game, emit):
+                    stats['plies'] += 1
+            except SyntaxError:
+                stats['errors'] += 1
+            stats['games'] += 1
+            if limit is not None and stats['games'] >= limit:
+                break
+    stats['time'] = perf_counter() - start
+    stats['games_per_sec'] = stats['games'] / stats['time'] if stats['time'] > 0 else 0.
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay the games of a PGN file')
+    parser.add_argument('file')
+    parser.add_argument('--emit', choices=('hash', 'fen', 'none'), default='hash')
+    parser.add_argument('--limit', type=int, help='Maximum number of games')
+    args = parser.parse_args()
+
+    result = replay_file(args.file, None if args.emit == 'none' else args.emit, args.limit)
+    print(f'{result["games"]} games, {result["plies"]} plies, {result["errors"]} errors in {result["time"]:.2f}s')
+    print(f'{result["games_per_sec"]:.1f} games/s, {result["plies"] / max(result["time"], 1e-9):.0f} plies/s')
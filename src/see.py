@@ -0,0 +1,115 @@
+"""
+Static exchange evaluation, the material won by a capture once every capture on its tile is played, from the least
+valuable attacker, without making any move on the board
+"""
+from typing import List, Dict, Tuple
+from src.util import pieces_values
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+Attacker = Tuple[int, Position, Tuple[int, int] | None]  # value, position, direction from the tile (None for knights)
+
+DIAGONALS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+LINES = ((1, 0), (0, -1), (0, 1), (-1, 0))
+KNIGHT_JUMPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+
+def piece_value(piece: int) -> int:
+    return abs(pieces_values[piece])
+
+
+def slider_behind(board: Board, position: Position, direction: Tuple[int, int]) -> Tuple[int, Position] | None:
+    """
+    The first piece after the position in the direction, if it is a slider moving along it
+
+    :param board:
+    :param position:
+    :param direction: (dx, dy)
+    :return: The piece and its position, or None
+    """
+    dx, dy = direction
+    i, j = position[0] + dx, position[1] + dy
+    while 0 <= i < 8 and 0 <= j < 8:
+        piece = board[i][j]
+        if piece is not None:
+            if piece in ((3, 5, 9, 11) if dx != 0 and dy != 0 else (4, 5, 10, 11)):
+                return piece, (i, j)
+            return None
+        i, j = i + dx, j + dy
+    return None
+
+
+def get_attackers(board: Board, position: Position) -> Tuple[List[Attacker], List[Attacker]]:
+    """
+    The pieces attacking the tile directly, the white ones and the black ones
+    The pieces behind them (x-rays) are found by see when the ones in front are used
+
+    :param board:
+    :param position:
+    :return:
+    """
+    x, y = position
+    attackers = ([], [])
+    for dx, dy in KNIGHT_JUMPS:
+        i, j = x + dx, y + dy
+        if 0 <= i < 8 and 0 <= j < 8 and board[i][j] in (2, 8):
+            attackers[board[i][j] > 6].append((piece_value(board[i][j]), (i, j), None))
+
+    for directions, sliders in ((DIAGONALS, (3, 5, 9, 11)), (LINES, (4, 5, 10, 11))):
+        for dx, dy in directions:
+            i, j = x + dx, y + dy
+            while 0 <= i < 8 and 0 <= j < 8:
+                piece = board[i][j]
+                if piece is not None:
+                    # Kings and pawns only attack the tiles next to them, pawns diagonally towards the other side
+                    if piece in sliders or (i - x, j - y) == (dx, dy) and (
+                            piece in (6, 12) or (dy != 0 and (piece == 1 and dx == 1 or piece == 7 and dx == -1))):
+                        attackers[piece > 6].append((piece_value(piece), (i, j), (dx, dy)))
+                    break
+                i, j = i + dx, j + dy
+    return attackers
+
+
+def see(board: Board, pos1: Position, pos2: Position) -> int:
+    """
+    The material won by the capture from pos1 to pos2 (negative if it loses some), each side being free to stop
+    capturing, with the values of pieces_values. Pins and checks are ignored
+
+    :param board:
+    :param pos1:
+    :param pos2:
+    :return:
+    """
+    piece = board[pos1[0]][pos1[1]]
+    captured = board[pos2[0]][pos2[1]]
+    if captured is None:  # Only a pawn can capture an empty tile, en-passant
+        captured = 7 if piece == 1 else 1
+    attackers = get_attackers(board, pos2)
+    color = 0 if piece <= 6 else 1
+    attacker = next((attacker for attacker in attackers[color] if attacker[1] == pos1), None)
+
+    gains = [piece_value(captured)]
+    on_tile = piece_value(piece)
+    while True:
+        # The piece that just captured reveals the slider behind it, if it was on a line with the tile
+        if attacker is not None:
+            attackers[color].remove(attacker)
+            if attacker[2] is not None:
+                behind = slider_behind(board, attacker[1], attacker[2])
+                if behind is not None:
+                    attackers[behind[0] > 6].append((piece_value(behind[0]), behind[1], attacker[2]))
+
+        # The other side recaptures with its least valuable attacker
+        color = 1 - color
+        if not attackers[color]:
+            break
+        attacker = min(attackers[color])
+        gains.append(on_tile - gains[-1])
+        on_tile = attacker[0]
+
+    # Each side only recaptures if it gains something
+    while len(gains) > 1:
+        last = gains.pop()
+        gains[-1] = -max(-gains[-1], last)
+    return gains[0]
@@ -0,0 +1,207 @@
+"""
+Headless self-play, to generate labelled positions for the tuning of the evaluation
+The games start with random moves, then the bot plays both sides with a shallow search in a process pool
+Each position is written straight into preallocated memory-mapped shards (.npy files, that np.load can map), and a
+manifest records how many rows of them are written, so that an interrupted generation resumes where it stopped
+"""
+import os
+import json
+import random
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from time import perf_counter
+from typing import List, Dict, Tuple
+from src.util import load_fen
+from src.state import GameState
+from src.engine import Engine
+from src.match import position_key, is_insufficient_material
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+Manifest = Dict[str, int | List[Dict[str, str | int]]]
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+# A row per position: the piece ids of the 64 tiles (0 for empty), the side to move, the search score (for white) and
+# the final result of the game (1 if white won, 0 for a draw, -1 if black won)
+POSITION = np.dtype([('board', np.int8, 64), ('turn', np.int8), ('score', np.float32), ('result', np.int8)])
+RESULTS = {'1-0': 1, '0-1': -1, '1/2-1/2': 0}
+MANIFEST = 'manifest.json'
+
+_engines: Dict[Tuple[int, int | None], Engine] = {}
+
+
+def play_selfplay_game(args: Tuple[int, int, int | None, int, int]) -> np.ndarray:
+    """
+    Run in a worker process, play a game and return its positions, the ones of the random opening excluded
+
+    :param args: The seed of the opening, the dept and node limit of the searches, the number of random plies and the
+    maximum number of plies, the game being a draw after it
+    :return: POSITION rows
+    """
+    seed, dept, node_limit, random_plies, max_plies = args
+    if (dept, node_limit) not in _engines:
+        _engines[dept, node_limit] = Engine('selfplay', dept, node_limit=node_limit, memory=16 << 20)
+    engine = _engines[dept, node_limit]
+    engine.new_game()
+
+    state = GameState(load_fen(START_FEN))
+    rng = random.Random(seed)
+    for _ in range(random_plies):
+        if state.result() is not None:
+            return np.empty(0, dtype=POSITION)
+        state.play(*rng.choice(sorted(state.legal_set)))
+
+    positions = np.zeros(max_plies, dtype=POSITION)
+    repetitions, count, result = {}, 0, None
+    while count < max_plies:
+        over = state.result()
+        if over is not None:
+            result = over[0]
+            break
+        game_data = state.game_data
+        key = position_key(game_data)
+        repetitions[key] = repetitions.get(key, 0) + 1
+        if repetitions[key] >= 3 or is_insufficient_material(state.board):
+            break
+
+        search = engine.play(game_data)
+        row = positions[count]
+        row['board'] = [piece or 0 for line in state.board for piece in line]
+        row['turn'] = state.turn
+        row['score'] = search['value']
+        count += 1
+        state.play(*search['move'])
+
+    positions = positions[:count]
+    positions['result'] = RESULTS.get(result, 0)  # Repetitions, insufficient material and long games are draws
+    return positions
+
+
+class ShardWriter:
+    """
+    Appends positions to the shards of a directory, a new shard being preallocated when the last one is full
+    The manifest is only updated by commit, after the shards are flushed, so the rows it counts are always written
+    """
+
+    def __init__(self, directory: str, shard_size: int = 1 << 20):
+        """
+        :param directory: Created if needed, resumed if it has a manifest
+        :param shard_size: Rows per shard, for a new directory
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as file:
+                self.manifest: Manifest = json.load(file)
+        else:
+            self.manifest = {'shard_size': shard_size, 'games': 0, 'positions': 0, 'shards': []}
+        self.shard = None
+        if self.manifest['shards']:
+            self.shard = np.lib.format.open_memmap(self.shard_path(len(self.manifest['shards']) - 1), mode='r+')
+
+    def shard_path(self, index: int) -> str:
+        return os.path.join(self.directory, f'shard-{index:05}.npy')
+
+    def write(self, positions: np.ndarray):
+        """
+        :param positions: POSITION rows
+        :return:
+        """
+        shards = self.manifest['shards']
+        while len(positions) > 0:
+            if self.shard is None or shards[-1]['rows'] == len(self.shard):
+                if self.shard is not None:
+                    self.shard.flush()
+                shards.append({'file': os.path.basename(self.shard_path(len(shards))), 'rows': 0})
+                self.shard = np.lib.format.open_memmap(self.shard_path(len(shards) - 1), mode='w+', dtype=POSITION,
+                                                       shape=(self.manifest['shard_size'], ))
+            start = shards[-1]['rows']
+            count = min(len(positions), len(self.shard) - start)
+            self.shard[start:start + count] = positions[:count]
+            shards[-1]['rows'] += count
+            self.manifest['positions'] += count
+            positions = positions[count:]
+
+    def commit(self, games: int = 1):
+        """
+        Flush the shards, then count the games in the manifest, replaced atomically
+
+        :param games: Number of games written since the last commit
+        :return:
+        """
+        if self.shard is not None:
+            self.shard.flush()
+        self.manifest['games'] += games
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.manifest, file)
+        os.replace(path + '.tmp', path)
+
+
+def load_shards(directory: str) -> np.ndarray:
+    """
+    The positions written in the shards of a directory, the single shard is only mapped, several ones are concatenated
+
+    :param directory:
+    :return: POSITION rows
+    """
+    with open(os.path.join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+    arrays = [np.load(os.path.join(directory, shard['file']), mmap_mode='r')[:shard['rows']]
+              for shard in manifest['shards']]
+    if len(arrays) == 0:
+        return np.empty(0, dtype=POSITION)
+    return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+
+def generate(directory: str, games: int, workers: int = None, dept: int = 2, node_limit: int = None,
+             random_plies: int = 8, max_plies: int = 300, shard_size: int = 1 << 20, seed: int = 0) -> Manifest:
+    """
+    Play games and write their positions to the shards of the directory, resuming after the games already written
+    The opening of the n-th game of a directory is seeded with seed + n, so a resumed generation plays the same games
+
+    :param directory:
+    :param games: Number of games to add
+    :param workers: Number of processes, the number of CPUs if None
+    :param dept: Of the searches
+    :param node_limit: Per move
+    :param random_plies: Random moves played at the start of each game
+    :param max_plies: After the random ones, the game is a draw after it
+    :param shard_size: Rows per shard, for a new directory
+    :param seed:
+    :return: The manifest
+    """
+    writer = ShardWriter(directory, shard_size)
+    first, written = writer.manifest['games'], writer.manifest['positions']
+    jobs = [(seed + index, dept, node_limit, random_plies, max_plies) for index in range(first, first + games)]
+    start = perf_counter()
+    with Pool(workers) as pool:
+        for done, positions in enumerate(pool.imap(play_selfplay_game, jobs), 1):
+            writer.write(positions)
+            writer.commit()
+            if done % 10 == 0 or done == games:
+                elapsed = perf_counter() - start
+                print(f'{first + done} games, {writer.manifest["positions"]} positions, '
+                      f'{(writer.manifest["positions"] - written) / elapsed:.1f} positions/s')
+    return writer.manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate labelled positions by self-play, resumable')
+    parser.add_argument('directory')
+    parser.add_argument('--games', type=int, default=100, help='Number of games to add')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--dept', type=int, default=2)
+    parser.add_argument('--nodes', type=int, default=None, help='Node limit per move')
+    parser.add_argument('--random-plies', type=int, default=8)
+    parser.add_argument('--max-plies', type=int, default=300)
+    parser.add_argument('--shard-size', type=int, default=1 << 20, help='Rows per shard')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    result = generate(args.directory, args.games, args.workers, args.dept, args.nodes, args.random_plies,
+                      args.max_plies, args.shard_size, args.seed)
+    print(f'{result["games"]} games, {result["positions"]} positions in {len(result["shards"])} shards')
@@ -0,0 +1,330 @@
+"""
+Local asyncio game server, many games at once over a line-based TCP protocol
+The bot turns are run by a shared pool of worker processes
+
+Client commands, one per line:
+    NEW <white|black> [fen]     Start a game where the client plays the given color
+    MOVE <id> <move>            Play a move like e2e4
+    MOVES <id>                  List the legal moves
+    STATE <id>                  Show the game state
+    METRICS                     Show the server metrics, as JSON
+    QUIT
+Server replies:
+    GAME <id> <color>, MOVED <id> <move>, BOT <id> <move>, MOVES <id> <moves...>, STATE <id> <turn> <moves...>,
+    END <id> <result> <reason>, METRICS <json>, ERR <message>
+A game whose bot turn fails ends with END <id> * bot-error
+"""
+import argparse
+import asyncio
+import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import count
+from time import perf_counter
+from typing import List, Dict, Tuple
+from src.util import load_fen, coords_to_position, position_to_coords
+from src.moves import get_all_legal_moves, make_move_smooth, is_in_check
+from src.engine import Engine
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+# Times a bot turn is retried on a new pool after its worker process died, a turn that kills it again ends the game
+MAX_POOL_RETRIES = 1
+
+
+# The engines of a worker process, by settings, their caches are kept between the moves
+_engines: Dict[Tuple[int, int | None, int], Engine] = {}
+
+
+def bot_move(game_data: GameData, dept: int, time_limit: float, node_limit: int = None,
+             memory: int = 32 << 20) -> Tuple[str, int, int]:
+    """
+    Run in a worker process, return the bot move, the number of searched nodes and the peak memory of the engine caches
+
+    :param game_data:
+    :param dept:
+    :param time_limit:
+    :param node_limit:
+    :param memory: Byte budget of the engine caches
+    :return:
+    """
+    key = (dept, node_limit, memory)
+    if key not in _engines:
+        _engines[key] = Engine('bot', dept, node_limit=node_limit, memory=memory)
+    engine = _engines[key]
+    engine.time_limit = time_limit
+    nodes = engine.stats['nodes']
+    pos1, pos2 = engine.play(game_data)['move']
+    return position_to_coords(pos1) + position_to_coords(pos2), engine.stats['nodes'] - nodes, \
+        engine.stats['peak_memory']
+
+
+def percentile(values: List[float], p: float) -> float:
+    if len(values) == 0:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class Game:
+    """
+    The in-memory state of a game, with its cached legal moves
+    """
+
+    def __init__(self, game_id: int, fen: str, human: int, writer: asyncio.StreamWriter, bot_budget: float):
+        self.id = game_id
+        self.game_data = load_fen(fen)
+        self.human = human
+        self.writer = writer
+        self.bot_budget = bot_budget  # Remaining thinking time of the bot, in seconds
+        self.halfmove = self.game_data['count_b']
+        self.result = None
+        self.pool_failures = 0  # Of the current bot turn
+        self.legal_moves = set()
+        self.update_legal_moves()
+
+    def update_legal_moves(self):
+        data = self.game_data
+        all_legal_moves = get_all_legal_moves(data['board'], data['turn'], data['en_passant'], data['castles'])
+        self.legal_moves = {position_to_coords(piece_pos) + position_to_coords(move)
+                            for piece_pos in all_legal_moves for move in all_legal_moves[piece_pos]}
+
+    def play(self, move: str):
+        """
+        Play a move, assuming it is legal, and check if the game is over
+
+        :param move:
+        :return:
+        """
+        data, board = self.game_data, self.game_data['board']
+        pos1, pos2 = coords_to_position(move[:2]), coords_to_position(move[2:4])
+        if board[pos2[0]][pos2[1]] is not None or board[pos1[0]][pos1[1]] in (1, 7):
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        new_data = make_move_smooth(board, pos1, pos2, data['en_passant'], data['castles'])
+        data.update({'castles': new_data['castles'], 'en_passant': new_data['en_passant'], 'turn': 1 - data['turn']})
+        self.update_legal_moves()
+
+        if len(self.legal_moves) == 0:
+            if is_in_check(board, data['turn']):
+                self.result = ('0-1' if data['turn'] == 0 else '1-0', 'checkmate')
+            else:
+                self.result = ('1/2-1/2', 'stalemate')
+        elif self.halfmove >= 100:
+            self.result = ('1/2-1/2', 'fifty moves')
+
+
+class GameServer:
+    """
+    Host the games, and dispatch the bot turns to the worker pool in first-come first-served order
+    Since a game has at most one pending bot turn, no game can starve the others
+    Finished games are kept until their client disconnects
+    """
+
+    def __init__(self, workers: int = 2, dept: int = 3, move_time: float = 1., game_budget: float = 60.,
+                 node_limit: int = None, memory: int = 32 << 20):
+        """
+        :param workers: Number of worker processes
+        :param dept: Maximum depth of the bot searches
+        :param move_time: Maximum time of a bot move, in seconds
+        :param game_budget: Total bot thinking time of a game, in seconds
+        :param node_limit: Maximum nodes of a bot move
+        :param memory: Byte budget of the caches of each worker
+        """
+        self.workers = workers
+        self.dept = dept
+        self.move_time = move_time
+        self.game_budget = game_budget
+        self.node_limit = node_limit
+        self.memory = memory
+        self.peak_memory = 0  # Of the caches of a worker
+        self.games: Dict[int, Game] = {}
+        self.ids = count(1)
+        self.queue: asyncio.Queue | None = None
+        self.pool: ProcessPoolExecutor | None = None
+        self.latencies: List[float] = []  # Of the bot moves, from the request to the reply
+        self.finished_games, self.failed_games, self.nodes, self.start = 0, 0, 0, perf_counter()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765):
+        self.queue = asyncio.Queue()
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.start = perf_counter()
+        dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f'Serving on {host}:{port} with {self.workers} workers')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in dispatchers:
+                task.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+    async def dispatch(self):
+        """
+        Worker loop, take the oldest pending bot turn and run it in the pool
+
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            game, requested = await self.queue.get()
+            pool = self.pool
+            try:
+                if game.result is not None or game.id not in self.games:
+                    continue
+                # The per-game budget is split so that the bot can always play about 20 more moves
+                time_limit = max(0.05, min(self.move_time, game.bot_budget / 20))
+                start = perf_counter()
+                move, nodes, peak_memory = await loop.run_in_executor(pool, bot_move, game.game_data, self.dept,
+                                                                      time_limit, self.node_limit, self.memory)
+                game.pool_failures = 0
+                game.bot_budget -= perf_counter() - start
+                self.nodes += nodes
+                self.peak_memory = max(self.peak_memory, peak_memory)
+                self.latencies.append(perf_counter() - requested)
+                if len(self.latencies) > 10000:
+                    del self.latencies[:5000]
+                game.play(move)
+                await self.send(game.writer, f'BOT {game.id} {move}')
+                await self.check_end(game)
+            except ConnectionError:
+                self.games.pop(game.id, None)
+            except BrokenProcessPool:
+                # A worker process died, the pool can't run anything anymore, the first dispatcher to notice replaces it
+                if self.pool is pool:
+                    print(f'Worker process died during a bot turn of game {game.id}, restarting the pool')
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = ProcessPoolExecutor(self.workers)
+                game.pool_failures += 1
+                if game.pool_failures <= MAX_POOL_RETRIES:
+                    self.queue.put_nowait((game, requested))
+                else:
+                    await self.fail_game(game)
+            except Exception:
+                print(f'Bot turn of game {game.id} failed:')
+                traceback.print_exc()
+                await self.fail_game(game)
+            finally:
+                self.queue.task_done()
+
+    async def fail_game(self, game: Game):
+        """
+        End a game whose bot turn can't be played, so that its client doesn't wait for the move
+
+        :param game:
+        :return:
+        """
+        game.result = ('*', 'bot-error')
+        self.failed_games += 1
+        try:
+            await self.send(game.writer, f'END {game.id} * bot-error')
+        except ConnectionError:
+            self.games.pop(game.id, None)
+
+    async def send(self, writer: asyncio.StreamWriter, line: str):
+        writer.write((line + '\n').encode())
+        await writer.drain()
+
+    async def check_end(self, game: Game):
+        if game.result is not None:
+            self.finished_games += 1
+            await self.send(game.writer, f'END {game.id} {game.result[0]} {game.result[1]}')
+
+    def request_bot_turn(self, game: Game):
+        if game.result is None and game.game_data['turn'] != game.human:
+            self.queue.put_nowait((game, perf_counter()))
+
+    def metrics(self) -> Dict[str, int | float]:
+        elapsed = perf_counter() - self.start
+        return {
+            'games': sum(1 for game in self.games.values() if game.result is None),
+            'finished_games': self.finished_games,
+            'failed_games': self.failed_games,
+            'games_per_sec': self.finished_games / elapsed if elapsed > 0 else 0.,
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'p50_move_latency': percentile(self.latencies, 50),
+            'p99_move_latency': percentile(self.latencies, 99),
+            'nodes_per_sec': self.nodes / elapsed if elapsed > 0 else 0.,
+            'worker_peak_memory': self.peak_memory,
+        }
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        owned = set()
+        try:
+            while line := await reader.readline():
+                parts = line.decode().split()
+                if len(parts) == 0:
+                    continue
+                command, args = parts[0].upper(), parts[1:]
+                if command == 'QUIT':
+                    break
+                await self.handle_command(command, args, writer, owned)
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in owned:
+                self.games.pop(game_id, None)
+            writer.close()
+
+    async def handle_command(self, command: str, args: List[str], writer: asyncio.StreamWriter, owned: set):
+        if command == 'METRICS':
+            return await self.send(writer, f'METRICS {json.dumps(self.metrics())}')
+        if command == 'NEW':
+            if len(args) == 0 or args[0] not in ('white', 'black'):
+                return await self.send(writer, 'ERR usage: NEW <white|black> [fen]')
+            try:
+                game = Game(next(self.ids), ' '.join(args[1:]) or START_FEN, 0 if args[0] == 'white' else 1, writer,
+                            self.game_budget)
+            except (SyntaxError, ValueError, KeyError, IndexError):
+                return await self.send(writer, 'ERR invalid FEN')
+            self.games[game.id] = game
+            owned.add(game.id)
+            await self.send(writer, f'GAME {game.id} {args[0]}')
+            return self.request_bot_turn(game)
+
+        if len(args) == 0 or not args[0].isdigit() or int(args[0]) not in owned or int(args[0]) not in self.games:
+            return await self.send(writer, 'ERR unknown game')
+        game = self.games[int(args[0])]
+        if command == 'MOVES':
+            await self.send(writer, f'MOVES {game.id} {" ".join(sorted(game.legal_moves))}')
+        elif command == 'STATE':
+            await self.send(writer, f'STATE {game.id} {"white" if game.game_data["turn"] == 0 else "black"} '
+                                    f'{" ".join(sorted(game.legal_moves))}')
+        elif command == 'MOVE':
+            if game.result is not None:
+                await self.send(writer, f'ERR {game.id} game over')
+            elif game.game_data['turn'] != game.human:
+                await self.send(writer, f'ERR {game.id} not your turn')
+            elif len(args) < 2 or args[1] not in game.legal_moves:
+                await self.send(writer, f'ERR {game.id} illegal move')
+            else:
+                game.play(args[1])
+                await self.send(writer, f'MOVED {game.id} {args[1]}')
+                await self.check_end(game)
+                self.request_bot_turn(game)
+        else:
+            await self.send(writer, 'ERR unknown command')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host chess games against the bot')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--move-time', type=float, default=1.)
+    parser.add_argument('--game-budget', type=float, default=60.)
+    parser.add_argument('--nodes', type=int, default=None, help='Node limit of a bot move')
+    parser.add_argument('--memory', type=int, default=32, help='Memory budget of the caches of each worker, in MiB')
+    args = parser.parse_args()
+    try:
+        asyncio.run(GameServer(args.workers, args.dept, args.move_time, args.game_budget, args.nodes,
+                               args.memory << 20).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print('\n\nBye, have a nice day!')
@@ -0,0 +1,289 @@
+"""
+Lazy SMP, helper processes search the same root with slightly different depths and orders, sharing a transposition
+table in shared memory, and the best completed result is kept
+The table is written without locks, each entry is checked by xoring its words so that a torn one is ignored
+"""
+import os
+import queue
+import struct
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+from time import perf_counter
+from typing import List, Dict, Tuple
+from src.util import load_fen, position_to_coords
+from src.bot import SearchConfig, SearchStats, SearchResult, DEFAULT_CONFIG, search, new_stats, format_pv
+from src.bench import SUITE
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+Move = Tuple[Position, Position]
+Entry = Tuple[int, float, int, Move | None]  # dept, value, flag, best move
+
+# An entry is 3 words, the check, the data (move, flag and dept) and the bits of the value
+ENTRY = struct.Struct('<QQQ')
+VALUE = struct.Struct('<d')
+BITS = struct.Struct('<Q')
+# The move is 0 for None, else 1 + from * 64 + to on its 13 first bits, followed by the flag and the dept
+MOVE_BITS, FLAG_BITS = 13, 2
+# Seconds between two checks of the helpers that are still expected to put their result
+RESULT_POLL = .1
+
+
+def encode_move(move: Move | None) -> int:
+    if move is None:
+        return 0
+    (x1, y1), (x2, y2) = move
+    return 1 + ((x1 * 8 + y1) << 6 | x2 * 8 + y2)
+
+
+def decode_move(code: int) -> Move | None:
+    if code == 0:
+        return None
+    code -= 1
+    return (code >> 9, code >> 6 & 7), (code >> 3 & 7, code & 7)
+
+
+class SharedTranspositionTable:
+    """
+    TranspositionTable stored in a shared memory block, that every process attached to it reads and writes
+    The check word of an entry is key ^ data ^ value bits, an entry mixing the words of two writes fails it
+    The counters are the ones of the current process
+    """
+
+    ENTRY_BYTES = ENTRY.size
+
+    def __init__(self, size: int = 1 << 16, name: str = None):
+        """
+        :param size: Number of entries
+        :param name: Of the block to attach to, a new one is created if None, and unlinked by unlink
+        """
+        self.size = size
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size * self.ENTRY_BYTES)
+        else:
+            # The processes started by the owner share its resource tracker, so the block is only unlinked once
+            self.shm = shared_memory.SharedMemory(name)
+        self.name = self.shm.name
+        self.stats = {'probes': 0, 'hits': 0, 'stores': 0}
+
+    def __getstate__(self):
+        return {'size': self.size, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['size'], state['name'])
+
+    @classmethod
+    def from_bytes(cls, budget: int) -> 'SharedTranspositionTable':
+        """
+        The largest table that fits in the budget
+
+        :param budget: In bytes
+        :return:
+        """
+        return cls(max(1, budget // cls.ENTRY_BYTES))
+
+    def memory(self) -> int:
+        """
+        The whole block is allocated when created
+
+        :return:
+        """
+        return self.size * self.ENTRY_BYTES
+
+    def hashfull(self) -> int:
+        """
+        Permille of the used entries, estimated on the first thousand ones since no process counts them all
+        An entry is used if any of its words is set, the data of a depth 0 entry without move can be 0
+
+        :return:
+        """
+        sample = min(1000, self.size)
+        used = sum(any(ENTRY.unpack_from(self.shm.buf, index * self.ENTRY_BYTES)) for index in range(sample))
+        return used * 1000 // sample
+
+    def probe(self, key: int) -> Entry | None:
+        """
+        Return the entry of the position, or None, see TranspositionTable.probe
+
+        :param key: The position hash
+        :return:
+        """
+        self.stats['probes'] += 1
+        check, data, bits = ENTRY.unpack_from(self.shm.buf, key % self.size * self.ENTRY_BYTES)
+        if check ^ data ^ bits != key:  # Another position, or a torn entry
+            return None
+        self.stats['hits'] += 1
+        return data >> MOVE_BITS + FLAG_BITS, VALUE.unpack(BITS.pack(bits))[0], \
+            data >> MOVE_BITS & (1 << FLAG_BITS) - 1, decode_move(data & (1 << MOVE_BITS) - 1)
+
+    def store(self, key: int, dept: int, value: float, flag: int, move: Move | None):
+        """
+        See TranspositionTable.store
+
+        :param key:
+        :param dept:
+        :param value:
+        :param flag:
+        :param move:
+        :return:
+        """
+        offset = key % self.size * self.ENTRY_BYTES
+        check, data, bits = ENTRY.unpack_from(self.shm.buf, offset)
+        if check ^ data ^ bits == key and data >> MOVE_BITS + FLAG_BITS > dept:
+            return
+        data = dept << MOVE_BITS + FLAG_BITS | flag << MOVE_BITS | encode_move(move)
+        bits = BITS.unpack(VALUE.pack(value))[0]
+        ENTRY.pack_into(self.shm.buf, offset, key ^ data ^ bits, data, bits)
+        self.stats['stores'] += 1
+
+    def clear(self):
+        self.shm.buf[:self.memory()] = bytes(self.memory())
+        self.stats = {'probes': 0, 'hits': 0, 'stores': 0}
+
+    def hit_rate(self) -> float:
+        return self.stats['hits'] / self.stats['probes'] if self.stats['probes'] > 0 else 0.
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Free the block, by its owner once every process is done with it
+
+        :return:
+        """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def helper(table: SharedTranspositionTable, game_data: GameData, dept: int, config: SearchConfig,
+           time_limit: float | None, node_limit: int | None, seed: int, stop, results):
+    """
+    Search of a helper process, its result and its nodes are put in the results queue
+
+    :param table:
+    :param game_data:
+    :param dept:
+    :param config:
+    :param time_limit:
+    :param node_limit:
+    :param seed: Of the shuffle of its root moves
+    :param stop: Event set by the main process once its own search is done
+    :param results:
+    :return:
+    """
+    stats = new_stats()
+    stats['stop'] = stop
+    result = search(game_data, dept, config, stats, time_limit, tt=table, node_limit=node_limit, seed=seed)
+    results.put((seed, result, stats['nodes']))
+    table.close()
+
+
+def smp_search(game_data: GameData, dept: int, workers: int = None, config: SearchConfig = None,
+               stats: SearchStats = None, time_limit: float = None, table: SharedTranspositionTable = None,
+               node_limit: int = None) -> SearchResult:
+    """
+    Lazy SMP search, see src.bot.search for the result
+    The main process searches the root like search does, every other worker searches it in its own process with its
+    root moves shuffled, the odd ones one ply deeper. They only cooperate through the shared table
+    Once the main search is done the helpers are stopped, and the result of the deepest completed search is kept,
+    the main one on ties. A helper that dies without its result (an exception, a kill) is skipped
+
+    :param game_data:
+    :param dept:
+    :param workers: Number of processes, the cpu count if None
+    :param config:
+    :param stats: Its nodes are the ones of every process
+    :param time_limit: In seconds
+    :param table: Shared transposition table, a new one of the config size is created and freed if None
+    :param node_limit: Per process
+    :return:
+    """
+    if config is None:
+        config = DEFAULT_CONFIG
+    if stats is None:
+        stats = new_stats()
+    if workers is None:
+        workers = os.cpu_count()
+    owned = table is None
+    if owned:
+        table = SharedTranspositionTable(config.tt_size)
+
+    stop, results = multiprocessing.Event(), multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=helper, args=(
+        table, game_data, dept + seed % 2, config, time_limit, node_limit, seed, stop, results), daemon=True)
+        for seed in range(1, workers)]
+    for process in processes:
+        process.start()
+
+    try:
+        best = search(game_data, dept, config, stats, time_limit, tt=table, node_limit=node_limit)
+        stop.set()
+        pending = dict(zip(range(1, workers), processes))
+        while pending:
+            try:
+                seed, result, nodes = results.get(timeout=RESULT_POLL)
+            except queue.Empty:
+                # A helper that exited normally has put its result, it is on its way, the other ones never will
+                for seed, process in list(pending.items()):
+                    if process.exitcode not in (None, 0):
+                        del pending[seed]
+                continue
+            del pending[seed]
+            stats['nodes'] += nodes
+            if result['dept'] > best['dept'] and result['move'] is not None:
+                best = result
+        for process in processes:
+            process.join()
+    finally:
+        stop.set()
+        if owned:
+            table.unlink()
+    return best
+
+
+def measure_scaling(dept: int, max_workers: int, suite: List[str] = None) -> List[Dict[str, int | float]]:
+    """
+    Time-to-depth of the suite from 1 to max_workers processes, printing a line per number of workers
+
+    :param dept:
+    :param max_workers:
+    :param suite:
+    :return:
+    """
+    rows = []
+    for workers in range(1, max_workers + 1):
+        nodes, start = 0, perf_counter()
+        for fen in suite or SUITE:
+            stats = new_stats()
+            smp_search(load_fen(fen), dept, workers, stats=stats)
+            nodes += stats['nodes']
+        elapsed = perf_counter() - start
+        rows.append({'workers': workers, 'time': elapsed, 'nodes': nodes, 'speedup': rows[0]['time'] / elapsed
+                     if rows else 1., 'nodes_per_sec': nodes / elapsed})
+        print(f'{workers:>2} workers: {elapsed:>8.2f}s {nodes:>9} nodes {nodes / elapsed:>9.0f} nodes/s '
+              f'speedup {rows[-1]["speedup"]:.2f}x')
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lazy SMP search, or its scaling on the bench suite')
+    parser.add_argument('fen', nargs='?', default=None, help='Search this position instead of measuring the scaling')
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes, at most')
+    args = parser.parse_args()
+
+    if args.fen is None:
+        print(f'{os.cpu_count()} cores')
+        measure_scaling(args.dept, args.workers)
+    else:
+        search_stats = new_stats()
+        start_time = perf_counter()
+        search_result = smp_search(load_fen(args.fen), args.dept, args.workers, stats=search_stats)
+        print(f'move {position_to_coords(search_result["move"][0]) + position_to_coords(search_result["move"][1])}, '
+              f'value {search_result["value"]}, dept {search_result["dept"]}, pv {format_pv(search_result["pv"])}')
+        print(f'{search_stats["nodes"]} nodes in {perf_counter() - start_time:.2f}s')
@@ -0,0 +1,313 @@
+"""
+Game state of the interactive front ends, that keeps its legal moves up to date incrementally
+Only the pieces whose moves may change after a move are regenerated
+"""
+from typing import List, Dict, Tuple, Set
+from src.moves import get_moves, make_move_smooth, get_all_legal_moves, is_square_attacked
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+Move = Tuple[Position, Position]
+
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+DIAGONALS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+LINES = ((1, 0), (0, -1), (0, 1), (-1, 0))
+
+
+def get_dependencies(board: Board, position: Position) -> Tuple[List[Position], List[Position]]:
+    """
+    Return the tiles attacked by the piece, defended ones included, and the tiles its pawn pushes go through
+    The moves of a piece only depend on the content of these tiles (and on the castles and en-passant)
+
+    :param board:
+    :param position:
+    :return:
+    """
+    x, y = position
+    piece = board[x][y]
+    kind = piece - 6 if piece >= 7 else piece
+    attacks, pushes = [], []
+
+    if kind == 1:
+        fact = -1 if piece < 7 else 1
+        if 0 <= x + fact < 8:
+            pushes.append((x + fact, y))
+            if (x == 6 and fact == -1) or (x == 1 and fact == 1):
+                pushes.append((x + fact * 2, y))
+            for j in (y - 1, y + 1):
+                if 0 <= j < 8:
+                    attacks.append((x + fact, j))
+    elif kind == 2 or kind == 6:
+        for dx, dy in (KNIGHT_STEPS if kind == 2 else KING_STEPS):
+            i, j = x + dx, y + dy
+            if 0 <= i < 8 and 0 <= j < 8:
+                attacks.append((i, j))
+    else:
+        directions = DIAGONALS if kind == 3 else LINES if kind == 4 else DIAGONALS + LINES
+        for dx, dy in directions:
+            i, j = x + dx, y + dy
+            while 0 <= i < 8 and 0 <= j < 8:
+                attacks.append((i, j))
+                if board[i][j] is not None:
+                    break
+                i, j = i + dx, j + dy
+
+    return attacks, pushes
+
+
+class GameState:
+    """
+    A game with its pseudo-legal moves, per-tile attack maps and legal moves cached
+    After a move, only the pieces on the changed tiles, the ones looking at them (sliders on a ray through them,
+    knights, kings and pawns around) and the kings that can still castle are regenerated
+    The king safety is then checked only for the king moves, the pinned pieces, en-passants and when in check
+    """
+
+    def __init__(self, game_data: GameData, debug: bool = False):
+        """
+        :param game_data: Copied, the state has its own board
+        :param debug: Cross-check the legal moves with a full regeneration after every move
+        """
+        self.board = [row.copy() for row in game_data['board']]
+        self.turn = game_data['turn']
+        self.en_passant = game_data['en_passant']
+        self.castles = game_data['castles'].copy()
+        self.count_b = game_data.get('count_b', 0)
+        self.count = game_data.get('count', 1)
+        self.debug = debug
+
+        self.moves: Dict[Position, List[Position]] = {}  # Pseudo-legal moves of every piece, of both players
+        self.dependencies: Dict[Position, Tuple[List[Position], List[Position]]] = {}
+        self.attacks: List[List[Set[Position]]] = [[set() for _ in range(8)] for _ in range(8)]  # Attackers of a tile
+        self.pushes: List[List[Set[Position]]] = [[set() for _ in range(8)] for _ in range(8)]  # Pawns pushing through
+        self.kings = [None, None]
+        self.legal_moves: Dict[Position, List[Position]] = {}
+        self.legal_set: Set[Move] = set()
+        self.in_check = False
+
+        for i in range(8):
+            for j in range(8):
+                if self.board[i][j] is not None:
+                    self.add_piece((i, j))
+        self.update_legal_moves()
+
+    @property
+    def game_data(self) -> GameData:
+        return {
+            'board': self.board,
+            'turn': self.turn,
+            'en_passant': self.en_passant,
+            'castles': self.castles,
+            'count_b': self.count_b,
+            'count': self.count
+        }
+
+    def add_piece(self, position: Position):
+        x, y = position
+        piece = self.board[x][y]
+        if piece == 6 or piece == 12:
+            self.kings[0 if piece == 6 else 1] = position
+        attacks, pushes = get_dependencies(self.board, position)
+        for i, j in attacks:
+            self.attacks[i][j].add(position)
+        for i, j in pushes:
+            self.pushes[i][j].add(position)
+        self.dependencies[position] = (attacks, pushes)
+        self.moves[position] = get_moves(self.board, position, self.en_passant, self.castles)
+
+    def remove_piece(self, position: Position):
+        if position not in self.dependencies:
+            return
+        attacks, pushes = self.dependencies.pop(position)
+        for i, j in attacks:
+            self.attacks[i][j].discard(position)
+        for i, j in pushes:
+            self.pushes[i][j].discard(position)
+        del self.moves[position]
+
+    def is_attacked(self, position: Position, player: int) -> bool:
+        """
+        Return whether the given player attacks the tile, from the attack map
+
+        :param position:
+        :param player:
+        :return:
+        """
+        for i, j in self.attacks[position[0]][position[1]]:
+            if (self.board[i][j] < 7) == (player == 0):
+                return True
+        return False
+
+    def is_legal(self, move: Move) -> bool:
+        """
+        O(1), the move is a (from, to) tuple of positions
+
+        :param move:
+        :return:
+        """
+        return move in self.legal_set
+
+    def play(self, pos1: Position, pos2: Position, promotion: int = None):
+        """
+        Play a move, assuming it is legal, and update the legal moves of the next player
+
+        :param pos1:
+        :param pos2:
+        :param promotion: The white id of the promotion piece (2 to 5), a queen if None
+        :return:
+        """
+        board = self.board
+        old_en_passant = self.en_passant
+        if board[pos2[0]][pos2[1]] is not None or board[pos1[0]][pos1[1]] in (1, 7):
+            self.count_b = 0
+        else:
+            self.count_b += 1
+        if self.turn == 1:
+            self.count += 1
+
+        # The tiles changed by the move, the ones of the castling rook and of the en-passant pawn included
+        changed = list(self.lookahead(pos1, pos2))
+        affected = set(changed)
+        for i, j in changed:
+            affected |= self.attacks[i][j]
+            affected |= self.pushes[i][j]
+
+        # The kings that could castle, their castles depend on the whole board
+        for king, rights in zip(self.kings, (('K', 'Q'), ('k', 'q'))):
+            if king is not None and (self.castles[rights[0]] or self.castles[rights[1]]):
+                affected.add(king)
+
+        data = make_move_smooth(board, pos1, pos2, self.en_passant, self.castles, promotion)
+        self.castles, self.en_passant = data['castles'], data['en_passant']
+        self.turn = 1 - self.turn
+
+        # The pawns that could or can now take en-passant
+        for square in (old_en_passant, self.en_passant):
+            if square is not None:
+                affected |= self.attacks[square[0]][square[1]]
+
+        for position in affected:
+            self.remove_piece(position)
+        for position in affected:
+            if board[position[0]][position[1]] is not None:
+                self.add_piece(position)
+
+        self.update_legal_moves()
+
+    def lookahead(self, pos1: Position, pos2: Position) -> List[Position]:
+        """
+        Return the tiles that the move will change
+
+        :param pos1:
+        :param pos2:
+        :return:
+        """
+        board = self.board
+        (x1, y1), (x2, y2) = pos1, pos2
+        piece = board[x1][y1]
+        tiles = [pos1, pos2]
+        if (piece == 1 or piece == 7) and y1 != y2 and board[x2][y2] is None:
+            tiles.append((x1, y2))
+        elif (piece == 6 or piece == 12) and abs(y2 - y1) == 2:
+            tiles += [(x1, 7), (x1, 5)] if y2 > y1 else [(x1, 0), (x1, 3)]
+        return tiles
+
+    def get_pinned(self) -> Set[Position]:
+        """
+        Return the pieces of the player to move that are pinned to their king
+
+        :return:
+        """
+        board, king = self.board, self.kings[self.turn]
+        pinned = set()
+        if king is None:
+            return pinned
+        enemy_offset = 6 if self.turn == 0 else 0
+        for directions, sliders in ((DIAGONALS, (3, 5)), (LINES, (4, 5))):
+            for dx, dy in directions:
+                i, j = king[0] + dx, king[1] + dy
+                blocker = None
+                while 0 <= i < 8 and 0 <= j < 8:
+                    piece = board[i][j]
+                    if piece is not None:
+                        if (piece < 7) == (self.turn == 0):
+                            if blocker is not None:
+                                break
+                            blocker = (i, j)
+                        else:
+                            if blocker is not None and piece - enemy_offset in sliders:
+                                pinned.add(blocker)
+                            break
+                    i, j = i + dx, j + dy
+        return pinned
+
+    def leaves_king_safe(self, pos1: Position, pos2: Position) -> bool:
+        """
+        Try the move in place, the same way get_legal_moves does, and look if the king is attacked
+
+        :param pos1:
+        :param pos2:
+        :return:
+        """
+        board = self.board
+        (x1, y1), (x2, y2) = pos1, pos2
+        piece, taken = board[x1][y1], board[x2][y2]
+        board[x1][y1], board[x2][y2] = None, piece
+        king = pos2 if piece == 6 or piece == 12 else self.kings[self.turn]
+        safe = king is None or not is_square_attacked(board, king, 1 - self.turn)
+        board[x1][y1], board[x2][y2] = piece, taken
+        return safe
+
+    def update_legal_moves(self):
+        """
+        Filter the pseudo-legal moves of the player to move
+        Without check, a move of a piece that is neither the king nor pinned is legal, except en-passants
+
+        :return:
+        """
+        board, king = self.board, self.kings[self.turn]
+        self.in_check = king is not None and self.is_attacked(king, 1 - self.turn)
+        pinned = self.get_pinned()
+        self.legal_moves, self.legal_set = {}, set()
+        for position in sorted(self.moves):
+            piece = board[position[0]][position[1]]
+            if (piece < 7) != (self.turn == 0):
+                continue
+            careful = self.in_check or position == king or position in pinned
+            pawn = piece == 1 or piece == 7
+            moves = [move for move in self.moves[position]
+                     if not (careful or (pawn and move == self.en_passant)) or self.leaves_king_safe(position, move)]
+            if len(moves) > 0:
+                self.legal_moves[position] = moves
+                self.legal_set.update((position, move) for move in moves)
+
+        if self.debug:
+            self.check()
+
+    def check(self):
+        """
+        Compare the legal moves with a full regeneration, raise an AssertionError if they differ
+
+        :return:
+        """
+        expected = get_all_legal_moves(self.board, self.turn, self.en_passant, self.castles)
+        expected_set = {(position, move) for position in expected for move in expected[position]}
+        if expected_set != self.legal_set:
+            raise AssertionError(f'Incremental legal moves differ, missing {expected_set - self.legal_set}, '
+                                 f'extra {self.legal_set - expected_set}')
+
+    def result(self) -> Tuple[str, str] | None:
+        """
+        Return the result and its reason if the game is over, else None
+
+        :return:
+        """
+        if len(self.legal_set) == 0:
+            if self.in_check:
+                return ('0-1' if self.turn == 0 else '1-0'), 'checkmate'
+            return '1/2-1/2', 'stalemate'
+        if self.count_b >= 100:
+            return '1/2-1/2', 'fifty moves'
+        return None
@@ -0,0 +1,155 @@
+"""
+Streaming export of the game tree, the bounded-memory replacement of create_decision_tree
+"""
+import argparse
+import json
+import struct
+from typing import List, Dict, Tuple, Callable, Iterator, BinaryIO, TextIO
+from src.util import evaluate_position, load_fen, position_to_coords
+from src.moves import get_all_legal_moves, make_move_smooth, reverse_moves, is_in_check
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+TreeNode = Dict[str, int | float | str | None]
+MoveFilter = Callable[[Board, Position, Position], bool]
+
+# Binary format: a magic header, then fixed records of id, parent id, depth, from tile, to tile and value
+# The tiles are x * 8 + y, 255 for the root that has no move
+BINARY_MAGIC = b'CTREE1\n'
+BINARY_RECORD = struct.Struct('<iiBBBf')
+NO_TILE = 255
+
+
+class TreeWriter:
+    """
+    Write the nodes one by one, as JSON lines or as binary records
+    """
+
+    def __init__(self, file: TextIO | BinaryIO, binary: bool = False):
+        self.file = file
+        self.binary = binary
+        self.count = 0
+        if binary:
+            file.write(BINARY_MAGIC)
+
+    def write(self, parent: int, dept: int, move: Tuple[Position, Position] | None, value: float) -> int:
+        """
+        Write a node, return its id
+
+        :param parent: -1 for the root
+        :param dept:
+        :param move:
+        :param value:
+        :return:
+        """
+        node_id = self.count
+        self.count += 1
+        if self.binary:
+            if move is None:
+                tile1, tile2 = NO_TILE, NO_TILE
+            else:
+                tile1, tile2 = move[0][0] * 8 + move[0][1], move[1][0] * 8 + move[1][1]
+            self.file.write(BINARY_RECORD.pack(node_id, parent, dept, tile1, tile2, value))
+        else:
+            move_text = 'null' if move is None else f'"{position_to_coords(move[0])}{position_to_coords(move[1])}"'
+            self.file.write(f'{{"id": {node_id}, "parent": {parent}, "dept": {dept}, "move": {move_text}, '
+                            f'"value": {value}}}\n')
+        return node_id
+
+
+def export_tree(game_data: GameData, dept: int, path: str, binary: bool = False, move_filter: MoveFilter = None,
+                min_value: float = None, max_value: float = None) -> int:
+    """
+    Walk the game tree depth-first, making and reversing moves on a single board, and write each node as soon as
+    it is reached, so that the memory used only grows with the depth
+    Return the number of nodes written
+
+    :param game_data:
+    :param dept: Maximum depth
+    :param path:
+    :param binary: Binary records instead of JSON lines
+    :param move_filter: If given, only the moves for which move_filter(board, pos1, pos2) is True are explored
+    :param min_value: Nodes whose value is under it are written but not expanded
+    :param max_value: Nodes whose value is over it are written but not expanded
+    :return:
+    """
+    game_data = {
+        'board': [line.copy() for line in game_data['board']],
+        'turn': game_data['turn'],
+        'en_passant': game_data['en_passant'],
+        'castles': game_data['castles'].copy(),
+    }
+    with open(path, 'wb' if binary else 'w') as file:
+        writer = TreeWriter(file, binary)
+        _export_node(game_data, dept, 0, -1, None, writer, move_filter, min_value, max_value)
+    return writer.count
+
+
+def _export_node(game_data: GameData, dept: int, current_dept: int, parent: int, move: Tuple[Position, Position] | None,
+                 writer: TreeWriter, move_filter: MoveFilter | None, min_value: float | None,
+                 max_value: float | None):
+    board, turn = game_data['board'], game_data['turn']
+    all_legal_moves = get_all_legal_moves(board, turn, game_data['en_passant'], game_data['castles'])
+    if len(all_legal_moves) == 0:
+        value = (-10000 if turn == 0 else 10000) if is_in_check(board, turn) else 0
+    else:
+        value = evaluate_position(board)
+    node_id = writer.write(parent, current_dept, move, value)
+
+    if current_dept >= dept or len(all_legal_moves) == 0:
+        return
+    if (min_value is not None and value < min_value) or (max_value is not None and value > max_value):
+        return
+
+    for piece_pos in all_legal_moves:
+        for target in all_legal_moves[piece_pos]:
+            if move_filter is not None and not move_filter(board, piece_pos, target):
+                continue
+            data = make_move_smooth(board, piece_pos, target, game_data['en_passant'], game_data['castles'].copy())
+            data['turn'] = 1 - turn
+            _export_node(data, dept, current_dept + 1, node_id, (piece_pos, target), writer, move_filter, min_value,
+                         max_value)
+            reverse_moves(board, data['old_tiles'])
+
+
+def read_tree(path: str, binary: bool = False) -> Iterator[TreeNode]:
+    """
+    Read back the nodes written by export_tree, one by one
+
+    :param path:
+    :param binary:
+    :return:
+    """
+    if not binary:
+        with open(path) as file:
+            for line in file:
+                yield json.loads(line)
+        return
+
+    with open(path, 'rb') as file:
+        if file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise SyntaxError('Invalid tree file')
+        while record := file.read(BINARY_RECORD.size):
+            node_id, parent, dept, tile1, tile2, value = BINARY_RECORD.unpack(record)
+            move = None
+            if tile1 != NO_TILE:
+                move = position_to_coords((tile1 // 8, tile1 % 8)) + position_to_coords((tile2 // 8, tile2 % 8))
+            yield {'id': node_id, 'parent': parent, 'dept': dept, 'move': move, 'value': value}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream the game tree of a position to a file')
+    parser.add_argument('fen', nargs='?', default='rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1')
+    parser.add_argument('--dept', type=int, default=3)
+    parser.add_argument('--output', default='tree.jsonl')
+    parser.add_argument('--binary', action='store_true')
+    parser.add_argument('--captures-only', action='store_true', help='Only explore captures')
+    parser.add_argument('--min-value', type=float)
+    parser.add_argument('--max-value', type=float)
+    args = parser.parse_args()
+
+    only_captures = (lambda board, pos1, pos2: board[pos2[0]][pos2[1]] is not None) if args.captures_only else None
+    count = export_tree(load_fen(args.fen), args.dept, args.output, args.binary, only_captures, args.min_value,
+                        args.max_value)
+    print(f'{count} nodes written to {args.output}')
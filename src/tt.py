@@ -0,0 +1,95 @@
+"""
+In-memory transposition table of the search, shared by the iterations and the lines of a search
+"""
+from typing import List, Tuple
+
+Position = Tuple[int, int]
+Move = Tuple[Position, Position]
+Entry = Tuple[int, float, int, Move | None]  # dept, value, flag, best move
+
+# The stored value is the exact score, a lower bound (the node failed high) or an upper bound (it failed low)
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TranspositionTable:
+    """
+    Fixed size table of the searched nodes, indexed by the position hash modulo the size
+    A new entry replaces the one stored at its index, unless it is the same position searched deeper
+    """
+
+    # Bytes of a filled entry, its two list slots, the key and the entry tuple with its value and move
+    ENTRY_BYTES = 320
+    SLOT_BYTES = 16
+
+    def __init__(self, size: int = 1 << 16):
+        """
+        :param size: Number of entries
+        """
+        self.size = size
+        self.keys: List[int | None] = [None] * size
+        self.entries: List[Entry | None] = [None] * size
+        self.stats = {'probes': 0, 'hits': 0, 'stores': 0}
+        self.filled = 0
+
+    @classmethod
+    def from_bytes(cls, budget: int) -> 'TranspositionTable':
+        """
+        The largest table that fits in the budget once full
+
+        :param budget: In bytes
+        :return:
+        """
+        return cls(max(1, budget // cls.ENTRY_BYTES))
+
+    def memory(self) -> int:
+        """
+        Estimation of the bytes used, the empty slots only cost their pointers
+
+        :return:
+        """
+        return self.size * self.SLOT_BYTES + self.filled * (self.ENTRY_BYTES - self.SLOT_BYTES)
+
+    def hashfull(self) -> int:
+        """
+        Permille of the used entries
+
+        :return:
+        """
+        return self.filled * 1000 // self.size
+
+    def probe(self, key: int) -> Entry | None:
+        """
+        Return the entry of the position, or None
+
+        :param key: The position hash
+        :return:
+        """
+        self.stats['probes'] += 1
+        index = key % self.size
+        if self.keys[index] == key:
+            self.stats['hits'] += 1
+            return self.entries[index]
+        return None
+
+    def store(self, key: int, dept: int, value: float, flag: int, move: Move | None):
+        """
+        :param key:
+        :param dept: The remaining depth of the search of the node
+        :param value:
+        :param flag: EXACT, LOWER or UPPER
+        :param move: The best move found, None if there is none
+        :return:
+        """
+        index = key % self.size
+        if self.keys[index] is None:
+            self.filled += 1
+        elif self.keys[index] == key and self.entries[index][0] > dept:
+            return
+        self.keys[index], self.entries[index] = key, (dept, value, flag, move)
+        self.stats['stores'] += 1
+
+    def clear(self):
+        self.__init__(self.size)
+
+    def hit_rate(self) -> float:
+        return self.stats['hits'] / self.stats['probes'] if self.stats['probes'] > 0 else 0.
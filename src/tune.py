@@ -0,0 +1,305 @@
+"""
+Offline Texel tuning of the evaluation tables
+The labelled positions are turned into NumPy feature arrays once, then the piece values and the piece-square tables
+are fitted by gradient descent on the error between the game results and a sigmoid of the evaluation
+The tuned parameters are written to src/params.py, that src/util.py loads at import
+"""
+import os
+import argparse
+import numpy as np
+from time import perf_counter
+from typing import List, Dict, Tuple, Iterable
+from src.fen import parse_fens
+from src.pawns import evaluate_pawn_structure
+from src import util
+
+Dataset = Dict[str, np.ndarray]
+
+RESULTS = {'1-0': 1., '0-1': 0., '1/2-1/2': .5}
+TABLES = ['pawn_table', 'knight_table', 'bishop_table', 'rook_table', 'queen_table', 'king_table',
+          'king_endgame_table']
+# Parameters: the values of the pawn, knight, bishop, rook and queen, then the 64 tiles of every table
+TABLES_OFFSET = 5
+PARAMETERS = TABLES_OFFSET + 64 * len(TABLES)
+KING_TABLE = TABLES_OFFSET + 64 * 5
+KING_ENDGAME_TABLE = TABLES_OFFSET + 64 * 6
+CHUNK = 1 << 17  # Rows per vectorized block, bounds the temporary arrays
+
+# By piece id, the empty tile being 0
+KINDS = np.array([-1, 0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 4, 5], dtype=np.int16)
+SIGNS = np.array([0, 1, 1, 1, 1, 1, 1, -1, -1, -1, -1, -1, -1], dtype=np.int8)
+PHASES = np.array(util.phase_weights, dtype=np.int16)
+
+
+def split_label(line: str) -> Tuple[str, float] | None:
+    """
+    Split a labelled line into its FEN and the game result from the white point of view
+    Both 'fen [1.0]' or 'fen "1-0"' lines and EPDs with a c9 "1-0" opcode are understood
+
+    :param line:
+    :return: None if the line has no result
+    """
+    line = line.strip()
+    if line.endswith(']') and '[' in line:
+        fen, _, label = line[:-1].rpartition('[')
+        return fen.strip(), float(label)
+    if 'c9' in line:
+        fen, _, label = line.partition('c9')
+        label = label.strip().rstrip(';').strip().strip('"')
+        return fen.strip().rstrip(';'), RESULTS[label]
+    for result in RESULTS:
+        if line.endswith(result) or line.endswith(f'"{result}"') or line.endswith(f'"{result}";'):
+            return line[:line.rindex(result)].rstrip().rstrip('"').strip(), RESULTS[result]
+    return None
+
+
+def get_parameters() -> np.ndarray:
+    """
+    Return the current parameters of the evaluation as a vector, the starting point of the tuning
+
+    :return:
+    """
+    theta = np.zeros(PARAMETERS + 1)  # The last one is always 0, used by the empty tiles
+    theta[:TABLES_OFFSET] = util.pieces_values[1:6]
+    for t, name in enumerate(TABLES):
+        theta[TABLES_OFFSET + t * 64:TABLES_OFFSET + (t + 1) * 64] = np.array(getattr(util, name)).ravel()
+    return theta
+
+
+def build_features(boards: np.ndarray) -> Dataset:
+    """
+    Turn boards into sparse feature arrays
+    Every tile gives a signed index into the parameters (the king ones excepted) and the material counts are dense,
+    the kings have their middlegame and endgame tables weighted by the game phase
+
+    :param boards: (n, 64) piece ids, 0 for empty tiles
+    :return:
+    """
+    n = len(boards)
+    kinds, signs = KINDS[boards], SIGNS[boards]
+    tiles = np.arange(64, dtype=np.int16)
+    # The black pieces read the tables upside down, like in evaluate_position
+    tiles = np.where(signs < 0, tiles ^ 56, tiles)
+    pieces = (kinds >= 0) & (kinds < 5)
+    indexes = np.where(pieces, TABLES_OFFSET + kinds * 64 + tiles, PARAMETERS).astype(np.int16)
+    counts = np.stack([((kinds == kind) * signs).sum(1) for kind in range(5)], 1).astype(np.int8)
+
+    phase = np.minimum(PHASES[boards].sum(1), util.MAX_PHASE) / util.MAX_PHASE
+    white_king, black_king = (boards == 6).argmax(1), (boards == 12).argmax(1) ^ 56
+    king_indexes = np.stack([KING_TABLE + white_king, KING_ENDGAME_TABLE + white_king,
+                             KING_TABLE + black_king, KING_ENDGAME_TABLE + black_king], 1).astype(np.int16)
+    king_weights = np.stack([phase, 1 - phase, -phase, phase - 1], 1).astype(np.float32)
+
+    return {'counts': counts, 'indexes': indexes, 'signs': np.where(pieces, signs, 0).astype(np.int8),
+            'king_indexes': king_indexes, 'king_weights': king_weights, 'offsets': np.zeros(n, dtype=np.float32)}
+
+
+def pawn_offsets(boards: np.ndarray) -> np.ndarray:
+    """
+    The pawn structure terms are not tuned, they are a constant part of every evaluation
+    Computed once per distinct pawn structure
+
+    :param boards:
+    :return:
+    """
+    pawns = np.where((boards == 1) | (boards == 7), boards, 0)
+    offsets, structures = np.empty(len(boards), dtype=np.float32), {}
+    for k, row in enumerate(pawns):
+        key = row.tobytes()
+        if key not in structures:
+            board = [[piece or None for piece in row[i * 8:(i + 1) * 8].tolist()] for i in range(8)]
+            structures[key] = evaluate_pawn_structure(board)
+        offsets[k] = structures[key]
+    return offsets
+
+
+def load_positions(path: str) -> Dataset:
+    """
+    Load a labelled position set, one position per line, a dataset saved by save_positions (.npz) or a directory of
+    self-play shards (see src.selfplay)
+
+    :param path:
+    :return:
+    """
+    if os.path.isdir(path):
+        from src.selfplay import load_shards
+
+        positions = load_shards(path)
+        return boards_to_dataset(positions['board'].astype(np.uint8), (positions['result'] + 1) / 2)
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return dict(data)
+    with open(path) as file:
+        return positions_to_dataset(file)
+
+
+def positions_to_dataset(lines: Iterable[str]) -> Dataset:
+    fens, results = [], []
+    for line in lines:
+        labelled = split_label(line)
+        if labelled is not None:
+            fens.append(labelled[0])
+            results.append(labelled[1])
+    batch = parse_fens(fens)
+    return boards_to_dataset(np.frombuffer(bytes(batch['boards']), dtype=np.uint8).reshape(-1, 64), results)
+
+
+def boards_to_dataset(boards: np.ndarray, results: np.ndarray | List[float]) -> Dataset:
+    """
+    :param boards: (n, 64) piece ids, 0 for empty tiles
+    :param results: 1 if white won, 0.5 for a draw, 0 if black won
+    :return:
+    """
+    data = build_features(boards)
+    data['offsets'] = pawn_offsets(boards)
+    data['results'] = np.asarray(results, dtype=np.float32)
+    return data
+
+
+def save_positions(data: Dataset, path: str):
+    np.savez(path, **data)
+
+
+def evaluate(theta: np.ndarray, data: Dataset, start: int = 0, stop: int = None) -> np.ndarray:
+    """
+    Vectorized evaluate_position of the positions from start to stop
+
+    :param theta:
+    :param data:
+    :param start:
+    :param stop:
+    :return:
+    """
+    rows = slice(start, stop)
+    values = data['counts'][rows] @ theta[:TABLES_OFFSET]
+    values += (theta[data['indexes'][rows]] * data['signs'][rows]).sum(1)
+    values += (theta[data['king_indexes'][rows]] * data['king_weights'][rows]).sum(1)
+    return values + data['offsets'][rows]
+
+
+def sigmoid(values: np.ndarray, scale: float) -> np.ndarray:
+    # A pawn is worth 10, so 10 ** (-scale * centipawns / 400) becomes 10 ** (-scale * values / 40)
+    return 1 / (1 + np.power(10., -scale * values / 40))
+
+
+def loss_and_gradient(theta: np.ndarray, data: Dataset, scale: float,
+                      gradient: bool = True) -> Tuple[float, np.ndarray]:
+    """
+    Mean squared error between the results and the predictions, and its gradient
+
+    :param theta:
+    :param data:
+    :param scale:
+    :param gradient: Skip the gradient computation if False
+    :return:
+    """
+    n = len(data['results'])
+    total, grad = 0., np.zeros(PARAMETERS + 1)
+    for start in range(0, n, CHUNK):
+        stop = min(n, start + CHUNK)
+        prediction = sigmoid(evaluate(theta, data, start, stop), scale)
+        error = data['results'][start:stop] - prediction
+        total += float(error @ error)
+        if not gradient:
+            continue
+        # d(error ** 2) / d(value)
+        g = -2 * error * prediction * (1 - prediction) * scale * np.log(10) / 40 / n
+        grad[:TABLES_OFFSET] += data['counts'][start:stop].T @ g
+        grad += np.bincount(data['indexes'][start:stop].ravel(), (data['signs'][start:stop] * g[:, None]).ravel(),
+                            PARAMETERS + 1)
+        grad += np.bincount(data['king_indexes'][start:stop].ravel(),
+                            (data['king_weights'][start:stop] * g[:, None]).ravel(), PARAMETERS + 1)
+    grad[PARAMETERS] = 0
+    return total / n, grad
+
+
+def fit_scale(theta: np.ndarray, data: Dataset) -> float:
+    """
+    The sigmoid scale that best fits the current evaluation, found by a narrowing grid search
+
+    :param theta:
+    :param data:
+    :return:
+    """
+    low, high = 0.05, 5.
+    for _ in range(4):
+        scales = np.linspace(low, high, 11)
+        losses = [loss_and_gradient(theta, data, scale, False)[0] for scale in scales]
+        best = int(np.argmin(losses))
+        step = scales[1] - scales[0]
+        low, high = max(1e-3, scales[best] - step), scales[best] + step
+    return float(scales[best])
+
+
+def tune(data: Dataset, epochs: int = 200, learning_rate: float = 0.05, scale: float = None,
+         theta: np.ndarray = None) -> Tuple[np.ndarray, List[float]]:
+    """
+    Fit the parameters with Adam, one step per epoch over all the positions
+
+    :param data:
+    :param epochs:
+    :param learning_rate:
+    :param scale: Fitted on the starting parameters if None
+    :param theta: The current evaluation parameters if None
+    :return: The parameters and the loss of every epoch
+    """
+    theta = get_parameters() if theta is None else theta.copy()
+    scale = fit_scale(theta, data) if scale is None else scale
+    m, v, losses = np.zeros_like(theta), np.zeros_like(theta), []
+    beta1, beta2 = 0.9, 0.999
+    for epoch in range(1, epochs + 1):
+        loss, grad = loss_and_gradient(theta, data, scale)
+        losses.append(loss)
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        theta -= learning_rate * (m / (1 - beta1 ** epoch)) / (np.sqrt(v / (1 - beta2 ** epoch)) + 1e-12)
+        theta[PARAMETERS] = 0
+    return theta, losses
+
+
+def write_parameters(theta: np.ndarray, path: str = 'src/params.py', comment: str = ''):
+    """
+    Generate the parameters module, plain lists so that loading it costs nothing more than the hand-written tables
+
+    :param theta:
+    :param path:
+    :param comment: Added to the module docstring
+    :return:
+    """
+    values = [round(float(value), 2) for value in theta[:TABLES_OFFSET]]
+    lines = ['"""', 'Evaluation parameters generated by src.tune, do not edit', comment, '"""', '',
+             f'pieces_values = [None, {", ".join(map(str, values))}, 900, '
+             f'{", ".join(str(-value) for value in values)}, -900]', '']
+    for t, name in enumerate(TABLES):
+        table = theta[TABLES_OFFSET + t * 64:TABLES_OFFSET + (t + 1) * 64].reshape(8, 8)
+        lines.append(f'{name} = [')
+        lines += [f'    [{", ".join(str(round(float(value), 2)) for value in row)}],' for row in table]
+        lines += [']', '']
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune the evaluation tables on labelled positions')
+    parser.add_argument('positions', help='Lines like "<fen> [1.0]" or EPDs with a c9 result, or a saved .npz')
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--learning-rate', type=float, default=0.05)
+    parser.add_argument('--scale', type=float, default=None, help='Sigmoid scale, fitted if not given')
+    parser.add_argument('--save', default=None, help='Save the feature arrays to this .npz to skip the parsing')
+    parser.add_argument('--output', default='src/params.py')
+    args = parser.parse_args()
+
+    start = perf_counter()
+    dataset = load_positions(args.positions)
+    print(f'{len(dataset["results"])} positions loaded in {perf_counter() - start:.1f}s')
+    if args.save is not None:
+        save_positions(dataset, args.save)
+
+    start = perf_counter()
+    parameters, history = tune(dataset, args.epochs, args.learning_rate, args.scale)
+    elapsed = perf_counter() - start
+    print(f'Loss {history[0]:.6f} -> {history[-1]:.6f}, {args.epochs} epochs in {elapsed:.1f}s '
+          f'({elapsed / args.epochs:.2f}s per epoch)')
+    write_parameters(parameters, args.output,
+                     f'Tuned on {len(dataset["results"])} positions from {args.positions}, loss {history[-1]:.6f}')
+    print(f'Parameters written to {args.output}')
@@ -0,0 +1,252 @@
+"""
+Make and unmake moves on a board with a preallocated undo stack, for the search
+Unlike make_move_smooth and reverse_moves, no dict is created per move and the position hash is updated incrementally
+"""
+from types import MappingProxyType
+from typing import List, Dict, Tuple
+from src.fen import CASTLES_BITS
+from src.zobrist import piece_keys, turn_key, castles_keys, en_passant_keys, hash_game_data
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+GameData = Dict[str, Board | int | str | Position | Dict[str, bool]]
+
+# A record is 8 ints in a flat list: from, to, moved piece, captured piece (None for none, and -1 as from for a null
+# move), then the castles mask, en-passant tile (-1 for none), halfmove clock and hash from before the move
+RECORD_SIZE = 8
+
+# The castles dicts and en-passant positions are shared, indexed by castles mask and tile (-1 is None)
+# The dicts are read-only proxies, a make_move_smooth on them raises instead of changing them for the whole process
+CASTLES_DICTS = [MappingProxyType({castle: mask & bit != 0 for castle, bit in CASTLES_BITS.items()})
+                 for mask in range(16)]
+CASTLES_HASHES = [0] * 16
+for _mask in range(16):
+    for _castle, _bit in CASTLES_BITS.items():
+        if _mask & _bit:
+            CASTLES_HASHES[_mask] ^= castles_keys[_castle]
+EN_PASSANT_POSITIONS = [(tile >> 3, tile & 7) for tile in range(64)] + [None]
+
+# The castles kept when a piece leaves a tile, and when a piece lands on it, like in make_move_smooth
+KEEP_FROM, KEEP_TO = [15] * 64, [15] * 64
+for _tile, _castles in ((0, 'q'), (7, 'k'), (56, 'Q'), (63, 'K'), (4, 'kq'), (60, 'KQ')):
+    KEEP_FROM[_tile] = 15 & ~sum(CASTLES_BITS[castle] for castle in _castles)
+for _tile, _castles in ((0, 'q'), (7, 'k'), (56, 'Q'), (63, 'K')):
+    KEEP_TO[_tile] = 15 & ~CASTLES_BITS[_castles]
+
+
+def castles_to_mask(castles: Dict[str, bool]) -> int:
+    mask = 0
+    for castle, bit in CASTLES_BITS.items():
+        if castles[castle]:
+            mask |= bit
+    return mask
+
+
+class UndoStack:
+    """
+    The board of a game data, with the state that a move changes and the records needed to take the moves back
+    The game data dict is kept up to date in place, its castles and en-passant being the shared read-only values, so
+    it should be a game data of the stack only (a deep copy), which nothing else moves on
+    """
+
+    def __init__(self, game_data: GameData, size: int = 256):
+        """
+        :param game_data: Its board is moved on, and its turn, castles and en-passant are updated
+        :param size: Preallocated records, the stack grows if a line is longer
+        """
+        self.game_data = game_data
+        self.board = game_data['board']
+        self.turn = game_data['turn']
+        self.castles = castles_to_mask(game_data['castles'])
+        en_passant = game_data['en_passant']
+        self.en_passant = -1 if en_passant is None else en_passant[0] * 8 + en_passant[1]
+        self.halfmove = game_data.get('count_b', 0)
+        self.hash = hash_game_data(game_data)
+        self.records = [0] * (size * RECORD_SIZE)
+        self.top = 0
+        game_data['castles'] = CASTLES_DICTS[self.castles]
+        game_data['en_passant'] = EN_PASSANT_POSITIONS[self.en_passant]
+
+    def __len__(self):
+        return self.top // RECORD_SIZE
+
+    def push(self, tile1: int, tile2: int, piece: int, captured: int | None):
+        records, top = self.records, self.top
+        if top == len(records):
+            records.extend([0] * len(records))
+        records[top] = tile1
+        records[top + 1] = tile2
+        records[top + 2] = piece
+        records[top + 3] = captured
+        records[top + 4] = self.castles
+        records[top + 5] = self.en_passant
+        records[top + 6] = self.halfmove
+        records[top + 7] = self.hash
+        self.top = top + RECORD_SIZE
+
+    def make(self, pos1: Position, pos2: Position, promotion: int = None):
+        """
+        Make a move, assuming it is legal, see make_move_smooth
+
+        :param pos1:
+        :param pos2:
+        :param promotion: The white id of the promotion piece (2 to 5), a queen if None
+        :return:
+        """
+        board, game_data = self.board, self.game_data
+        x1, y1 = pos1
+        x2, y2 = pos2
+        tile1, tile2 = x1 * 8 + y1, x2 * 8 + y2
+        piece, captured = board[x1][y1], board[x2][y2]
+        castles, key = self.castles, self.hash
+
+        # The record, written inline since a call costs as much as the rest
+        records, top = self.records, self.top
+        if top == len(records):
+            records.extend([0] * len(records))
+        records[top:top + RECORD_SIZE] = tile1, tile2, piece, captured, castles, self.en_passant, self.halfmove, key
+        self.top = top + RECORD_SIZE
+
+        key ^= piece_keys[piece][tile1] ^ turn_key
+        if captured is not None:
+            key ^= piece_keys[captured][tile2]
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        board[x1][y1] = None
+
+        landing = piece
+        en_passant = -1
+        if piece == 1 or piece == 7:
+            self.halfmove = 0
+            if y1 != y2 and captured is None:  # En-passant
+                key ^= piece_keys[board[x1][y2]][x1 * 8 + y2]
+                board[x1][y2] = None
+            elif x2 - x1 == 2 or x1 - x2 == 2:
+                en_passant = tile1 + tile2 >> 1
+            if x2 == 0 or x2 == 7:
+                landing = piece + (promotion or 5) - 1
+        elif (piece == 6 or piece == 12) and (y2 - y1 == 2 or y1 - y2 == 2):  # Castles, the rook moves too
+            rook_from, rook_to = (7, 5) if y2 > y1 else (0, 3)
+            rook = board[x1][rook_from]
+            board[x1][rook_to], board[x1][rook_from] = rook, None
+            key ^= piece_keys[rook][x1 * 8 + rook_from] ^ piece_keys[rook][x1 * 8 + rook_to]
+        board[x2][y2] = landing
+        key ^= piece_keys[landing][tile2]
+
+        if castles:
+            new_castles = castles & KEEP_FROM[tile1] & KEEP_TO[tile2]
+            if new_castles != castles:
+                key ^= CASTLES_HASHES[castles] ^ CASTLES_HASHES[new_castles]
+                self.castles = new_castles
+                game_data['castles'] = CASTLES_DICTS[new_castles]
+        if self.en_passant >= 0:
+            key ^= en_passant_keys[self.en_passant & 7]
+            if en_passant < 0:
+                game_data['en_passant'] = None
+        if en_passant >= 0:
+            key ^= en_passant_keys[en_passant & 7]
+            game_data['en_passant'] = EN_PASSANT_POSITIONS[en_passant]
+        self.en_passant = en_passant
+
+        self.hash = key
+        self.turn = game_data['turn'] = 1 - self.turn
+
+    def make_null(self):
+        """
+        Pass the turn, for null-move pruning
+
+        :return:
+        """
+        self.push(-1, -1, 0, None)
+        key = self.hash ^ turn_key
+        if self.en_passant >= 0:
+            key ^= en_passant_keys[self.en_passant & 7]
+            self.en_passant = -1
+            self.game_data['en_passant'] = None
+        self.hash = key
+        self.turn = self.game_data['turn'] = 1 - self.turn
+
+    def unmake(self):
+        """
+        Take back the last move, null moves included
+
+        :return:
+        """
+        records, game_data = self.records, self.game_data
+        top = self.top = self.top - RECORD_SIZE
+        tile1, tile2, piece, captured, castles, en_passant, self.halfmove, self.hash = records[top:top + RECORD_SIZE]
+        if tile1 >= 0:
+            board = self.board
+            x1, y1, x2, y2 = tile1 >> 3, tile1 & 7, tile2 >> 3, tile2 & 7
+            board[x1][y1] = piece
+            board[x2][y2] = captured
+            if (piece == 1 or piece == 7) and y1 != y2 and captured is None:  # En-passant
+                board[x1][y2] = 7 if piece == 1 else 1
+            elif (piece == 6 or piece == 12) and (y2 - y1 == 2 or y1 - y2 == 2):
+                rook_from, rook_to = (7, 5) if y2 > y1 else (0, 3)
+                board[x1][rook_from], board[x1][rook_to] = board[x1][rook_to], None
+
+        if castles != self.castles:
+            self.castles = castles
+            game_data['castles'] = CASTLES_DICTS[castles]
+        if en_passant != self.en_passant:
+            self.en_passant = en_passant
+            game_data['en_passant'] = EN_PASSANT_POSITIONS[en_passant]
+        self.turn = game_data['turn'] = 1 - self.turn
+
+
+if __name__ == '__main__':
+    import argparse
+    from time import perf_counter
+    from copy import deepcopy
+    from src.util import load_fen
+    from src.moves import get_all_legal_moves, make_move_smooth, reverse_moves
+    from src.bench import SUITE
+
+    parser = argparse.ArgumentParser(description='Compare make/unmake pairs per second with the undo stack and with '
+                                                 'make_move_smooth/reverse_moves')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    positions = []
+    for fen in SUITE:
+        data = load_fen(fen)
+        moves = get_all_legal_moves(data['board'], data['turn'], data['en_passant'], data['castles'])
+        positions.append((data, [(piece_pos, move) for piece_pos in moves for move in moves[piece_pos]]))
+    pairs = args.repeat * sum(len(moves) for _, moves in positions)
+
+    start = perf_counter()
+    for data, moves in positions:
+        board, en_passant, castles = data['board'], data['en_passant'], data['castles']
+        for _ in range(args.repeat):
+            for pos1, pos2 in moves:
+                reverse_moves(board, make_move_smooth(board, pos1, pos2, en_passant, castles.copy())['old_tiles'])
+    old = perf_counter() - start
+
+    # The search also needs the hash of every node, for the transposition table
+    start = perf_counter()
+    for data, moves in positions:
+        board, en_passant, castles = data['board'], data['en_passant'], data['castles']
+        for _ in range(args.repeat):
+            for pos1, pos2 in moves:
+                new_data = make_move_smooth(board, pos1, pos2, en_passant, castles.copy())
+                new_data['turn'] = 1 - data['turn']
+                hash_game_data(new_data)
+                reverse_moves(board, new_data['old_tiles'])
+    old_hashed = perf_counter() - start
+
+    start = perf_counter()
+    for data, moves in positions:
+        stack = UndoStack(deepcopy(data))
+        make, unmake = stack.make, stack.unmake
+        for _ in range(args.repeat):
+            for pos1, pos2 in moves:
+                make(pos1, pos2)
+                unmake()
+    new = perf_counter() - start
+
+    print(f'make_move_smooth/reverse_moves:                 {pairs / old:,.0f} pairs/s')
+    print(f'make_move_smooth/reverse_moves + hash_game_data: {pairs / old_hashed:,.0f} pairs/s')
+    print(f'UndoStack make/unmake, incremental hash:         {pairs / new:,.0f} pairs/s '
+          f'({old / new:.2f}x, {old_hashed / new:.2f}x with the hash)')
@@ -2,6 +2,9 @@
 Useful things
 """
 from typing import List, Dict, Tuple
+from src.zobrist import piece_keys
+from src.pawns import PawnHashTable, pawn_hash as default_pawn_hash, DOUBLED_PAWN, ISOLATED_PAWN, PASSED_PAWN
+from src.evalcache import EvalCache
 
 Board = List[List[int]]
 Position = Tuple[int, int]
@@ -84,6 +87,33 @@ king_table = [
     [2.0, 3.0, 1.0, 0.0, 0.0, 1.0, 3.0, 2.0]
 ]
 
+# In endgames the king has to come in the center
+king_endgame_table = [
+    [-5.0, -4.0, -3.0, -2.0, -2.0, -3.0, -4.0, -5.0],
+    [-3.0, -2.0, -1.0, 0.0, 0.0, -1.0, -2.0, -3.0],
+    [-3.0, -1.0, 2.0, 3.0, 3.0, 2.0, -1.0, -3.0],
+    [-3.0, -1.0, 3.0, 4.0, 4.0, 3.0, -1.0, -3.0],
+    [-3.0, -1.0, 3.0, 4.0, 4.0, 3.0, -1.0, -3.0],
+    [-3.0, -1.0, 2.0, 3.0, 3.0, 2.0, -1.0, -3.0],
+    [-3.0, -3.0, 0.0, 0.0, 0.0, 0.0, -3.0, -3.0],
+    [-5.0, -3.0, -3.0, -3.0, -3.0, -3.0, -3.0, -5.0]
+]
+
+# Game phase, from 24 with all the pieces to 0 with only kings and pawns
+phase_weights = [0, 0, 1, 1, 2, 4, 0, 0, 1, 1, 2, 4, 0]
+MAX_PHASE = 24
+
+# The values and tables tuned by src.tune replace the hand-picked ones above, if they were generated
+try:
+    from src.params import (pieces_values, pawn_table, knight_table, bishop_table, rook_table, queen_table,
+                            king_table, king_endgame_table)
+except ImportError:
+    pass
+
+# Everything the evaluation depends on, so that analyses made with other parameters can be told apart
+EVALUATION_PARAMETERS = (pieces_values, pawn_table, knight_table, bishop_table, rook_table, queen_table, king_table,
+                         king_endgame_table, phase_weights, DOUBLED_PAWN, ISOLATED_PAWN, PASSED_PAWN)
+
 
 def draw_matrix(mat: List[List[any]], src: Dict[any, any]) -> None:
     """
@@ -111,44 +141,14 @@ def draw_board(board: Board):
 
 def load_fen(string: str) -> GameData:
     """
-    Load a fen format
+    Load a fen format, see src.fen.parse_fen
 
     :param string:
     :return:
     """
-    board, last = [[]], None
-    for i in range(len(string)):
-        e = string[i]
-        if e == ' ':
-            last = string[i + 1:]
-            break
-        if e.isdigit():
-            board[-1].extend([None] * int(e))
-        elif e == '/':
-            board.append([])
-        else:
-            board[-1].append(pieces_ids[e])
-    if last is None:
-        raise SyntaxError('Invalid FEN')
-
-    parts = last.split(' ')
-    if len(parts) != 5:
-        raise SyntaxError('Invalid FEN')
-
-    turn, castles, en_passant, count_b, count = parts
-    return {
-        'board': board,
-        'turn': 0 if turn == 'w' else 1,
-        'castles': {
-            'Q': 'Q' in castles,
-            'K': 'K' in castles,
-            'q': 'q' in castles,
-            'k': 'k' in castles,
-        },
-        'en_passant': coords_to_position(en_passant) if en_passant != '-' else None,
-        'count_b': int(count_b),
-        'count': int(count),
-    }
+    from src.fen import parse_fen
+
+    return parse_fen(string)
 
 
 def coords_to_position(coords: str) -> Position:
@@ -184,22 +184,34 @@ def input_valid_coords(text):
     return coords
 
 
-def evaluate_position(board: Board):
+def evaluate_position(board: Board, pawn_hash: PawnHashTable = None, eval_cache: EvalCache = None, key: int = None):
     """
     Evaluate the board position
     Negative is good for black, positive is good for white
+    The king tables are blended depending on the remaining pieces, and the pawn structure comes from the pawn hash
 
     :param board:
+    :param pawn_hash: The shared pawn hash table if None
+    :param eval_cache: Checked first and filled, if the key is given
+    :param key: The position hash of the board
     :return:
     """
-    total = 0
+    if eval_cache is not None and key is not None:
+        value = eval_cache.probe(key)
+        if value is not None:
+            return value
+
+    total, phase, pawn_key = 0, 0, 0
+    white_king = black_king = None
     for i in range(8):
         for j in range(8):
             if board[i][j] is not None:
                 total += pieces_values[board[i][j]]
+                phase += phase_weights[board[i][j]]
                 match board[i][j]:
                     case 1:
                         total += pawn_table[i][j]
+                        pawn_key ^= piece_keys[1][i * 8 + j]
                     case 2:
                         total += knight_table[i][j]
                     case 3:
@@ -209,9 +221,10 @@ def evaluate_position(board: Board):
                     case 5:
                         total += queen_table[i][j]
                     case 6:
-                        total += king_table[i][j]
+                        white_king = (i, j)
                     case 7:
                         total -= pawn_table[7 - i][j]
+                        pawn_key ^= piece_keys[7][i * 8 + j]
                     case 8:
                         total -= knight_table[7 - i][j]
                     case 9:
@@ -221,8 +234,20 @@ def evaluate_position(board: Board):
                     case 11:
                         total -= queen_table[7 - i][j]
                     case 12:
-                        total -= king_table[7 - i][j]
-
+                        black_king = (i, j)
+
+    # Tapered king tables
+    phase = min(phase, MAX_PHASE)
+    if white_king is not None:
+        i, j = white_king
+        total += (king_table[i][j] * phase + king_endgame_table[i][j] * (MAX_PHASE - phase)) / MAX_PHASE
+    if black_king is not None:
+        i, j = 7 - black_king[0], black_king[1]
+        total -= (king_table[i][j] * phase + king_endgame_table[i][j] * (MAX_PHASE - phase)) / MAX_PHASE
+
+    total += (pawn_hash or default_pawn_hash).probe(board, pawn_key)
+    if eval_cache is not None and key is not None:
+        eval_cache.store(key, total)
     return total
 
 
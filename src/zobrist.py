@@ -0,0 +1,51 @@
+"""
+Zobrist hashing of the positions
+"""
+import random
+from typing import List, Dict, Tuple
+
+Board = List[List[int]]
+Position = Tuple[int, int]
+
+# Seeded, so that the hashes are the same in every process and across sessions
+_random = random.Random(0x5EED)
+
+# piece_keys[piece][x * 8 + y], the index 0 is unused since pieces ids start at 1
+piece_keys = [[_random.getrandbits(64) for _ in range(64)] for _ in range(13)]
+turn_key = _random.getrandbits(64)
+castles_keys = {castle: _random.getrandbits(64) for castle in 'KQkq'}
+en_passant_keys = [_random.getrandbits(64) for _ in range(8)]  # By column
+
+
+def hash_position(board: Board, turn: int, en_passant: Position | None, castles: Dict[str, bool]) -> int:
+    """
+    Return the 64 bits hash of the position
+
+    :param board:
+    :param turn:
+    :param en_passant:
+    :param castles:
+    :return:
+    """
+    key = turn_key if turn == 1 else 0
+    for i in range(8):
+        line = board[i]
+        for j in range(8):
+            if line[j] is not None:
+                key ^= piece_keys[line[j]][i * 8 + j]
+    for castle in castles:
+        if castles[castle]:
+            key ^= castles_keys[castle]
+    if en_passant is not None:
+        key ^= en_passant_keys[en_passant[1]]
+    return key
+
+
+def hash_game_data(game_data: Dict) -> int:
+    """
+    hash_position but from a game data
+
+    :param game_data:
+    :return:
+    """
+    return hash_position(game_data['board'], game_data['turn'], game_data['en_passant'], game_data['castles'])